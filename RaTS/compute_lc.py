@@ -5,62 +5,39 @@ import os
 import glob
 import argparse
 import warnings
+import multiprocessing
 from tqdm import tqdm
-from astropy import units as u 
-from astropy.coordinates import SkyCoord, CartesianRepresentation
-from scipy.special import binom
-import scipy.interpolate as interpolate
-import matplotlib.pyplot as plt
-from matplotlib import ticker, colors
-
-def observing_strategy(obs_setup, det_threshold, nobs, obssens, obssig, obsinterval, obsdurations):
+# astropy, scipy and matplotlib take seconds to import, so they are only imported by the sky geometry, interpolation and
+# plotting functions that use them
+
+def observing_strategy(obs_setup, det_threshold, nobs, obssens, obssig, obsinterval, obsdurations, rng=None):
     """Parse observation file or set up trial mode. Return array of observation info and a regions observed"""
 
-    rng = np.random.default_rng()
-    start_epoch = datetime.datetime(1858, 11, 17, 00, 00, 00, 00)
+    rng = np.random.default_rng(rng)
     if obs_setup is not None:
-        tstart, tend, sens, ra, dec, gapsfile,fov  = np.loadtxt(obs_setup, unpack=True, delimiter = ',',
-            dtype={'names': ('start', 'end','sens', 'ra', 'dec','gaps', 'fov'), 'formats': ('U32','U32','f8','f8','f8','<U128','f8')})
-        tstart = np.array([(datetime.datetime.strptime(t, "%Y-%m-%dT%H:%M:%S.%f+00:00") - start_epoch).total_seconds()/3600/24 for t in tstart])
-        tend = np.array([(datetime.datetime.strptime(t, "%Y-%m-%dT%H:%M:%S.%f+00:00") - start_epoch).total_seconds()/3600/24 for t in tend])
-        tdur = tend - tstart
-        sortkey = np.argsort(tstart)
-        obs = np.zeros(len(tstart),
+        schedule = read_schedule(obs_setup)
+        obs = np.zeros(len(schedule),
               dtype={'names': ('start', 'duration','sens','gaps'), 'formats': ('f8','f8','f8','<U128')})
-        obs['start']=tstart[sortkey]
-        obs['duration']=tdur[sortkey]
-        obs['sens']+=sens[sortkey]*det_threshold
-        obs['gaps']=gapsfile[sortkey]
-        pointing = np.array([np.array([r,d,f]) for r,d,f in zip(ra[sortkey],dec[sortkey],fov[sortkey])])
+        obs['start']=schedule['start']
+        obs['duration']=schedule['duration']
+        obs['sens']+=schedule['sens']*det_threshold
+        obs['gaps']=schedule['gaps']
+        pointing = np.column_stack((schedule['ra'], schedule['dec'], schedule['fov']))
         pointFOV = pointing
     else: # Enter 'trial mode' according to specified cadence
         observations = np.zeros(nobs,dtype={'names': ('start', 'duration','sens','gaps'), 'formats': ('f8','f8','f8','<U128')})
-        for i in range(nobs):
-            tstart = (datetime.datetime.strptime("2019-08-08T12:50:05.0", "%Y-%m-%dT%H:%M:%S.%f") + datetime.timedelta(days=i*7) - start_epoch).total_seconds()/3600/24#) + 60*60*24*obsinterval*i)/(3600*24)    #in days at an interval of 7 days
-            tdur = datetime.timedelta(days=obsdurations).total_seconds()/3600/24
-            sens = rng.normal(obssens, obssig) * det_threshold # in Jy. Choice of Gaussian and its characteristics were arbitrary.
-            observations['start'][i] = tstart
-            observations['duration'][i] = tdur
-            observations['sens'][i] = sens
-            observations['gaps'][i] = "False"
+        tstart = np.datetime64('2019-08-08T12:50:05.0') + np.arange(nobs)*np.timedelta64(7,'D') # at an interval of 7 days
+        observations['start'] = mjd(tstart)
+        observations['duration'] = datetime.timedelta(days=obsdurations).total_seconds()/3600/24
+        observations['sens'] = rng.normal(obssens, obssig, nobs) * det_threshold # in Jy. Choice of Gaussian and its characteristics were arbitrary.
+        observations['gaps'] = "False"
         # obs = np.zeros(len(observations)
         obs = observations
             
-        pointing = np.array([np.array([275.0913169, 7.185135679]) for l in observations])
-        # pointing = np.array([np.array([342.7528844,-59.12614311]) for l in observations])
-        tmpsc = SkyCoord(ra=275.0913169*u.degree,dec=7.185135679*u.degree,frame='fk5')
-        tmpscoff1 = tmpsc.directional_offset_by(-30.00075*u.degree, (1/np.sqrt(2))*u.degree)
-        tmpscoff2 = tmpsc.directional_offset_by(30.00075*u.degree, (1/np.sqrt(2))*u.degree)
-        # # print()
-        # pointing[::3]-=[tmpsc.ra.deg - tmpscoff1.ra.deg,tmpsc.dec.deg - tmpscoff1.dec.deg]
-        # pointing[1::3]-=[tmpsc.ra.deg - tmpscoff2.ra.deg,tmpsc.dec.deg - tmpscoff2.dec.deg]
-        # pointing[::3]=[342.5811999,-59.12369356]
-        # pointing[1::3]=[342.6688451,-59.04494042]
-        # print(pointing)
-        # pointing[2::3]-=[-1,1]
+        pointing = np.tile([275.0913169, 7.185135679], (len(observations),1))
         pointing = pointing[obs['start'].argsort()]
         obs = obs[obs['start'].argsort()] # sorts observations by date
-        FOV = np.array([1.4 for l in observations]) # make FOV for all observations whatever specified here, 1.5 degrees for example
+        FOV = np.full(len(observations), 1.4) # make FOV for all observations whatever specified here, 1.5 degrees for example
         # FOV = np.array([0.059505254 for l in observations]) # make FOV for all observations whatever specified here, 1.5 degrees for example
         # FOV[::3]=0.06105040575
         # FOV[1::3]=0.0636070677
@@ -70,141 +47,230 @@ def observing_strategy(obs_setup, det_threshold, nobs, obssens, obssig, obsinter
         pointFOV[:,2] += FOV
 
     return obs, pointFOV
+
+def mjd(times, start_epoch=np.datetime64('1858-11-17T00:00:00')):
+    """Convert datetime64 times to MJD, counting whole microseconds like datetime.timedelta.total_seconds. Return array of days"""
+
+    return (times - start_epoch).astype('timedelta64[us]').astype(np.int64)/10**6/3600/24
+
+def parse_schedule(obs_setup):
+    """Read an observation file and convert its times to MJD in one go. Return structured array of the observations sorted by start time"""
+
+    tstart, tend, sens, ra, dec, gapsfile,fov  = np.loadtxt(obs_setup, unpack=True, delimiter = ',', ndmin=1,
+        dtype={'names': ('start', 'end','sens', 'ra', 'dec','gaps', 'fov'), 'formats': ('U32','U32','f8','f8','f8','<U128','f8')})
+    # times are written as YYYY-MM-DDTHH:MM:SS.ffffff+00:00, so the UTC offset is dropped before numpy parses them
+    tstart = mjd(np.char.partition(np.atleast_1d(tstart), '+')[:,0].astype('datetime64[us]'))
+    tend = mjd(np.char.partition(np.atleast_1d(tend), '+')[:,0].astype('datetime64[us]'))
+    sortkey = np.argsort(tstart)
+    schedule = np.zeros(len(tstart), dtype={'names': ('start', 'duration', 'sens', 'ra', 'dec', 'gaps', 'fov'), 'formats': ('f8','f8','f8','f8','f8','<U128','f8')})
+    schedule['start'] = tstart[sortkey]
+    schedule['duration'] = (tend - tstart)[sortkey]
+    schedule['sens'] = sens[sortkey]
+    schedule['ra'] = ra[sortkey]
+    schedule['dec'] = dec[sortkey]
+    schedule['gaps'] = gapsfile[sortkey]
+    schedule['fov'] = fov[sortkey]
+    return schedule
+
+def read_schedule(obs_setup):
+    """Read an observation file through a .npy copy of the parsed schedule kept next to it. The copy is memory mapped and 
+    is rewritten whenever the observation file is newer. Return structured array of the observations sorted by start time"""
+
+    cachefile = obs_setup + '.npy'
+    if os.path.exists(cachefile) and os.stat(cachefile).st_mtime_ns >= os.stat(obs_setup).st_mtime_ns:
+        return np.load(cachefile, mmap_mode='r')
+    schedule = parse_schedule(obs_setup)
+    try: # write to a temporary file first so that another run never maps a half written cache
+        tmpfile = cachefile + '.' + str(os.getpid())
+        with open(tmpfile, 'wb') as f:
+            np.save(f, schedule)
+        os.replace(tmpfile, cachefile)
+    except OSError as e:
+        warnings.warn(f"Could not cache the parsed schedule of {obs_setup}: {e}")
+    return schedule
+
+# Scans files that have already been parsed in this process. Keys are (filename, det_threshold) and values are the 
+# modification time of the file when it was read together with its scans.
+_scancache = {}
+
+def read_scans(scansfile, det_threshold):
+    """Parse a scans file, reusing the result of earlier calls unless the file has changed since. Return array of scans in the same format as observing_strategy"""
+
+    mtime = os.stat(scansfile).st_mtime_ns
+    key = (scansfile, det_threshold)
+    if (key not in _scancache) or (_scancache[key][0] != mtime):
+        subobs, _ = observing_strategy(scansfile, det_threshold, 1, 1, 1, 1, 1) # We are giving the scansfile name, so the other variables are unimportant, we set them to 1 
+        _scancache[key] = (mtime, subobs)
+    return _scancache[key][1]
+
+def load_scans(obs, det_threshold):
+    """Parse every scans file named in the observations once so later calls to read_scans are served from memory. Return dictionary of the parsed scans files"""
+
+    for scansfile in np.unique(obs['gaps'][obs['gaps']!='False']):
+        read_scans(scansfile, det_threshold)
+    return {key: value for key, value in _scancache.items() if key[1]==det_threshold}
         
+def unit_vectors(ra, dec):
+    """Convert right ascensions and declinations in degrees to cartesian unit vectors. Return array of shape (n, 3)"""
+
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    return np.column_stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)))
+
+def overlapping_pairs(uniquepoint):
+    """Find every pair of pointings whose fields of view overlap using a KD-tree of their unit vectors. Return array of index pairs (i < j) sorted by i then j and their separations in radians"""
+
+    xyz = unit_vectors(uniquepoint[:,0], uniquepoint[:,1])
+    # Two pointings can only overlap if their centres are closer than the two largest fields of view, which is a chord of 
+    # this length. The small margin keeps pairs that touch exactly, the exact test below decides.
+    maxsep = min(2*np.radians(np.max(uniquepoint[:,2])), np.pi)
+    from scipy.spatial import cKDTree
+    candidates = cKDTree(xyz).query_pairs(2*np.sin(maxsep/2) + 1e-9, output_type='ndarray').reshape(-1,2)
+    candidates = candidates[np.lexsort((candidates[:,1], candidates[:,0]))]
+    i, j = candidates[:,0], candidates[:,1]
+    separation = np.arctan2(np.linalg.norm(np.cross(xyz[i], xyz[j]), axis=1), np.sum(xyz[i]*xyz[j], axis=1))
+    overlap = np.degrees(separation) <= (uniquepoint[i,2] + uniquepoint[j,2])
+    return candidates[overlap], separation[overlap]
+
+def overlapping_triples(pairs, numrgns):
+    """Find every triple of pointings that all overlap each other from the overlapping pairs. Return array of index triples (i < j < k) sorted by i, j then k"""
+
+    # pairs are sorted by their first pointing, so the pointings k > j that overlap j are a slice of the pairs
+    pairkey = pairs[:,0]*numrgns + pairs[:,1]
+    firstpair = np.searchsorted(pairs[:,0], np.arange(numrgns+1))
+    nk = firstpair[pairs[:,1]+1] - firstpair[pairs[:,1]]
+    ij = np.repeat(np.arange(len(pairs)), nk)
+    k = pairs[np.arange(len(ij)) - np.repeat(np.cumsum(nk) - nk, nk) + np.repeat(firstpair[pairs[:,1]], nk), 1]
+    triples = np.column_stack((pairs[ij], k)).astype(int).reshape(-1,3)
+    # keep those where i also overlaps k
+    ik = triples[:,0]*numrgns + triples[:,2]
+    found = np.searchsorted(pairkey, ik)
+    return triples[pairkey[np.minimum(found, len(pairkey)-1)] == ik] if len(pairkey) else triples
+
+def overlap_vertex(centre, towards, halfheight, other, otherfov):
+    """Find the corner of a double overlap region that lies inside a third pointing, starting from the centre of the double overlap. Return SkyCoord of the corners"""
+
+    from astropy import units as u
+    from astropy.coordinates import SkyCoord
+    angle_offset = 90*u.deg
+    pa = centre.position_angle(towards)
+    vertex = centre.directional_offset_by(pa + angle_offset, halfheight)
+    flipped = centre.directional_offset_by(pa - angle_offset, halfheight)
+    flip = vertex.separation(other).deg > otherfov
+    return SkyCoord(ra=np.where(flip, flipped.ra.deg, vertex.ra.deg), dec=np.where(flip, flipped.dec.deg, vertex.dec.deg), unit='deg', frame='fk5')
+
+def pointing_observations(uniquepoint, pointFOV):
+    """Find the first and last observation at the position of every unique pointing. Return two arrays of observation indices"""
+
+    _, obsgroup = np.unique(pointFOV[:,0:2], axis=0, return_inverse=True)
+    _, pointgroup = np.unique(uniquepoint[:,0:2], axis=0, return_inverse=True)
+    obsgroup = obsgroup.ravel()
+    pointgroup = pointgroup.ravel()
+    firstobs = np.full(pointgroup.max()+1, len(pointFOV))
+    lastobs = np.zeros(pointgroup.max()+1, dtype=int)
+    np.minimum.at(firstobs, obsgroup, np.arange(len(pointFOV)))
+    np.maximum.at(lastobs, obsgroup, np.arange(len(pointFOV)))
+    return firstobs[pointgroup], lastobs[pointgroup]
+
 def calculate_regions(pointFOV, observations):
     """Calculate regions based on simultaneous observing times assuming circular regions. Returns region info as structured numpy array."""
     
+    from astropy import units as u
+    from astropy.coordinates import SkyCoord
     uniquepoint = np.unique(pointFOV,axis=0)
     uniquesky = SkyCoord(ra=uniquepoint[:,0],dec=uniquepoint[:,1], unit='deg', frame='fk5')
-    ### Next two lines set up variables for defining region properties. Region array is of maximum theoretical length assuming no more than double overlapping fovs (triple or more never get computed ##
     numrgns = len(uniquepoint) 
-    regions = np.zeros(np.uint32(numrgns + binom(numrgns,2) + binom(numrgns,3)), dtype={'names': ('ra', 'dec','identity', 'area', 'timespan', 'stop', 'start'), 'formats': ('f8','f8','U32','f8', 'f8', 'f8', 'f8')})
-    for i in range(numrgns): # Label the individual pointings. These regions are for example region 1 NOT 2 and 2 NOT 1 
-        regions['identity'][i] = str(i)
-        regions['ra'][i] = uniquepoint[i,0]
-        regions['dec'][i] = uniquepoint[i,1]
-        regions['area'][i] = (4*np.pi*np.sin(uniquepoint[i,2]*(np.pi/180/2))**2*(180/np.pi)**2) # Assumes single circular regions, for multiple pointings or other shapes this needs altering
-        leftoff = i + 1
-    obssubsection = []
+    pairs, pairsep = overlapping_pairs(uniquepoint)
+    triples = overlapping_triples(pairs, numrgns)
+    ### Set up the region array with a row for every pointing and every double and triple overlap that exists (quadruple or more never get computed) ##
+    numpairs = len(pairs)
+    regions = np.zeros(numrgns + numpairs + len(triples), dtype={'names': ('ra', 'dec','identity', 'area', 'timespan', 'stop', 'start'), 'formats': ('f8','f8','U32','f8', 'f8', 'f8', 'f8')})
+    # Label the individual pointings. These regions are for example region 1 NOT 2 and 2 NOT 1 
+    regions['identity'][:numrgns] = np.arange(numrgns).astype(str)
+    regions['ra'][:numrgns] = uniquepoint[:,0]
+    regions['dec'][:numrgns] = uniquepoint[:,1]
+    regions['area'][:numrgns] = (4*np.pi*np.sin(uniquepoint[:,2]*(np.pi/180/2))**2*(180/np.pi)**2) # Assumes single circular regions, for multiple pointings or other shapes this needs altering
     
-    for p in uniquepoint:
-        timeind = np.array([np.amax(np.argwhere((pointFOV[:,0] == p[0]) & (pointFOV[:,1] ==p[1]))), np.amin(np.argwhere((pointFOV[:,0] == p[0]) & (pointFOV[:,1] ==p[1])))])
-        matchregion = (regions['ra']==p[0]) & (regions['dec']==p[1]) & (regions['area']==(4*np.pi*np.sin(p[2]*(np.pi/180/2))**2*(180/np.pi)**2))
-        regions['timespan'][matchregion] = (observations['start'][timeind[0]] + observations['duration'][timeind[0]] - observations['start'][timeind[1]])
-        regions['stop'][matchregion] = observations['start'][timeind[0]] + observations['duration'][timeind[0]]
-        regions['start'][matchregion] = observations['start'][timeind[1]]
-        obssubsection.append([timeind[1],timeind[0],regions['identity'][matchregion][0]])
-
-    gamma = np.zeros((len(uniquepoint),len(uniquepoint)))
-    for i in range(len(uniquesky)-1): # Label intersections: For example: 1 AND 2
-        for j in range(i+1,len(uniquesky)):
-            if uniquesky[i].separation(uniquesky[j]).deg <= (uniquepoint[i,2] + uniquepoint[j,2]):
-                d = uniquesky[i].separation(uniquesky[j]).rad
-                r1 = uniquepoint[i,2]*np.pi/180
-                r2 = uniquepoint[j,2]*np.pi/180
-                gamma[i,j] = np.arctan((np.cos(r2)/np.cos(r1)/np.sin(d)) - (1/np.tan(d)))
-                pa = uniquesky[i].position_angle(uniquesky[j])
-                # https://arxiv.org/ftp/arxiv/papers/1205/1205.1396.pdf
-                # and https://en.wikipedia.org/wiki/Solid_angle#Cone,_spherical_cap,_hemisphere
-                fullcone1 = 4*np.pi*np.sin(r1/2)**2 
-                cutchord1 = 2*(np.arccos(np.sin(gamma[i,j])/np.sin(r1)) - np.cos(r1)*np.arccos(np.tan(gamma[i,j])/np.tan(r1))) 
-                fullcone2 = 4*np.pi*np.sin(r2/2)**2
-                cutchord2 = 2*(np.arccos(np.sin(gamma[i,j])/np.sin(r2)) - np.cos(r2)*np.arccos(np.tan(gamma[i,j])/np.tan(r2))) 
-                centerreg = uniquesky[i].directional_offset_by(pa, gamma[i,j]*u.radian)
-                regions['identity'][leftoff] = str(i)+'&'+str(j)
-                regions['ra'][leftoff] = centerreg.ra.deg
-                regions['dec'][leftoff] = centerreg.dec.deg
-                regions['area'][leftoff] = (cutchord1 + cutchord2)*(180/np.pi)**2
-                regions['start'][leftoff] = min(regions['start'][i],regions['start'][j])
-                regions['stop'][leftoff] = max(regions['stop'][i],regions['stop'][j])
-                regions['timespan'][leftoff] = regions['stop'][leftoff] - regions['start'][leftoff]
-                leftoff+=1
-    # scatterpointsra = []
-    # scatterpointsdec = []
-    for i in range(len(uniquesky)-2): # repeat the above, but this time for triple overlapping regions
-        for j in range(i+1,len(uniquesky)-1):
-            for index3 in range(j+1,len(uniquesky)):
-                if ((uniquesky[i].separation(uniquesky[j]).deg <= (uniquepoint[i,2] + uniquepoint[j,2])) and 
-                    (uniquesky[j].separation(uniquesky[index3]).deg <= (uniquepoint[j,2] + uniquepoint[index3,2])) and 
-                    (uniquesky[i].separation(uniquesky[index3]).deg <= (uniquepoint[i,2] + uniquepoint[index3,2]))):
-                    r1 = uniquepoint[i,2]*np.pi/180
-                    r2 = uniquepoint[j,2]*np.pi/180
-                    r3 = uniquepoint[index3,2]*np.pi/180
-                    # Get coordinates of the encircled(?) spherical triangle
-                    # from the triangle formed between pointing center, overlap center, and overlap nodal point.
-
-                    angle_offset = 90*u.deg
-                    halfheightr4 = np.arccos(np.cos(r1)/np.cos(gamma[i][j])) 
-                    point4key = np.where(regions['identity'] == str(i)+'&'+str(j))
-                    point4ra = regions['ra'][point4key]
-                    point4dec = regions['dec'][point4key]
-                    point4sc = SkyCoord(ra=point4ra, dec=point4dec, unit='deg',frame='fk5')
-                    point4pa = point4sc.position_angle(uniquesky[j])
-                    point7sc = point4sc.directional_offset_by(point4pa + angle_offset, halfheightr4)
-                    # print(point7sc.separation(uniquesky[index3]).deg)
-                    if point7sc.separation(uniquesky[index3]).deg > uniquepoint[index3,2]:
-                        point7sc = point4sc.directional_offset_by(point4pa - angle_offset, halfheightr4)
-
-                    halfheightr5 = np.arccos(np.cos(r2)/np.cos(gamma[j][index3]))
-                    point5key = np.where(regions['identity'] == str(j)+'&'+str(index3))
-                    point5ra = regions['ra'][point5key]
-                    point5dec = regions['dec'][point5key]
-                    point5sc = SkyCoord(ra=point5ra, dec=point5dec, unit='deg',frame='fk5')
-                    point5pa = point5sc.position_angle(uniquesky[index3])
-                    point8sc = point5sc.directional_offset_by(point5pa + angle_offset, halfheightr5)
-                    # print(point8sc.separation(uniquesky[i]).deg)
-                    if point8sc.separation(uniquesky[i]).deg > uniquepoint[i,2]:
-                        point8sc = point5sc.directional_offset_by(point5pa - angle_offset, halfheightr5)
-
-                    halfheightr6 = np.arccos(np.cos(r1)/np.cos(gamma[i][index3]))
-                    point6key = np.where(regions['identity'] == str(i)+'&'+str(index3))
-                    point6ra = regions['ra'][point6key]
-                    point6dec = regions['dec'][point6key]
-                    point6sc = SkyCoord(ra=point6ra, dec=point6dec, unit='deg',frame='fk5')
-                    point6pa = point6sc.position_angle(uniquesky[i])
-                    point9sc = point6sc.directional_offset_by(point6pa + angle_offset, halfheightr6)
-                    # print(point9sc.separation(uniquesky[j]).deg)
-                    if point9sc.separation(uniquesky[j]).deg > uniquepoint[j,2]:
-                        point9sc = point6sc.directional_offset_by(point6pa - angle_offset, halfheightr6)
-
-                    #We now get the side lengths of the encircled triangle from the coordinates. 
-                    aside = point7sc.separation(point8sc).rad[0]
-                    bside = point8sc.separation(point9sc).rad[0]
-                    cside = point9sc.separation(point7sc).rad[0]
-
-                    # spherical law of cosines
-
-                    Aangle = np.arccos((np.cos(aside) - np.cos(bside)*np.cos(cside))/(np.sin(bside)*np.sin(cside)))
-                    Bangle = np.arccos((np.cos(bside) - np.cos(cside)*np.cos(aside))/(np.sin(cside)*np.sin(aside)))
-                    Cangle = np.arccos((np.cos(cside) - np.cos(aside)*np.cos(bside))/(np.sin(aside)*np.sin(bside)))
-
-                    triarea = Aangle + Bangle + Cangle - np.pi
-
-                    # We now need to get the excess area from the overlapping region not actually being a spherical triange. 
-                    # we will use the triangle formed from a pointing center, a point of the overlap region, and the midpoint of
-                    # the encircled circular triangle
-
-                    gamma4 = np.arccos(np.cos(r2)/np.cos(aside/2))
-                    cutchord1 = 2*(np.arccos(np.sin(gamma4)/np.sin(r2)) - np.cos(r2)*np.arccos(np.tan(gamma4)/np.tan(r2))) 
-                    gamma5 = np.arccos(np.cos(r3)/np.cos(bside/2))
-                    cutchord2 = 2*(np.arccos(np.sin(gamma5)/np.sin(r3)) - np.cos(r3)*np.arccos(np.tan(gamma5)/np.tan(r3))) 
-                    gamma6 = np.arccos(np.cos(r1)/np.cos(cside/2))
-                    cutchord3 = 2*(np.arccos(np.sin(gamma6)/np.sin(r1)) - np.cos(r1)*np.arccos(np.tan(gamma6)/np.tan(r1))) 
-
-                    area = triarea + cutchord1 + cutchord2 + cutchord3
-
-
-                    midpointra = (point7sc.ra.deg + point8sc.ra.deg + point9sc.ra.deg)/3
-                    midpointdec = (point7sc.dec.deg + point8sc.dec.deg + point9sc.dec.deg)/3
-                    # print(point7sc, point8sc, point9sc)
-                    regions['identity'][leftoff] = str(i)+'&'+str(j)+'&'+str(index3)
-                    regions['ra'][leftoff] = midpointra
-                    regions['dec'][leftoff] = midpointdec
-                    regions['area'][leftoff] = area*(180/np.pi)**2
-                    regions['start'][leftoff] = np.amin([regions['start'][i],regions['start'][j],regions['start'][index3]])
-                    regions['stop'][leftoff] = np.amax([regions['stop'][i],regions['stop'][j],regions['stop'][index3]])
-                    regions['timespan'][leftoff] = regions['stop'][leftoff] - regions['start'][leftoff]
-                    leftoff+=1
+    firstobs, lastobs = pointing_observations(uniquepoint, pointFOV)
+    regions['stop'][:numrgns] = observations['start'][lastobs] + observations['duration'][lastobs]
+    regions['start'][:numrgns] = observations['start'][firstobs]
+    regions['timespan'][:numrgns] = regions['stop'][:numrgns] - regions['start'][:numrgns]
+    obssubsection = [[f, l, identity] for f, l, identity in zip(firstobs, lastobs, regions['identity'][:numrgns])]
+
+    # Label intersections: For example: 1 AND 2
+    i, j = pairs[:,0], pairs[:,1]
+    d = pairsep
+    r1 = uniquepoint[i,2]*np.pi/180
+    r2 = uniquepoint[j,2]*np.pi/180
+    gamma = np.arctan((np.cos(r2)/np.cos(r1)/np.sin(d)) - (1/np.tan(d)))
+    # https://arxiv.org/ftp/arxiv/papers/1205/1205.1396.pdf
+    # and https://en.wikipedia.org/wiki/Solid_angle#Cone,_spherical_cap,_hemisphere
+    cutchord1 = 2*(np.arccos(np.sin(gamma)/np.sin(r1)) - np.cos(r1)*np.arccos(np.tan(gamma)/np.tan(r1))) 
+    cutchord2 = 2*(np.arccos(np.sin(gamma)/np.sin(r2)) - np.cos(r2)*np.arccos(np.tan(gamma)/np.tan(r2))) 
+    pairrows = slice(numrgns, numrgns + numpairs)
+    if numpairs:
+        pa = uniquesky[i].position_angle(uniquesky[j])
+        centerreg = uniquesky[i].directional_offset_by(pa, gamma*u.radian)
+        regions['ra'][pairrows] = centerreg.ra.deg
+        regions['dec'][pairrows] = centerreg.dec.deg
+    regions['identity'][pairrows] = np.char.add(np.char.add(i.astype(str), '&'), j.astype(str))
+    regions['area'][pairrows] = (cutchord1 + cutchord2)*(180/np.pi)**2
+    regions['start'][pairrows] = np.minimum(regions['start'][i],regions['start'][j])
+    regions['stop'][pairrows] = np.maximum(regions['stop'][i],regions['stop'][j])
+    regions['timespan'][pairrows] = regions['stop'][pairrows] - regions['start'][pairrows]
+
+    # repeat the above, but this time for triple overlapping regions
+    triplerows = slice(numrgns + numpairs, len(regions))
+    if len(triples):
+        i, j, index3 = triples[:,0], triples[:,1], triples[:,2]
+        r1 = uniquepoint[i,2]*np.pi/180
+        r2 = uniquepoint[j,2]*np.pi/180
+        r3 = uniquepoint[index3,2]*np.pi/180
+        # rows of the double overlaps of each triple
+        pairkey = pairs[:,0]*numrgns + pairs[:,1]
+        ij = np.searchsorted(pairkey, i*numrgns + j)
+        jk = np.searchsorted(pairkey, j*numrgns + index3)
+        ik = np.searchsorted(pairkey, i*numrgns + index3)
+        pairsky = lambda rows: SkyCoord(ra=regions['ra'][numrgns + rows], dec=regions['dec'][numrgns + rows], unit='deg',frame='fk5')
+        # Get coordinates of the encircled(?) spherical triangle
+        # from the triangle formed between pointing center, overlap center, and overlap nodal point.
+        point7sc = overlap_vertex(pairsky(ij), uniquesky[j], np.arccos(np.cos(r1)/np.cos(gamma[ij])), uniquesky[index3], uniquepoint[index3,2])
+        point8sc = overlap_vertex(pairsky(jk), uniquesky[index3], np.arccos(np.cos(r2)/np.cos(gamma[jk])), uniquesky[i], uniquepoint[i,2])
+        point9sc = overlap_vertex(pairsky(ik), uniquesky[i], np.arccos(np.cos(r1)/np.cos(gamma[ik])), uniquesky[j], uniquepoint[j,2])
+
+        #We now get the side lengths of the encircled triangle from the coordinates. 
+        aside = point7sc.separation(point8sc).rad
+        bside = point8sc.separation(point9sc).rad
+        cside = point9sc.separation(point7sc).rad
+
+        # spherical law of cosines
+
+        Aangle = np.arccos((np.cos(aside) - np.cos(bside)*np.cos(cside))/(np.sin(bside)*np.sin(cside)))
+        Bangle = np.arccos((np.cos(bside) - np.cos(cside)*np.cos(aside))/(np.sin(cside)*np.sin(aside)))
+        Cangle = np.arccos((np.cos(cside) - np.cos(aside)*np.cos(bside))/(np.sin(aside)*np.sin(bside)))
+
+        triarea = Aangle + Bangle + Cangle - np.pi
+
+        # We now need to get the excess area from the overlapping region not actually being a spherical triange. 
+        # we will use the triangle formed from a pointing center, a point of the overlap region, and the midpoint of
+        # the encircled circular triangle
+
+        gamma4 = np.arccos(np.cos(r2)/np.cos(aside/2))
+        cutchord1 = 2*(np.arccos(np.sin(gamma4)/np.sin(r2)) - np.cos(r2)*np.arccos(np.tan(gamma4)/np.tan(r2))) 
+        gamma5 = np.arccos(np.cos(r3)/np.cos(bside/2))
+        cutchord2 = 2*(np.arccos(np.sin(gamma5)/np.sin(r3)) - np.cos(r3)*np.arccos(np.tan(gamma5)/np.tan(r3))) 
+        gamma6 = np.arccos(np.cos(r1)/np.cos(cside/2))
+        cutchord3 = 2*(np.arccos(np.sin(gamma6)/np.sin(r1)) - np.cos(r1)*np.arccos(np.tan(gamma6)/np.tan(r1))) 
+
+        area = triarea + cutchord1 + cutchord2 + cutchord3
+
+        regions['identity'][triplerows] = np.char.add(np.char.add(regions['identity'][numrgns + ij], '&'), index3.astype(str))
+        regions['ra'][triplerows] = (point7sc.ra.deg + point8sc.ra.deg + point9sc.ra.deg)/3
+        regions['dec'][triplerows] = (point7sc.dec.deg + point8sc.dec.deg + point9sc.dec.deg)/3
+        regions['area'][triplerows] = area*(180/np.pi)**2
+        regions['start'][triplerows] = np.minimum.reduce([regions['start'][i],regions['start'][j],regions['start'][index3]])
+        regions['stop'][triplerows] = np.maximum.reduce([regions['stop'][i],regions['stop'][j],regions['stop'][index3]])
+        regions['timespan'][triplerows] = regions['stop'][triplerows] - regions['start'][triplerows]
 
     #                 scatterpointsra.extend([point7sc.ra,point8sc.ra,point9sc.ra])
     #                 scatterpointsdec.extend([point7sc.dec,point8sc.dec,point9sc.dec])
@@ -238,61 +304,265 @@ def calculate_regions(pointFOV, observations):
     return regions[regions['identity'] != ''], obssubsection
     
 
-def generate_pointings(n_sources, pointFOV, i, leftoff, overlapnums):
-    """Simulate pointings for each simulated source. Use a monte-carlo like method to roll the dice to determine position. Return a numpy array and """
+def ring_geometry(ring, nside):
+    """Describe rings of a HEALPix grid in the RING scheme, numbered 1 to 4*nside-1 from the north pole. Every pixel has the 
+    same area, 4pi/(12*nside**2). Return the z of the ring centres, the number of pixels in each ring, the offset of the 
+    first pixel centre from phi=0 in pixel widths and the index of the first pixel of each ring"""
+
+    ring = np.asarray(ring, dtype=np.int64)
+    north = ring < nside
+    south = ring > 3*nside
+    polar = np.where(south, 4*nside - ring, ring) # rings counted from the nearest pole in the polar caps
+    z = np.where(north, 1 - polar**2/(3*nside**2), np.where(south, polar**2/(3*nside**2) - 1, (2*nside - ring)*2/(3*nside)))
+    npixring = np.where(north | south, 4*polar, 4*nside)
+    shift = np.where(north | south | ((ring - nside) % 2 == 0), 0.5, 0.)
+    firstpix = np.where(north, 2*polar*(polar - 1), np.where(south, 12*nside**2 - 2*polar*(polar + 1), 2*nside*(nside - 1) + (ring - nside)*4*nside))
+    return z, npixring, shift, firstpix
+
+def ring_of_z(z, nside):
+    """Fractional HEALPix ring number at height z, the inverse of the ring centres in ring_geometry. Return array of floats"""
+
+    z = np.asarray(z, dtype=float)
+    return np.where(z > 2/3, nside*np.sqrt(3*(1 - np.minimum(z, 1))), np.where(z < -2/3, 4*nside - nside*np.sqrt(3*(1 + np.maximum(z, -1))), nside*(2 - 1.5*z)))
+
+def group_masks(masks):
+    """Group identical rows of packed bitmasks. Rows are hashed to 64 bits to sort them quickly and checked against their 
+    group afterwards, so a hash collision can never merge different masks. Return the index of one row per group and the group of every row"""
+
+    nbytes = masks.shape[1]
+    words = np.zeros((len(masks), -(-nbytes//8)*8), dtype=np.uint8)
+    words[:, :nbytes] = masks
+    words = words.view(np.uint64)
+    hashkey = np.zeros(len(masks), dtype=np.uint64)
+    for w in range(words.shape[1]):
+        hashkey = (hashkey ^ words[:,w])*np.uint64(0x9E3779B97F4A7C15) + np.uint64(w) # wraps around like any 64 bit hash
+    _, rep, inverse = np.unique(hashkey, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    if not np.array_equal(masks, masks[rep[inverse]]):
+        _, rep, inverse = np.unique(masks.view(f'V{nbytes}').ravel(), return_index=True, return_inverse=True)
+    return rep, inverse.ravel()
+
+def pack_masks(row, point, nrows, nbytes):
+    """Set bit point of row for every (row, point) pair. Return the packed bitmasks"""
+
+    byte = row*nbytes + point//8
+    byteorder = np.argsort(byte, kind='stable')
+    byte = byte[byteorder]
+    newbyte = np.flatnonzero(np.r_[True, byte[1:] != byte[:-1]])
+    bits = np.zeros(nrows*nbytes, dtype=np.uint8)
+    bits[byte[newbyte]] = np.bitwise_or.reduceat((128 >> (point % 8)).astype(np.uint8)[byteorder], newbyte)
+    return bits.reshape(nrows, nbytes)
+
+def group_pixels(pixrow, point, npixels, nbytes):
+    """Group pixels covered by the same set of pointings, given as (pixel, pointing) pairs sorted by pixel. Each pixel is hashed 
+    by xoring a 64 bit key per pointing so only the representative pixels need a full bitmask. Return the bitmask of every group and the group of every pixel"""
+
+    key = np.arange(1, point.max() + 2, dtype=np.uint64)*np.uint64(0x9E3779B97F4A7C15) # splitmix64 of the pointing number
+    key = (key ^ (key >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    key = (key ^ (key >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    key ^= key >> np.uint64(31)
+    first = np.flatnonzero(np.r_[True, pixrow[1:] != pixrow[:-1]])
+    _, rep, inverse = np.unique(np.bitwise_xor.reduceat(key[point], first), return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    isrep = np.zeros(npixels, dtype=bool)
+    isrep[rep] = True
+    reppairs = isrep[pixrow]
+    bits = pack_masks(inverse[pixrow[reppairs]], point[reppairs], len(rep), nbytes)
+    # A pixel belongs to its group only if it has as many pointings as the group's bitmask and all of them are in it
+    count = np.diff(np.r_[first, len(pixrow)])
+    if np.all(count == count[rep][inverse]) and np.all(bits[inverse[pixrow], point//8] & (128 >> (point % 8)).astype(np.uint8)):
+        return bits, inverse
+    bits = pack_masks(pixrow, point, npixels, nbytes) # a hash collision, group the full bitmasks instead
+    rep, inverse = group_masks(bits)
+    return bits[rep], inverse
+
+def cap_rings(uniquepoint, nside):
+    """Find the run of HEALPix pixels whose centres lie inside each pointing's field of view on every ring it crosses. 
+    Return the pointing, ring, first pixel column and number of pixels of every (pointing, ring) run"""
+
+    theta0 = np.radians(90 - uniquepoint[:,1])
+    phi0 = np.radians(uniquepoint[:,0])
+    radius = np.radians(uniquepoint[:,2])
+    z0 = np.cos(theta0)
+    # rings that can touch each cap, from the cap's highest to lowest point
+    zmax = np.cos(np.maximum(theta0 - radius, 0))
+    zmin = np.cos(np.minimum(theta0 + radius, np.pi))
+    firstring = np.clip(np.floor(ring_of_z(zmax, nside)), 1, 4*nside-1).astype(np.int64)
+    lastring = np.clip(np.ceil(ring_of_z(zmin, nside)), 1, 4*nside-1).astype(np.int64)
+    nrings = lastring - firstring + 1
+    point = np.repeat(np.arange(len(uniquepoint)), nrings)
+    ring = np.arange(len(point)) - np.repeat(np.cumsum(nrings) - nrings, nrings) + np.repeat(firstring, nrings)
+    z, npixring, shift, _ = ring_geometry(ring, nside)
+    # half width in phi of the part of the ring inside the cap, from the spherical law of cosines
+    sinprod = np.sqrt(1 - z**2)*np.sin(theta0[point])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosdphi = (np.cos(radius[point]) - z*z0[point])/sinprod
+    cosdphi = np.where(sinprod > 0, cosdphi, np.where(z*z0[point] >= np.cos(radius[point]), -1, 2)) # rings around a pole are all in or all out
+    dphi = np.arccos(np.clip(cosdphi, -1, 1))
+    width = 2*np.pi/npixring
+    firstj = np.ceil((phi0[point] - dphi)/width - shift).astype(np.int64)
+    lastj = np.floor((phi0[point] + dphi)/width - shift).astype(np.int64)
+    npix = np.where(cosdphi > 1, 0, np.clip(lastj - firstj + 1, 0, npixring))
+    keep = npix > 0
+    return point[keep], ring[keep], firstj[keep], npix[keep]
+
+# Default memory for the pixel masks, which grow with the number of pointings, when no max_mem is given
+_PIXEL_MEM = 2**30
+
+def pixel_regions(pointFOV, observations, pixels_per_fov=4096, max_mem=None):
+    """Calculate regions by rasterizing every pointing onto an equal-area HEALPix grid. Pixels are grouped by the exact set of 
+    pointings covering them, packed into bitmasks, so overlaps of any order are found. Unlike calculate_regions a region is 
+    only the sky covered by exactly its pointings, e.g. region 1 is 1 NOT 2, so a pointing that others cover completely
+    has area 0. Returns region info as structured numpy array"""
+
+    uniquepoint = np.unique(pointFOV,axis=0)
+    numrgns = len(uniquepoint)
+    # pick the grid so that the smallest field of view covers about pixels_per_fov pixels
+    mincap = 2*np.pi*(1 - np.cos(np.radians(np.min(uniquepoint[:,2]))))
+    nside = int(np.ceil(np.sqrt(4*np.pi*pixels_per_fov/(12*mincap))))
+    pixarea = 4*np.pi/(12*nside**2)*(180/np.pi)**2
+    point, ring, firstj, npix = cap_rings(uniquepoint, nside)
+    # Pixels are numbered ring by ring, so the sky is done in bands of rings that keep the (pixel, pointing) pairs under 
+    # max_mem. One bit per pointing: identical masks are merged within a band with np.unique and across bands by their bytes.
+    order = np.argsort(ring, kind='stable')
+    point, ring, firstj, npix = point[order], ring[order], firstj[order], npix[order]
+    nbytes = (numrgns + 7)//8
+    budget = max(1, (max_mem or _PIXEL_MEM)//(8*_TEMPORARIES + 2*nbytes))
+    ringstart = np.flatnonzero(np.r_[True, ring[1:] != ring[:-1]])
+    cumpix = np.cumsum(npix)[np.r_[ringstart[1:], len(ring)] - 1]
+    bands = [0]
+    while bands[-1] < len(ringstart):
+        done = cumpix[bands[-1]-1] if bands[-1] else 0
+        bands.append(max(bands[-1]+1, int(np.searchsorted(cumpix, done + budget, side='right'))))
+    bands[-1] = len(ringstart)
+    bounds = np.r_[ringstart, len(ring)]
+    bandmasks = []
+    bandpixels = []
+    bandcentroid = []
+    for b, bend in zip(bands[:-1], bands[1:]):
+        rows = slice(bounds[b], bounds[bend])
+        rowring, rowpoint, rownpix = ring[rows], point[rows], npix[rows]
+        z, npixring, shift, firstpix = ring_geometry(rowring, nside)
+        run = np.repeat(np.arange(len(rowring)), rownpix)
+        j = np.arange(len(run)) - np.repeat(np.cumsum(rownpix) - rownpix, rownpix) + np.repeat(firstj[rows], rownpix)
+        pixel = firstpix[run] + j % npixring[run]
+        pixorder = np.argsort(pixel, kind='stable')
+        pixel, run, j = pixel[pixorder], run[pixorder], j[pixorder]
+        newpixel = np.r_[True, pixel[1:] != pixel[:-1]]
+        pixrow = np.cumsum(newpixel) - 1
+        first = np.flatnonzero(newpixel)
+        phi = (j[first] + shift[run[first]])*2*np.pi/npixring[run[first]]
+        sintheta = np.sqrt(1 - z[run[first]]**2)
+        pixxyz = np.column_stack((sintheta*np.cos(phi), sintheta*np.sin(phi), z[run[first]]))
+        bits, inverse = group_pixels(pixrow, rowpoint[run], len(first), nbytes)
+        bandmasks.append(bits)
+        bandpixels.append(np.bincount(inverse))
+        bandcentroid.append(np.column_stack([np.bincount(inverse, weights=pixxyz[:,k]) for k in range(3)]))
+    bandmasks = np.concatenate(bandmasks)
+    rep, inverse = group_masks(bandmasks)
+    npixels = np.bincount(inverse, weights=np.concatenate(bandpixels))
+    centroid = np.column_stack([np.bincount(inverse, weights=np.concatenate(bandcentroid)[:,k]) for k in range(3)])
+    membership = np.unpackbits(bandmasks[rep], axis=1)[:, :numrgns].astype(bool)
+    # Every pointing gets a row of its own first, even if other pointings cover all of it, followed by the overlaps in 
+    # order of how many pointings they share and then by pointing number
+    norder = membership.sum(axis=1)
+    single = norder == 1
+    overlap = np.flatnonzero(~single)
+    regrow, members = np.nonzero(membership[overlap])
+    memberlist = np.full((len(overlap), max(norder.max(), 1)), numrgns)
+    memberlist[regrow, np.arange(len(regrow)) - np.searchsorted(regrow, regrow)] = members
+    overlapkey = np.lexsort([memberlist[:,k] for k in range(memberlist.shape[1]-1, -1, -1)] + [norder[overlap]])
+    overlap = overlap[overlapkey]
+    memberlist = memberlist[overlapkey]
+    identities = ['&'.join(map(str, m[:n])) for m, n in zip(memberlist.tolist(), norder[overlap])]
+    regions = np.zeros(numrgns + len(overlap), dtype={'names': ('ra', 'dec','identity', 'area', 'timespan', 'stop', 'start'), 'formats': ('f8','f8',f'U{max([32] + [len(ident) for ident in identities])}','f8', 'f8', 'f8', 'f8')})
+    regions['identity'][:numrgns] = np.arange(numrgns).astype(str)
+    regions['ra'][:numrgns] = uniquepoint[:,0]
+    regions['dec'][:numrgns] = uniquepoint[:,1]
+    regions['area'][np.argmax(membership[single], axis=1)] = npixels[single]*pixarea
+    firstobs, lastobs = pointing_observations(uniquepoint, pointFOV)
+    regions['stop'][:numrgns] = observations['start'][lastobs] + observations['duration'][lastobs]
+    regions['start'][:numrgns] = observations['start'][firstobs]
+    obssubsection = [[f, l, identity] for f, l, identity in zip(firstobs, lastobs, regions['identity'][:numrgns])]
+    if len(overlap):
+        members = membership[overlap]
+        regions['identity'][numrgns:] = identities
+        regions['ra'][numrgns:] = np.degrees(np.arctan2(centroid[overlap,1], centroid[overlap,0])) % 360
+        regions['dec'][numrgns:] = np.degrees(np.arctan2(centroid[overlap,2], np.hypot(centroid[overlap,0], centroid[overlap,1])))
+        regions['area'][numrgns:] = npixels[overlap]*pixarea
+        regions['start'][numrgns:] = np.min(np.where(members, regions['start'][:numrgns], np.inf), axis=1)
+        regions['stop'][numrgns:] = np.max(np.where(members, regions['stop'][:numrgns], -np.inf), axis=1)
+    regions['timespan'] = regions['stop'] - regions['start']
+    return regions, obssubsection
+
+def sample_cap(n_sources, ra, dec, fov, rng=None):
+    """Draw points uniformly inside spherical caps of radius fov degrees. The cosine of the angle from the centre is uniform 
+    over a cap, so points are drawn around the pole and rotated onto the centre. ra, dec and fov may be one value or one per point. Return array of unit vectors of shape (n_sources, 3)"""
+
+    rng = np.random.default_rng(rng)
+    ra, dec, fov = [np.broadcast_to(np.radians(a), (int(n_sources),)) for a in (ra, dec, fov)]
+    cosrho = 1 - rng.random(int(n_sources))*(1 - np.cos(fov))
+    sinrho = np.sqrt(1 - cosrho**2)
+    phi = 2*np.pi*rng.random(int(n_sources))
+    centre = unit_vectors(np.degrees(ra), np.degrees(dec))
+    north = np.column_stack((-np.sin(dec)*np.cos(ra), -np.sin(dec)*np.sin(ra), np.cos(dec)))
+    east = np.column_stack((-np.sin(ra), np.cos(ra), np.zeros(len(ra))))
+    return cosrho[:,None]*centre + sinrho[:,None]*(np.cos(phi)[:,None]*north + np.sin(phi)[:,None]*east)
+
+def sample_cap_union(n_sources, pointFOV, rng=None):
+    """Draw points uniformly inside the union of the pointings' fields of view, e.g. a mosaic. Caps are picked in proportion 
+    to their area and each point is kept with probability one over the number of caps it falls in, so overlaps are not 
+    counted twice. Return array of unit vectors of shape (n_sources, 3)"""
+
+    rng = np.random.default_rng(rng)
+    caps = np.unique(pointFOV, axis=0)
+    capxyz = unit_vectors(caps[:,0], caps[:,1])
+    cosfov = np.cos(np.radians(caps[:,2]))
+    capprob = (1 - cosfov)/np.sum(1 - cosfov) # cap areas are proportional to 1 - cos(fov)
+    points = []
+    npoints = 0
+    acceptance = 1.
+    while npoints < n_sources: # usually one pass, a second tops up the few points that were thinned away
+        ndraw = int(np.ceil((n_sources - npoints)/acceptance*1.05)) + 16
+        cap = rng.choice(len(caps), size=ndraw, p=capprob)
+        xyz = sample_cap(ndraw, caps[cap,0], caps[cap,1], caps[cap,2], rng=rng)
+        multiplicity = np.maximum(np.sum((xyz @ capxyz.T) >= cosfov, axis=1), 1)
+        keep = rng.random(ndraw)*multiplicity < 1
+        acceptance = max(np.mean(keep), 1e-3)
+        points.append(xyz[keep])
+        npoints += np.sum(keep)
+    return np.concatenate(points)[:n_sources]
+
+def generate_pointings(n_sources, pointFOV, i, leftoff, overlapnums, rng=None):
+    """Simulate pointings for each simulated source. Sources are drawn uniformly inside pointing i and counted in every double and triple overlap it is part of. Return the overlap counts and where the next overlap goes"""
     
     uniquepointFOV = np.unique(pointFOV, axis=0)
-    rng = np.random.default_rng() 
-    maxFOV = np.max(pointFOV[:,2])
-    minra = min(uniquepointFOV[:,0])
-    mindec = min(uniquepointFOV[:,1])
-    maxra = max(uniquepointFOV[:,0])
-    maxdec = max(uniquepointFOV[:,1])
-    uniqueskycoord = SkyCoord(ra=uniquepointFOV[:,0]*u.deg, dec=uniquepointFOV[:,1]*u.deg, frame='fk5')
-    ra_randfield = lambda n, ptfov: (rng.random(int(n))*(min(ptfov[0] + ptfov[2],360) - max(ptfov[0] - ptfov[2],0)) + max(ptfov[0] - ptfov[2],0)) * u.degree
-    dec_randfield = lambda n, ptfov: (rng.random(int(n))*(min(ptfov[1] + ptfov[2],90)  - max(ptfov[1] - ptfov[2], -90)) + max(ptfov[1] - ptfov[2], -90)) * u.degree    
-    rollforskycoordfield = lambda n, ptfov: SkyCoord(ra=ra_randfield(n, ptfov), dec=dec_randfield(n, ptfov), frame='fk5')
-    sc = rollforskycoordfield(n_sources, uniquepointFOV[i])
-    accept = np.zeros(sc.shape,dtype=bool)
-    reject = np.logical_not(accept)
-    cond = np.zeros(len(sc),dtype=bool)
-    while True:
-        cond[reject] +=((sc[reject].separation(uniqueskycoord[i]).deg) < (uniquepointFOV[i,2])) 
-        if np.sum(~cond)==0:
-            break
-        reject = ~cond
-        accept = ~reject
-        sc.data.lon[reject] = ra_randfield(len(sc[reject]),uniquepointFOV[i])
-        sc.data.lat[reject] = dec_randfield(len(sc[reject]),uniquepointFOV[i])
-        sc.cache.clear()
-
-    numrgns = len(uniqueskycoord)
-    for j in range(i+1,len(uniqueskycoord)):
-        if (uniqueskycoord[i].separation(uniqueskycoord[j]).deg <= (uniquepointFOV[i,2] + uniquepointFOV[j,2])) & (i!=j):
-            overlapnums['name'][leftoff - numrgns] = str(i)+'&'+str(j)
-            overlapnums['sources'][leftoff - numrgns] =  np.sum((sc.separation(uniqueskycoord[i]).deg < (uniquepointFOV[i,2])) & (sc.separation(uniqueskycoord[j]).deg < (uniquepointFOV[j,2])))
-            leftoff+=1
-    for j in range(i+1,len(uniqueskycoord)):
-        for k in range(j+1,len(uniqueskycoord)):
-            if ((uniqueskycoord[i].separation(uniqueskycoord[j]).deg <= (uniquepointFOV[i,2] + uniquepointFOV[j,2])) & 
-                (uniqueskycoord[j].separation(uniqueskycoord[k]).deg <= (uniquepointFOV[j,2] + uniquepointFOV[k,2])) &
-                (uniqueskycoord[i].separation(uniqueskycoord[k]).deg <= (uniquepointFOV[i,2] + uniquepointFOV[k,2])) &
-                (i!=j) & (j!=k)):
-                overlapnums['name'][leftoff - numrgns] = str(i)+'&'+str(j)+'&'+str(k)
-                overlapnums['sources'][leftoff - numrgns] =  np.sum((sc.separation(uniqueskycoord[i]).deg < (uniquepointFOV[i,2])) & 
-                    (sc.separation(uniqueskycoord[j]).deg < (uniquepointFOV[j,2])) &
-                    (sc.separation(uniqueskycoord[k]).deg < (uniquepointFOV[k,2])))
-                leftoff+=1
-    #### Put another loop here, but nested and use it to determine number of sources in triple overlap region
-    # print(overlapnums)
-    # print(leftoff)
+    rng = np.random.default_rng(rng)
+    xyz = sample_cap(n_sources, uniquepointFOV[i,0], uniquepointFOV[i,1], uniquepointFOV[i,2], rng=rng)
+    numrgns = len(uniquepointFOV)
+    pairs, _ = overlapping_pairs(uniquepointFOV)
+    triples = overlapping_triples(pairs, numrgns)
+    pairs = pairs[pairs[:,0]==i]
+    triples = triples[triples[:,0]==i]
+    # every source is inside pointing i, so only the other pointings of each overlap need a containment test
+    others = np.unique(np.concatenate((pairs[:,1], triples[:,1:].ravel()))).astype(int)
+    inside = (xyz @ unit_vectors(uniquepointFOV[others,0], uniquepointFOV[others,1]).T) > np.cos(np.radians(uniquepointFOV[others,2]))
+    column = lambda j: np.searchsorted(others, j)
+    for j in pairs[:,1]:
+        overlapnums['name'][leftoff - numrgns] = str(i)+'&'+str(j)
+        overlapnums['sources'][leftoff - numrgns] = np.sum(inside[:,column(j)])
+        leftoff+=1
+    for j,k in triples[:,1:]:
+        overlapnums['name'][leftoff - numrgns] = str(i)+'&'+str(j)+'&'+str(k)
+        overlapnums['sources'][leftoff - numrgns] = np.sum(inside[:,column(j)] & inside[:,column(k)])
+        leftoff+=1
     return overlapnums,leftoff
 
-def generate_sources(n_sources, start_survey, end_survey, fl_min, fl_max, dmin, dmax, lightcurve, burstlength, burstflux):
+def generate_sources(n_sources, start_survey, end_survey, fl_min, fl_max, dmin, dmax, lightcurve, burstlength, burstflux, rng=None):
     """Generate characteristic fluxes and characteristic durations for simulated sources. Return as numpy array"""
     
     start_epoch = datetime.datetime(1858, 11, 17, 00, 00, 00, 00)
-    rng = np.random.default_rng()
+    rng = np.random.default_rng(rng)
     bursts = np.zeros(n_sources, dtype={'names': ('chartime', 'chardur','charflux'), 'formats': ('f8','f8','f8')}) # initialise the numpy array
     if not np.isnan(burstlength):
         bursts['chardur'] += burstlength
@@ -309,93 +579,893 @@ def generate_sources(n_sources, start_survey, end_survey, fl_min, fl_max, dmin,
         exit()
     return bursts
     
-def generate_start(bursts, potential_start, potential_end, n_sources):
+def generate_start(bursts, potential_start, potential_end, n_sources, rng=None):
     """Generate characteristic times to go with durations and fluxes. Return modified numpy array"""
     
-    rng = np.random.default_rng() 
+    rng = np.random.default_rng(rng)
     bursts['chartime'] = rng.random(n_sources)*(potential_end - potential_start) + potential_start
     bursts.sort(axis=0,order='chartime')
     return bursts
     
 
-def detect_bursts(obs, flux_err,  det_threshold, sources, fluxint):
+def detect_bursts(obs, flux_err,  det_threshold, sources, fluxint, rng=None, segments=None, max_mem=None, support=None, kernel=None):
     """Detect simulated sources by using a series of conditionals along with the integrated flux calculation. Returns detected sources and the boolean array to get source indices"""
     
-    rng = np.random.default_rng() 
-    if (obs['gaps']!="False").any():
-        detections = np.zeros((len(obs),len(sources)),dtype=bool)
-        detbool = np.zeros(len(sources)*len(obs),dtype=bool)
-        for i,o in enumerate(obs):
-            if o['gaps']!=False:
-                subobs, _ = observing_strategy(o['gaps'], det_threshold, 1, 1, 1, 1, 1) # We are giving the scansfile name, so the other variables are unimportant, we set them to 1 
-                flux_int = np.zeros((len(sources)),dtype=np.float32)
-                subfluxint = np.zeros([len(subobs),len(sources)], dtype=np.float32)
-                for j,s in enumerate(subobs):
-                    end_subobs = s['start']+s['duration']
-                    start_subobs = s['start']
-                    F0_o = sources['charflux']
-                    error = np.sqrt((F0_o * flux_err)**2 + (o['sens']/det_threshold)**2) 
-                    F0 =rng.normal(F0_o, error)
-                    F0[(F0<0)] = F0[(F0<0)]*0
-                    tcrit = sources['chartime']
-                    tau = sources['chardur']
-                    subfluxint[j] = fluxint(F0, tcrit, tau, end_subobs, start_subobs)
-                    subfluxint[j][subfluxint[j] < 0] = 0
-                flux_int = np.average(subfluxint,weights=subobs['duration']/np.sum(subobs['duration']),axis=0)
-                flux_int[flux_int < 0] = 0
-            else:
-                flux_int = np.zeros((len(sources)),dtype=np.float32)
-                F0_o = sources['charflux']
-                tcrit = sources['chartime']
-                tau = sources['chardur']
-                end_obs = o['start']+o['duration']
-                start_obs = o['start']
-                error = np.sqrt((F0_o * flux_err)**2 + (o['sens']/det_threshold)**2) 
-                F0 =rng.normal(F0_o, error)
-                F0[(F0<0)] = F0[(F0<0)]*0
-                flux_int = fluxint(F0, tcrit, tau, end_obs, start_obs)
-                flux_int[flux_int < 0] = 0
-            sensitivity = o['sens']
-            detections[i] = (flux_int > sensitivity)
-        constant = np.all(detections==True, axis=0)
-        detectany = np.any(detections==True,axis=0)
-        detections = detectany & np.logical_not(constant)
-            
-    else:  # vectorized
-        sensitivity = np.tile(obs['sens'],len(sources))
-        F0_o = np.repeat(sources['charflux'],len(obs))
+    rng = np.random.default_rng(rng)
+    # Observations with a scans file are integrated scan by scan and the scans are averaged back into their observation, 
+    # weighted by duration. An observation without scans is a single scan of weight one, so every source and every scan 
+    # is done in one go however the schedule is made up.
+    if segments is None:
+        segments = observation_segments(obs, det_threshold)
+    if kernel is not None: # a compiled loop of the jit backend, see RaTS.jitkernels
+        detections = detect_fused(obs, flux_err, det_threshold, sources, kernel, rng, segments, support)
+        return sources[detections], detections
+    if support is not None: # the light curve says when it is on, so only the pairs that can overlap are integrated
+        detections = detect_sparse(obs, flux_err, det_threshold, sources, fluxint, rng, segments, max_mem, support)
+        return sources[detections], detections
+    nseg = len(segments)
+    sensitivity = obs['sens'][segments['obs']]
+    end_obs = segments['start']+segments['duration']
+    start_obs = segments['start']
+    firstseg = np.searchsorted(segments['obs'], np.arange(len(obs)))
+    detections = np.zeros(len(sources),dtype=bool)
+    # Sources go down the first axis and scans along the second, so each source only needs broadcasting rather than 
+    # copying. Sources are done in chunks so that the (sources, scans) temporaries stay under max_mem, and noise is 
+    # drawn source by source in the same order whatever the chunk size.
+    chunk = chunk_length(nseg, max_mem, len(sources))
+    for c in range(0, len(sources), chunk):
+        chunksources = sources[c:c+chunk]
+        F0_o = chunksources['charflux'][:,None]
         error = np.sqrt((F0_o * flux_err)**2 + (sensitivity/det_threshold)**2) 
         # error = F0_o*flux_err
         F0 =rng.normal(F0_o, error)
         # F0=F0_o
-        F0[(F0<0)] = F0[(F0<0)]*0
-        t0 = np.repeat(sources['chartime'],len(obs))
-        tau0 = np.repeat(sources['chardur'],len(obs))
-       #  print(tau0.min(),tau0.max(),obs['duration'].min(),obs['duration'].max())
-       #  print("^durations")
-        end_obs = np.tile(obs['start']+obs['duration'],len(sources))
-        start_obs = np.tile(obs['start'],len(sources))
+        F0[(F0<0)] = 0
+        t0 = chunksources['chartime'][:,None]
+        tau0 = chunksources['chardur'][:,None]
         flux_int = fluxint(F0, t0, tau0, end_obs, start_obs) # uses whatever class of lightcurve supplied: tophat, ered, etc      
-       #  for f,t,d,t1,t2,fi in zip(F0,t0,tau0,start_obs,end_obs,flux_int):
-       #      print(f,t,d,t1,t2,fi)
         flux_int[flux_int < 0] = 0
-        detections = (flux_int > sensitivity).reshape(len(sources),len(obs)).transpose()
-        constant = np.all(detections==True, axis=0)
-        detectany = np.any(detections==True,axis=0)
-        nondetect = np.all(detections==False,axis=0)
-       #  print(np.sum(constant), "constant sources")
-       #  print(np.sum(detectany), "total detections")
-       #  print(np.sum(nondetect), "total undetected")
-        detections = detectany & np.logical_not(constant)
+        if nseg > len(obs):
+            flux_int = np.add.reduceat(flux_int*segments['weight'], firstseg, axis=1)
+        chunkdetections = (flux_int > obs['sens'])
+        constant = np.all(chunkdetections, axis=1)
+        detectany = np.any(chunkdetections, axis=1)
+        detections[c:c+chunk] = detectany & np.logical_not(constant)
 
     return sources[detections], detections
 
-def statistics(fl_min, fl_max, dmin, dmax, det, all_simulated):
+# Rough number of float64 arrays of shape (sources, scans) alive at once while detecting a chunk of sources
+_TEMPORARIES = 16
+
+def chunk_length(nseg, max_mem, nsources):
+    """Number of sources that can be detected at once while keeping the (sources, scans) temporaries under max_mem bytes. Return an int"""
+
+    if max_mem is None:
+        return max(nsources, 1)
+    return int(max(1, max_mem // (nseg*8*_TEMPORARIES)))
+
+def observation_window(obs, windowstart, windowend):
+    """Find the observations that overlap each source's support window. The observations are sorted by start time, so 
+    the first one is found from the running maximum of the end times. Return the first and one past the last observation of each source"""
+
+    obsend = np.maximum.accumulate(obs['start'] + obs['duration'])
+    first = np.searchsorted(obsend, windowstart, side='right')
+    last = np.searchsorted(obs['start'], windowend, side='left')
+    return first, np.maximum(first, last)
+
+def candidate_pairs(segments, firstseg, first, last):
+    """List every scan of every observation a source can overlap, source by source. Return the source and scan of each 
+    pair, and the source, observation and first pair of each (source, observation) group"""
+
+    nobs = last - first
+    groupsrc = np.repeat(np.arange(len(first)), nobs)
+    groupobs = np.arange(len(groupsrc)) - np.repeat(np.cumsum(nobs) - nobs, nobs) + np.repeat(first, nobs)
+    nscans = np.diff(np.append(firstseg, len(segments)))[groupobs]
+    groupfirst = np.cumsum(nscans) - nscans
+    pairsrc = np.repeat(groupsrc, nscans)
+    pairseg = np.arange(len(pairsrc)) - np.repeat(groupfirst, nscans) + np.repeat(firstseg[groupobs], nscans)
+    return pairsrc, pairseg, groupsrc, groupobs, groupfirst
+
+def pair_chunks(npairs, max_mem):
+    """Split the sources into chunks whose candidate pairs stay under max_mem bytes. Return the first source of every chunk followed by the number of sources"""
+
+    if max_mem is None or len(npairs) == 0:
+        return np.array([0, len(npairs)])
+    budget = max(1, max_mem // (8*_TEMPORARIES))
+    cumpairs = np.cumsum(npairs)
+    bounds = np.searchsorted(cumpairs, np.arange(budget, cumpairs[-1], budget), side='right')
+    return np.unique(np.concatenate(([0], bounds, [len(npairs)])))
+
+def sparse_chunks(obs, segments, sources, support, max_mem):
+    """Find the candidate pairs of every source and hand them out a chunk of sources at a time. Yield the chunk's first source, its sources and its pairs"""
+
+    firstseg = np.searchsorted(segments['obs'], np.arange(len(obs)))
+    first, last = observation_window(obs, *support(sources['chartime'], sources['chardur']))
+    segbound = np.append(firstseg, len(segments))
+    bounds = pair_chunks(segbound[last] - segbound[first], max_mem)
+    for c, cend in zip(bounds[:-1], bounds[1:]):
+        pairs = candidate_pairs(segments, firstseg, first[c:cend], last[c:cend])
+        yield c, sources[c:cend], pairs
+
+def group_detections(obs, nsources, pairs, flux_int):
+    """Average the weighted scan fluxes of each (source, observation) group and compare them to the sensitivity. Return the boolean array of detected sources"""
+
+    pairsrc, pairseg, groupsrc, groupobs, groupfirst = pairs
+    if len(groupfirst) == 0:
+        return np.zeros(nsources, dtype=bool)
+    flux_int = np.add.reduceat(flux_int, groupfirst)
+    ndetected = np.bincount(groupsrc, weights=(flux_int > obs['sens'][groupobs]), minlength=nsources)
+    # an observation outside the window sees no flux, so a source is only constant if every observation is a candidate and detected
+    return (ndetected > 0) & (ndetected < len(obs))
+
+def detect_sparse(obs, flux_err, det_threshold, sources, fluxint, rng, segments, max_mem, support):
+    """Detect sources by integrating only the scans that fall inside each source's support window. Returns the boolean array of detected sources"""
+
+    detections = np.zeros(len(sources), dtype=bool)
+    end_obs = segments['start'] + segments['duration']
+    for c, chunksources, pairs in sparse_chunks(obs, segments, sources, support, max_mem):
+        pairsrc, pairseg = pairs[:2]
+        F0_o = chunksources['charflux'][pairsrc]
+        error = np.sqrt((F0_o * flux_err)**2 + (obs['sens'][segments['obs'][pairseg]]/det_threshold)**2)
+        F0 = rng.normal(F0_o, error)
+        F0[(F0<0)] = 0
+        flux_int = fluxint(F0, chunksources['chartime'][pairsrc], chunksources['chardur'][pairsrc], end_obs[pairseg], segments['start'][pairseg])
+        flux_int[flux_int < 0] = 0
+        detections[c:c+len(chunksources)] = group_detections(obs, len(chunksources), pairs, flux_int*segments['weight'][pairseg])
+    return detections
+
+# Number of noise draws made at a time for the jit backend, the only array it needs per (source, scan) pair
+_NOISEBLOCK = 2**16
+
+def detect_fused(obs, flux_err, det_threshold, sources, kernel, rng, segments, support):
+    """Detect sources with a compiled kernel that adds the noise, integrates and compares each source to the observations
+    in one pass. The noise is drawn in the same order as the numpy backend draws it, so the detections are the same. 
+    Returns the boolean array of detected sources"""
+
+    firstseg = np.searchsorted(segments['obs'], np.arange(len(obs)))
+    segbound = np.append(firstseg, len(segments))
+    if support is None:
+        first, last = np.zeros(len(sources), dtype=int), np.full(len(sources), len(obs))
+    else:
+        first, last = observation_window(obs, *support(sources['chartime'], sources['chardur']))
+    # pair_chunks budgets _TEMPORARIES arrays per pair, the kernel only keeps the noise
+    bounds = pair_chunks(segbound[last] - segbound[first], _NOISEBLOCK*8*_TEMPORARIES)
+    detections = np.zeros(len(sources), dtype=bool)
+    end_obs = segments['start'] + segments['duration']
+    segsens = obs['sens'][segments['obs']]
+    for c, cend in zip(bounds[:-1], bounds[1:]):
+        noise = rng.standard_normal(np.sum(segbound[last[c:cend]] - segbound[first[c:cend]]))
+        kernel(sources['charflux'][c:cend], sources['chartime'][c:cend], sources['chardur'][c:cend], first[c:cend], last[c:cend], 
+            segbound, segments['start'], end_obs, segments['weight'], segsens, obs['sens'], float(flux_err), float(det_threshold), noise, detections[c:cend])
+    return detections
+
+def parse_memory(size):
+    """Convert a memory size such as 512M or 4G into bytes. Return an int, or None if no size is given"""
+
+    if size is None:
+        return None
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    size = str(size).strip().upper().rstrip('B')
+    if size[-1] in units:
+        return int(float(size[:-1])*units[size[-1]])
+    return int(float(size))
+
+def observation_segments(obs, det_threshold):
+    """Split observations with a scans file into their scans. Return a structured array with the start, duration and weight of every scan and the index of the observation it belongs to"""
+
+    hasscans = obs['gaps']!='False'
+    # an observation without scans is a single scan covering the whole observation
+    nscans = np.ones(len(obs), dtype=int)
+    subobslist = [read_scans(gapsfile, det_threshold) for gapsfile in obs['gaps'][hasscans]]
+    nscans[hasscans] = [len(subobs) for subobs in subobslist]
+    segments = np.zeros(np.sum(nscans), dtype={'names': ('start', 'duration', 'weight', 'obs'), 'formats': ('f8','f8','f8','i8')})
+    segments['obs'] = np.repeat(np.arange(len(obs)), nscans)
+    segments['start'] = np.repeat(obs['start'], nscans)
+    segments['duration'] = np.repeat(obs['duration'], nscans)
+    segments['weight'] = 1
+    firstseg = np.cumsum(nscans) - nscans
+    for i, subobs in zip(np.flatnonzero(hasscans), subobslist):
+        seg = segments[firstseg[i]:firstseg[i]+nscans[i]]
+        seg['start'] = subobs['start']
+        seg['duration'] = subobs['duration']
+        seg['weight'] = subobs['duration']/np.sum(subobs['duration'])
+    return segments
+
+def unit_fluxint(segments, sources, fluxint, pairs=None):
+    """Integrate every source over every scan with a characteristic flux of one. Every fluxint is linear in F0, so this can be rescaled to any flux. Return an array of shape (sources, scans), or one value per candidate pair if pairs are given"""
+
+    end_obs = segments['start']+segments['duration']
+    if pairs is not None:
+        pairsrc, pairseg = pairs[:2]
+        unit = fluxint(np.ones(len(pairsrc)), sources['chartime'][pairsrc], sources['chardur'][pairsrc], end_obs[pairseg], segments['start'][pairseg])
+        unit[unit < 0] = 0
+        return unit
+    unit = fluxint(np.ones((len(sources),1)), sources['chartime'][:,None], sources['chardur'][:,None], end_obs, segments['start'])
+    unit = np.broadcast_to(unit, (len(sources),len(segments))).copy() # a constant light curve may not broadcast by itself
+    unit[unit < 0] = 0
+    return unit
+
+def detect_scaled(obs, segments, flux_err, det_threshold, charflux, unit, noise, pairs=None):
+    """Detect sources from their unit flux integrals, given their characteristic fluxes and standard normal draws for the flux errors. Returns the boolean array of detected sources"""
+
+    if pairs is not None: # unit and noise are given for the candidate pairs only
+        pairsrc, pairseg = pairs[:2]
+        error = np.sqrt((charflux[pairsrc] * flux_err)**2 + (obs['sens'][segments['obs'][pairseg]]/det_threshold)**2)
+        F0 = charflux[pairsrc] + error*noise
+        F0[(F0<0)] = 0
+        return group_detections(obs, len(charflux), pairs, F0*unit*segments['weight'][pairseg])
+    sens = obs['sens'][segments['obs']]
+    error = np.sqrt((charflux[:,None] * flux_err)**2 + (sens/det_threshold)**2)
+    F0 = charflux[:,None] + error*noise
+    F0[(F0<0)] = 0
+    # F0 is never negative, so clipping F0*unit is the same as clipping the integral as detect_bursts does
+    firstseg = np.searchsorted(segments['obs'], np.arange(len(obs)))
+    flux_int = np.add.reduceat(F0*unit*segments['weight'], firstseg, axis=1)
+    detections = flux_int > obs['sens']
+    constant = np.all(detections, axis=1)
+    detectany = np.any(detections, axis=1)
+    return detectany & np.logical_not(constant)
+
+# Settings shared by every bin of the grid currently being simulated. Worker processes receive these once through
+# init_grid rather than once per duration row.
+_gridsetup = {}
+
+def init_grid(setup):
+    """Store the settings shared by all bins of a grid in this process. Returns nothing"""
+
+    global _gridsetup
+    _gridsetup = setup
+    _scancache.update(setup['scans'])
+    _gridsetup['kernel'] = None
+    if setup['backend'] == 'jit': # compiled in every process, the compiled loop cannot be sent to the workers
+        from RaTS import jitkernels
+        _gridsetup['kernel'] = jitkernels.detection_kernel(setup['lightcurve'])
+
+def simulate_row(task):
+    """Simulate and detect sources in every flux bin of one duration row. Return the stats rows, detected sources per flux bin, timings, and the sources and detections of the last bin if asked for"""
+
+    flux_bins, ldurbin, rdurbin, rowseed, keeplast = task
+    g = _gridsetup
+    lightcurve = g['lightcurve']
+    targetnum = g['targetnum']
+    nflux = len(flux_bins) - 1
+    stats = np.zeros((nflux, 5), dtype=np.float32)
+    detectedsources = np.zeros(nflux, dtype=int)
+    srcsimtime = 0
+    dettime = 0
+    stattime = 0
+    thisdur = (ldurbin+rdurbin)/2
+    # Every bin gets its own random stream so that results do not depend on how rows are spread over workers
+    binseeds = rowseed.spawn(nflux)
+    for fluxind,(lfluxbin,rfluxbin) in enumerate(zip(flux_bins[:-1],flux_bins[1:])):
+        rng = np.random.default_rng(binseeds[fluxind])
+        thisflux = (lfluxbin + rfluxbin)/2
+        # With a tolerance the bin is simulated in batches until the confidence interval on its probability is narrow
+        # enough, otherwise it is a single batch of targetnum sources
+        batch = targetnum if g['tolerance'] is None else g['minsources']
+        nsources = 0
+        ndetected = 0
+        kept = []
+        while batch > 0:
+            t1 = datetime.datetime.now()
+            bursts = generate_sources(batch, #n_sources
+                g['startepoch'], #start_survey
+                g['stopepoch'], #end_survey
+                lfluxbin, #Flux min
+                rfluxbin, #Flux max
+                ldurbin, # duration min
+                rdurbin,  #duration max
+                g['lightcurvetype'],
+                g['burstlength'],
+                g['burstflux'],
+                rng=rng)
+            if g['fixedstart'] is None:
+                bursts = generate_start(bursts,
+                    lightcurve.earliest_crit_time(g['startepoch'],bursts['chardur']), # earliest crit time
+                    lightcurve.latest_crit_time(g['stopepoch'],bursts['chardur']),  # latest crit time
+                    batch,
+                    rng=rng)
+            else: # every source starts at the same time, e.g. for the false detection pass
+                bursts['chartime'] += g['fixedstart']
+            t2 = datetime.datetime.now()
+            srcsimtime+= (t2-t1).total_seconds()
+            t1 = datetime.datetime.now()
+            # det are the sources themselves while detbool is a numpy boolean array indexing all sources
+            det, detbool = detect_bursts(g['obs'],
+                g['flux_err'],
+                g['det_threshold'],
+                bursts,
+                lightcurve.fluxint,
+                rng=rng,
+                segments=g['segments'],
+                max_mem=g['max_mem'],
+                support=getattr(lightcurve, 'support', None),
+                kernel=g['kernel'])
+            t2 = datetime.datetime.now()
+            dettime += (t2-t1).total_seconds()
+            nsources += batch
+            ndetected += np.sum(detbool)
+            if keeplast and fluxind == nflux - 1:
+                kept.append((bursts, detbool))
+            if g['tolerance'] is None:
+                break
+            halfwidth = binomial_halfwidth(ndetected, nsources, method=g['interval'])
+            batch = next_batch(nsources, halfwidth, g['tolerance'], g['maxsources'])
+        t1 = datetime.datetime.now()
+        stats[fluxind,0] = thisdur
+        stats[fluxind,1] = thisflux
+        stats[fluxind,2] = np.nan_to_num(ndetected/nsources) # probability for this bin
+        if g['tolerance'] is not None: # the number of sources it took and the half width of the confidence interval
+            stats[fluxind,3] = nsources
+            stats[fluxind,4] = halfwidth
+        detectedsources[fluxind] += ndetected
+        t2= datetime.datetime.now()
+        stattime += (t2-t1).total_seconds()
+    if keeplast:
+        bursts = np.concatenate([k[0] for k in kept])
+        detbool = np.concatenate([k[1] for k in kept])
+    else:
+        bursts = None
+        detbool = None
+    return stats, detectedsources, (srcsimtime, dettime, stattime), bursts, detbool
+
+def binomial_halfwidth(ndetected, nsources, confidence=0.95, method='wilson'):
+    """Work out the confidence interval on the probability of detecting ndetected out of nsources sources with the Wilson 
+    score or the exact Clopper-Pearson method. Return the half width of the interval"""
+
+    from scipy.special import ndtri, betaincinv
+    if method == 'wilson':
+        z = ndtri((1 + confidence)/2)
+        p = ndetected/nsources
+        return z/(1 + z**2/nsources)*np.sqrt(p*(1 - p)/nsources + z**2/(4*nsources**2))
+    if method != 'clopper-pearson':
+        raise ValueError(f"Unknown confidence interval {method}, use wilson or clopper-pearson")
+    alpha = 1 - confidence
+    lower = betaincinv(ndetected, nsources - ndetected + 1, alpha/2) if ndetected > 0 else 0.
+    upper = betaincinv(ndetected + 1, nsources - ndetected, 1 - alpha/2) if ndetected < nsources else 1.
+    return (upper - lower)/2
+
+def next_batch(nsources, halfwidth, tolerance, maxsources):
+    """Number of sources to simulate next so that the confidence interval, which narrows as one over the square root of 
+    the number of sources, reaches the tolerance. At most doubles the sources so far. Return 0 once the interval is 
+    narrow enough or maxsources are simulated"""
+
+    if halfwidth <= tolerance or nsources >= maxsources:
+        return 0
+    batch = np.ceil(nsources*((halfwidth/tolerance)**2 - 1))
+    return int(min(max(batch, nsources//8, 1), nsources, maxsources - nsources))
+
+def simulate_row_unitflux(task):
+    """Simulate one duration row with a single set of sources whose unit flux integrals are rescaled into every flux bin. Return the same as simulate_row"""
+
+    flux_bins, ldurbin, rdurbin, rowseed, keeplast = task
+    g = _gridsetup
+    lightcurve = g['lightcurve']
+    targetnum = g['targetnum']
+    segments = g['segments']
+    nflux = len(flux_bins) - 1
+    stats = np.zeros((nflux, 5), dtype=np.float32)
+    detectedsources = np.zeros(nflux, dtype=int)
+    dettime = 0
+    stattime = 0
+    thisdur = (ldurbin+rdurbin)/2
+    rng = np.random.default_rng(rowseed)
+    t1 = datetime.datetime.now()
+    # Fluxes are drawn between 0 and 1 and rescaled into each flux bin below. All flux bins share the same start times, 
+    # durations and noise draws (common random numbers), which keeps the probability surface smooth along the flux axis.
+    bursts = generate_sources(targetnum, g['startepoch'], g['stopepoch'], 0, 1, ldurbin, rdurbin, g['lightcurvetype'], g['burstlength'], g['burstflux'], rng=rng)
+    if g['fixedstart'] is None:
+        bursts = generate_start(bursts,
+            lightcurve.earliest_crit_time(g['startepoch'],bursts['chardur']), # earliest crit time
+            lightcurve.latest_crit_time(g['stopepoch'],bursts['chardur']),  # latest crit time
+            targetnum,
+            rng=rng)
+    else: # every source starts at the same time, e.g. for the false detection pass
+        bursts['chartime'] += g['fixedstart']
+    fluxfrac = np.copy(bursts['charflux'])
+    t2 = datetime.datetime.now()
+    srcsimtime = (t2-t1).total_seconds()
+    detbool = np.zeros(targetnum, dtype=bool)
+    # The unit integrals and noise draws are (sources, scans) arrays, or one value per candidate pair if the light curve 
+    # has a support window, so they are made one chunk of sources at a time. Drawing the noise chunk by chunk gives the 
+    # same numbers as one big draw.
+    support = getattr(lightcurve, 'support', None)
+    if support is None:
+        chunk = chunk_length(len(segments), g['max_mem'], targetnum)
+        chunks = ((c, bursts[c:c+chunk], None) for c in range(0, targetnum, chunk))
+    else:
+        chunks = sparse_chunks(g['obs'], segments, bursts, support, g['max_mem'])
+    for c, chunksources, pairs in chunks:
+        t1 = datetime.datetime.now()
+        if pairs is None:
+            noise = rng.standard_normal((len(chunksources), len(segments)))
+        else:
+            noise = rng.standard_normal(len(pairs[0]))
+        t2 = datetime.datetime.now()
+        srcsimtime += (t2-t1).total_seconds()
+        t1 = datetime.datetime.now()
+        unit = unit_fluxint(segments, chunksources, lightcurve.fluxint, pairs)
+        for fluxind,(lfluxbin,rfluxbin) in enumerate(zip(flux_bins[:-1],flux_bins[1:])):
+            if np.isnan(g['burstflux']):
+                charflux = fluxfrac[c:c+len(chunksources)]*(rfluxbin - lfluxbin) + lfluxbin
+            else:
+                charflux = chunksources['charflux']
+            chunkdetbool = detect_scaled(g['obs'], segments, g['flux_err'], g['det_threshold'], charflux, unit, noise, pairs)
+            detectedsources[fluxind] += np.sum(chunkdetbool)
+            if fluxind == nflux - 1:
+                detbool[c:c+len(chunksources)] = chunkdetbool
+        t2 = datetime.datetime.now()
+        dettime += (t2-t1).total_seconds()
+    t1 = datetime.datetime.now()
+    for fluxind,(lfluxbin,rfluxbin) in enumerate(zip(flux_bins[:-1],flux_bins[1:])):
+        stats[fluxind,0] = thisdur
+        stats[fluxind,1] = (lfluxbin + rfluxbin)/2
+        stats[fluxind,2] = np.nan_to_num(detectedsources[fluxind]/targetnum) # probability for this bin
+    t2= datetime.datetime.now()
+    stattime += (t2-t1).total_seconds()
+    if keeplast:
+        if np.isnan(g['burstflux']):
+            bursts['charflux'] = fluxfrac*(flux_bins[-1] - flux_bins[-2]) + flux_bins[-2]
+    else:
+        bursts = None
+        detbool = None
+    return stats, detectedsources, (srcsimtime, dettime, stattime), bursts, detbool
+
+# The grid engine draws and detects the sources of the whole grid in blocks of this many, each with its own random 
+# stream, so that its results do not depend on --chunksize or --workers
+_GRIDBLOCK = 2**14
+
+def grid_blocks(dur_ints, flux_bins, targetnum, seed):
+    """Lay out targetnum sources for every bin of the grid of dur_ints and flux_bins, bin after bin, and split them into 
+    blocks of _GRIDBLOCK sources with a seed each. Return the tasks of simulate_grid_block"""
+
+    total = targetnum*(len(dur_ints) - 1)*(len(flux_bins) - 1)
+    bounds = np.append(np.arange(0, total, _GRIDBLOCK), total)
+    return [(dur_ints, flux_bins, first, last, blockseed) for first, last, blockseed in zip(bounds[:-1], bounds[1:], seed.spawn(len(bounds) - 1))]
+
+def simulate_grid_block(task):
+    """Draw the sources first to last of the grid of grid_blocks, each uniformly within its bin as the bins engine draws 
+    them, and detect them at most chunksize at a time. Return the sources, their detections and timings"""
+
+    dur_ints, flux_bins, first, last, blockseed = task
+    g = _gridsetup
+    lightcurve = g['lightcurve']
+    rng = np.random.default_rng(blockseed)
+    t1 = datetime.datetime.now()
+    durbin, fluxbin = np.divmod(np.arange(first, last)//g['targetnum'], len(flux_bins) - 1)
+    # generate_sources draws between 0 and 1 here, which is stretched over the bin of each source
+    bursts = generate_sources(last - first, g['startepoch'], g['stopepoch'], 0, 1, 0, 1, g['lightcurvetype'], g['burstlength'], g['burstflux'], rng=rng)
+    if np.isnan(g['burstlength']):
+        bursts['chardur'] = dur_ints[durbin] + bursts['chardur']*(dur_ints[durbin+1] - dur_ints[durbin])
+    if np.isnan(g['burstflux']):
+        bursts['charflux'] = flux_bins[fluxbin] + bursts['charflux']*(flux_bins[fluxbin+1] - flux_bins[fluxbin])
+    if g['fixedstart'] is None:
+        # drawn as generate_start draws them, but not sorted by time so that every source keeps its place in the grid
+        earliest = lightcurve.earliest_crit_time(g['startepoch'], bursts['chardur'])
+        latest = lightcurve.latest_crit_time(g['stopepoch'], bursts['chardur'])
+        bursts['chartime'] = rng.random(len(bursts))*(latest - earliest) + earliest
+    else: # every source starts at the same time, e.g. for the false detection pass
+        bursts['chartime'] += g['fixedstart']
+    t2 = datetime.datetime.now()
+    srcsimtime = (t2-t1).total_seconds()
+    t1 = datetime.datetime.now()
+    detbool = np.zeros(len(bursts), dtype=bool)
+    chunksize = g['chunksize'] or len(bursts)
+    for c in range(0, len(bursts), chunksize):
+        _, detbool[c:c+chunksize] = detect_bursts(g['obs'],
+            g['flux_err'],
+            g['det_threshold'],
+            bursts[c:c+chunksize],
+            lightcurve.fluxint,
+            rng=rng,
+            segments=g['segments'],
+            max_mem=g['max_mem'],
+            support=getattr(lightcurve, 'support', None),
+            kernel=g['kernel'])
+    t2 = datetime.datetime.now()
+    dettime = (t2-t1).total_seconds()
+    return bursts, detbool, (srcsimtime, dettime, 0.)
+
+def grid_stats(setup, dur_ints, flux_bins, blocks, keeplast):
+    """Bin the durations and fluxes of all the sources of simulate_grid_block over the grid with statistics in one pass. 
+    Return the same as simulate_row for the whole grid"""
+
+    targetnum = setup['targetnum']
+    nflux = len(flux_bins) - 1
+    bursts = np.concatenate([b[0] for b in blocks])
+    detbool = np.concatenate([b[1] for b in blocks])
+    srcsimtime, dettime, stattime = np.sum([b[2] for b in blocks], axis=0)
+    t1 = datetime.datetime.now()
+    durbin, fluxbin = np.divmod(np.arange(len(bursts))//targetnum, nflux)
+    # A fixed burstlength or burstflux lies outside the bins, so those sources are counted in the bin they were drawn for
+    binned = np.copy(bursts)
+    if not np.isnan(setup['burstlength']):
+        binned['chardur'] = ((dur_ints[:-1] + dur_ints[1:])/2)[durbin]
+    if not np.isnan(setup['burstflux']):
+        binned['charflux'] = ((flux_bins[:-1] + flux_bins[1:])/2)[fluxbin]
+    stats = statistics(flux_bins[0], flux_bins[-1], dur_ints[0], dur_ints[-1], binned[detbool], binned, flux_bins=flux_bins, dur_ints=dur_ints)
+    stats[:,3:] = 0 # only the bins engine with a tolerance fills these, with its number of sources and half width
+    detectedsources = np.bincount(fluxbin[detbool], minlength=nflux)
+    t2 = datetime.datetime.now()
+    stattime += (t2-t1).total_seconds()
+    if keeplast: # the sources of the last bin are the last ones laid out
+        return stats, detectedsources, (srcsimtime, dettime, stattime), bursts[-targetnum:], detbool[-targetnum:]
+    return stats, detectedsources, (srcsimtime, dettime, stattime), None, None
+
+def simulate_row_grid(task):
+    """Simulate one duration row, e.g. a row of cells of simulate_adaptive, as a grid of its own with the blocks of the 
+    grid engine. Return the same as simulate_row"""
+
+    flux_bins, ldurbin, rdurbin, rowseed, keeplast = task
+    dur_ints = np.array([ldurbin, rdurbin])
+    blocks = [simulate_grid_block(block) for block in grid_blocks(dur_ints, flux_bins, _gridsetup['targetnum'], rowseed)]
+    return grid_stats(_gridsetup, dur_ints, flux_bins, blocks, keeplast)
+
+# Gauss-Legendre nodes per critical time panel, and per 0.05 dex (the bin width of simulate.py) of the duration and flux 
+# bins, of the analytic engine
+_PANELNODES = 5
+_BINNODES = 2
+# Largest number of (critical time, flux, observation) values the analytic engine works on at once
+_ANALYTICBLOCK = 2**22
+# Observations are taken to never detect a source that is more than this many standard deviations below their sensitivity
+_NEVERSEEN = -10
+# An observation detects a source for certain, or never, when its flux is more than this many standard deviations from 
+# its sensitivity, 1 - ndtr(8) = 6e-16. Only every _FLUXSTRIDE-th flux is checked against it first
+_SATURATED = 8
+_FLUXSTRIDE = 8
+
+def detection_probability(obs, segments, unit, fluxes, flux_err, det_threshold):
+    """Work out the probability that sources with the unit flux integrals unit, an array of shape (sources, scans), and 
+    the characteristic fluxes fluxes are seen in at least one observation but not in all of them. The flux of every scan 
+    has the normal noise of detect_bursts, so each observation is detected with a normal CDF probability; the clipping of
+    negative fluxes is ignored for observations with several scans, where it only matters for undetectable sources. 
+    Return an array of shape (sources, fluxes)"""
+
+    from scipy.special import ndtr
+    firstseg = np.searchsorted(segments['obs'], np.arange(len(obs)))
+    weighted = unit*segments['weight']
+    # the mean and variance of the flux of an observation are a*F and b*F**2 + c for a characteristic flux F
+    a = np.add.reduceat(weighted, firstseg, axis=1)
+    b = np.add.reduceat(weighted**2, firstseg, axis=1)*flux_err**2
+    c = np.add.reduceat((weighted*obs['sens'][segments['obs']]/det_threshold)**2, firstseg, axis=1)
+    fluxorder = np.argsort(fluxes, kind='stable')
+    fluxes = np.asarray(fluxes, dtype=np.float64)[fluxorder]
+    nflux = len(fluxes)
+    # x = (a*F - sens)/sqrt(b*F**2 + c) grows with F, so it is only worked out on every _FLUXSTRIDE-th flux to bracket 
+    # the fluxes at which an observation is neither certain to miss nor certain to detect a source
+    coarse = np.unique(np.r_[np.arange(0, nflux, _FLUXSTRIDE), nflux - 1])
+    bound = np.r_[coarse, nflux]
+    probability = np.zeros((len(unit), nflux))
+    block = max(1, _ANALYTICBLOCK//(len(fluxes)*len(obs)))
+    for i in range(0, len(unit), block):
+        # observations that cannot detect a source even at the largest flux are left out, so the normal CDF is only 
+        # worked out for the others, source by source. A source is only detected in all observations if none is left out
+        with np.errstate(all='ignore'):
+            largest = (fluxes[-1]*a[i:i+block] - obs['sens'])/np.sqrt(fluxes[-1]**2*b[i:i+block] + c[i:i+block])
+        source, seen = np.nonzero(largest > _NEVERSEEN)
+        nseen = np.bincount(source, minlength=len(a[i:i+block]))
+        some = np.flatnonzero(nseen > 0)
+        if len(some) == 0:
+            continue
+        everywhere = nseen[some] == len(obs)
+        first = np.cumsum(nseen)[some] - nseen[some]
+        pa, pb, pc, psens = a[i+source,seen], b[i+source,seen], c[i+source,seen], obs['sens'][seen]
+        # an observation that can detect a source has c > 0, so x is never undefined here
+        x = (fluxes[coarse]*pa[:,None] - psens[:,None])/np.sqrt(fluxes[coarse]**2*pb[:,None] + pc[:,None])
+        # an observation misses a source for certain below the flux miss and detects it for certain from the flux hit on
+        miss = np.where(x[:,0] > -_SATURATED, 0, bound[np.argmax(x > -_SATURATED, axis=1) - 1] + 1)
+        miss[x[:,-1] <= -_SATURATED] = nflux
+        hit = np.where(x[:,-1] > _SATURATED, bound[np.argmax(x > _SATURATED, axis=1)], nflux)
+        # Below the lowest miss every observation misses the source. From the lowest hit one observation detects it, so
+        # it is detected unless every observation does, which needs it to be seen everywhere and beyond the highest miss.
+        # The probability is only worked out below the lowest hit, and for sources seen everywhere from the highest miss
+        # to the highest hit, above which every observation detects them
+        lowmiss, highmiss = np.minimum.reduceat(miss, first), np.maximum.reduceat(miss, first)
+        lowhit, highhit = np.minimum.reduceat(hit, first), np.maximum.reduceat(hit, first)
+        columns = np.arange(nflux)
+        probability[i + some] = (columns >= lowhit[:,None]) & (~everywhere[:,None] | (columns < highmiss[:,None]))
+        owner = np.r_[np.arange(len(some)), np.flatnonzero(everywhere)]
+        lo = np.r_[lowmiss, np.maximum(highmiss, lowhit)[everywhere]]
+        width = np.maximum(np.r_[lowhit, highhit[everywhere]] - lo, 0)
+        # Every flux of every such window is a group of its source's observations, next to each other
+        group = np.repeat(owner, width)
+        column = np.repeat(lo, width) + np.arange(len(group)) - np.repeat(np.cumsum(width) - width, width)
+        size = nseen[some][group]
+        start = np.cumsum(size) - size
+        member = np.repeat(np.arange(len(group)), size)
+        pair = np.repeat(first[group] - start, size) + np.arange(len(member))
+        flux = np.repeat(fluxes[column], size)
+        x = (flux*pa[pair] - psens[pair])/np.sqrt(flux**2*pb[pair] + pc[pair])
+        detected = ndtr(x)
+        if len(group):
+            never = np.multiply.reduceat(1 - detected, start)
+            always = np.multiply.reduceat(detected, start)*everywhere[group]
+            probability[i + some[group], column] = 1 - never - always
+    return probability[:, np.argsort(fluxorder)]
+
+def false_detections(obs, flux_bins, nsources, flux_err, det_threshold):
+    """Work out how many sources of constant flux, nsources drawn uniformly in each flux bin, are detected in some but 
+    not all of the observations only because of the flux noise. Every observation sees the whole flux with the normal 
+    noise of detect_bursts, as in a run with a tophat longer than the survey. Return the expected number of detected
+    sources in each flux bin"""
+
+    constant = np.copy(obs)
+    constant['gaps'] = 'False' # a constant flux is the same in every scan
+    segments = observation_segments(constant, det_threshold)
+    fluxes, weights = bin_nodes(flux_bins[:-1], flux_bins[1:])
+    probability = detection_probability(constant, segments, np.ones((1, len(segments))), fluxes.ravel(), flux_err, det_threshold)
+    return nsources*(probability.reshape(len(flux_bins) - 1, -1) @ weights)
+
+def bin_nodes(lo, hi):
+    """Gauss-Legendre nodes for averaging over the bins from lo to hi, _BINNODES per 0.05 dex of the widest bin. Return
+    the nodes, an array of shape (bins, nodes), and their weights, which add up to one"""
+
+    n = _BINNODES*max(1, int(np.ceil(np.amax(np.log10(hi/lo))/0.05 - 1e-9)))
+    nodes, weights = np.polynomial.legendre.leggauss(n)
+    return ((lo + hi)/2)[:,None] + ((hi - lo)/2)[:,None]*nodes, weights/2
+
+def crit_time_breaks(lightcurve, segments, tau, earliest, latest):
+    """Find the critical times at which the critical time or an edge of the support window of the light curve crosses 
+    the start or end of a scan. In between the detection probability is smooth. Return the sorted breaks from earliest to latest"""
+
+    offsets = [0.]
+    if hasattr(lightcurve, 'support'):
+        offsets += [float(t) for t in np.ravel(lightcurve.support(np.zeros(1), np.full(1, tau)))]
+    offsets = np.array(offsets)[np.isfinite(offsets)]
+    edges = np.concatenate((segments['start'], segments['start'] + segments['duration']))
+    breaks = (edges[:,None] - offsets[None,:]).ravel()
+    breaks = breaks[(breaks > earliest) & (breaks < latest)]
+    return np.unique(np.concatenate(([earliest], breaks, [latest])))
+
+def crit_time_average(probability, breaks, atol, maxlevel=20):
+    """Average probability(tcrit), which returns an array per critical time, over the critical times from breaks[0] to 
+    breaks[-1] by adaptive Gauss-Legendre quadrature. The panels between the breaks are halved until halving changes 
+    their share of the average by less than atol times their share of the range. Return the average"""
+
+    nodes, weights = np.polynomial.legendre.leggauss(_PANELNODES)
+    total = breaks[-1] - breaks[0]
+    if not total > 0:
+        return probability(breaks[:1])[0]
+    def panels(lo, hi):
+        t = ((lo + hi)/2)[:,None] + ((hi - lo)/2)[:,None]*nodes
+        values = probability(t.ravel()).reshape(len(lo), len(nodes), -1)
+        return np.einsum('pnf,n->pf', values, weights)*((hi - lo)/2)[:,None]
+    lo, hi = breaks[:-1], breaks[1:]
+    coarse = panels(lo, hi)
+    integral = 0
+    for level in range(maxlevel):
+        mid = (lo + hi)/2
+        left, right = panels(lo, mid), panels(mid, hi)
+        # the panels are integrals over critical time, so their share of the average is divided by total too
+        done = np.all(np.abs(left + right - coarse) <= atol*(hi - lo)[:,None], axis=1)
+        integral += np.sum(left[done] + right[done], axis=0)
+        keep = ~done
+        lo, hi = np.concatenate((lo[keep], mid[keep])), np.concatenate((mid[keep], hi[keep]))
+        coarse = np.concatenate((left[keep], right[keep]))
+        if len(lo) == 0:
+            break
+    integral += np.sum(coarse, axis=0) # panels still not converged after maxlevel halvings
+    return integral/total
+
+def simulate_row_analytic(task):
+    """Work out the detection probability of every flux bin of one duration row without drawing any sources. It is 
+    averaged over the critical times by adaptive quadrature and over the durations and fluxes in each bin on Gauss-Legendre
+    nodes, with the flux noise marginalized analytically. Return the same as simulate_row, with the expected number of
+    detected sources and no sources"""
+
+    flux_bins, ldurbin, rdurbin, rowseed, keeplast = task
+    g = _gridsetup
+    lightcurve = g['lightcurve']
+    segments = g['segments']
+    nflux = len(flux_bins) - 1
+    stats = np.zeros((nflux, 5), dtype=np.float32)
+    t1 = datetime.datetime.now()
+    if np.isnan(g['burstlength']):
+        taus, tauweights = bin_nodes(np.array([ldurbin]), np.array([rdurbin]))
+        taus = taus[0]
+    else:
+        taus, tauweights = np.array([g['burstlength']], dtype=np.float64), np.ones(1)
+    if np.isnan(g['burstflux']):
+        fluxes, fluxweights = bin_nodes(flux_bins[:-1], flux_bins[1:])
+        fluxes = fluxes.ravel()
+    else:
+        fluxes, fluxweights = np.full(nflux, g['burstflux'], dtype=np.float64), np.ones(1)
+    prob = np.zeros(nflux)
+    for tau, tauweight in zip(taus, tauweights):
+        def probability(tcrit):
+            sources = np.zeros(len(tcrit), dtype={'names': ('chartime', 'chardur','charflux'), 'formats': ('f8','f8','f8')})
+            sources['chartime'] = tcrit
+            sources['chardur'] = tau
+            with np.errstate(over='ignore', invalid='ignore'): # light curves can overflow far from their critical time
+                unit = unit_fluxint(segments, sources, lightcurve.fluxint)
+            return detection_probability(g['obs'], segments, unit, fluxes, g['flux_err'], g['det_threshold'])
+        if g['fixedstart'] is None:
+            earliest = float(lightcurve.earliest_crit_time(g['startepoch'], tau))
+            latest = float(lightcurve.latest_crit_time(g['stopepoch'], tau))
+            average = crit_time_average(probability, crit_time_breaks(lightcurve, segments, tau, earliest, latest), g['atol'])
+        else: # every source starts at the same time, e.g. for the false detection pass
+            average = probability(np.array([g['fixedstart']], dtype=np.float64))[0]
+        prob += tauweight*(average.reshape(nflux, -1) @ fluxweights)
+    t2 = datetime.datetime.now()
+    dettime = (t2-t1).total_seconds()
+    stats[:,0] = (ldurbin+rdurbin)/2
+    stats[:,1] = (flux_bins[:-1] + flux_bins[1:])/2
+    stats[:,2] = np.clip(prob, 0, 1) # probability for this bin
+    return stats, prob*g['targetnum'], (0., dettime, 0.), None, None
+
+def simulate_grid(obs, lightcurve, lightcurvetype, startepoch, stopepoch, dur_ints, flux_bins, targetnum, flux_err, det_threshold, burstlength, burstflux, seed=None, workers=1, fixedstart=None, engine='bins', chunksize=None, max_mem=None, backend='numpy', atol=1e-3, tolerance=None, minsources=100, maxsources=100000, interval='wilson', levels=0, threshold=0.1):
+    """Simulate and detect sources in every duration and flux bin, spreading the duration rows over worker processes. With levels above 0 the grid is refined adaptively instead, see simulate_adaptive. Return the stats array, detected sources per flux bin, timings, and the sources and detections of the last bin"""
+
+    setup = {'obs': obs,
+        'lightcurve': lightcurve,
+        'lightcurvetype': lightcurvetype,
+        'startepoch': startepoch,
+        'stopepoch': stopepoch,
+        'targetnum': targetnum,
+        'flux_err': flux_err,
+        'det_threshold': det_threshold,
+        'burstlength': burstlength,
+        'burstflux': burstflux,
+        'fixedstart': fixedstart,
+        'chunksize': chunksize,
+        'max_mem': max_mem,
+        'backend': backend,
+        'atol': atol,
+        'tolerance': tolerance,
+        'minsources': minsources,
+        'maxsources': maxsources,
+        'interval': interval,
+        'scans': load_scans(obs, det_threshold)}
+    rowfunc = {'bins': simulate_row, 'unitflux': simulate_row_unitflux, 'grid': simulate_row_grid, 'analytic': simulate_row_analytic}[engine]
+    if tolerance is not None and engine != 'bins':
+        raise ValueError(f"Only the bins engine simulates bins one by one and can stop each at a tolerance, not the {engine} engine")
+    setup['segments'] = observation_segments(obs, det_threshold)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if levels > 0:
+        return simulate_adaptive(rowfunc, setup, dur_ints, flux_bins, seed, workers, levels, threshold)
+    if engine == 'grid': # the sources of the whole grid are drawn and detected in blocks spread over the workers
+        pool = grid_pool(setup, workers)
+        try:
+            blocks = run_tasks(simulate_grid_block, grid_blocks(dur_ints, flux_bins, targetnum, seed), pool)
+        finally:
+            if pool is not None:
+                pool.terminate()
+        return grid_stats(setup, dur_ints, flux_bins, blocks, True)
+    nrows = len(dur_ints) - 1
+    tasks = [(flux_bins, ldurbin, rdurbin, rowseed, rowind==(nrows-1)) for rowind, (ldurbin, rdurbin, rowseed) in enumerate(zip(dur_ints[:-1], dur_ints[1:], seed.spawn(nrows)))]
+    pool = grid_pool(setup, workers)
+    try:
+        rows = run_tasks(rowfunc, tasks, pool)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    stats = np.concatenate([r[0] for r in rows])
+    detectedsources = np.sum([r[1] for r in rows], axis=0)
+    timing = tuple(np.sum([r[2] for r in rows], axis=0))
+    return stats, detectedsources, timing, rows[-1][3], rows[-1][4]
+
+def grid_pool(setup, workers=1):
+    """Start a pool of workers processes that each store setup with init_grid, or store it in this process if workers is 1. Return the pool, or None"""
+
+    if workers > 1:
+        return multiprocessing.Pool(workers, initializer=init_grid, initargs=(setup,))
+    init_grid(setup)
+    return None
+
+def run_tasks(rowfunc, tasks, pool=None):
+    """Run rowfunc on every task, in the worker processes of pool if there is one. Return the results in task order"""
+
+    if pool is not None:
+        # imap hands results back in task order, so the stats array is filled the same way as in a serial run
+        return list(tqdm(pool.imap(rowfunc, tasks), total=len(tasks)))
+    return [rowfunc(task) for task in tqdm(tasks)]
+
+def split_cells(cells):
+    """Split cells, rows of the first and last bin (exclusive) along duration and flux and the nominal size in bins, into
+    quarters of half the size. Quarters that fall outside a cell clipped at the edge of the grid are dropped. Return the quarters"""
+
+    half = cells[:,4]//2
+    quarters = []
+    for di in (0, 1):
+        for dj in (0, 1):
+            i0 = cells[:,0] + di*half
+            j0 = cells[:,2] + dj*half
+            quarters.append(np.stack([i0, np.minimum(i0+half, cells[:,1]), j0, np.minimum(j0+half, cells[:,3]), half], axis=1))
+    quarters = np.concatenate(quarters)
+    return quarters[(quarters[:,0] < quarters[:,1]) & (quarters[:,2] < quarters[:,3])]
+
+def simulate_adaptive(rowfunc, setup, dur_ints, flux_bins, seed, workers=1, levels=3, threshold=0.1):
+    """Refine the grid of dur_ints and flux_bins where the probability changes. Cells of 2**levels by 2**levels bins are
+    simulated first with rowfunc, each as a single bin. Every cell whose probability differs by more than threshold from a
+    neighbouring cell is split into quarters, which are simulated in turn, until the cells are single bins of the grid.
+    Return the same as simulate_grid, with one stats row per final cell at its geometric centre, detected sources per final cell
+    and no sources, so the stats are scattered points rather than a grid"""
+
+    ndur = len(dur_ints) - 1
+    nflux = len(flux_bins) - 1
+    size = 2**levels
+    cells = np.array([(i, min(i+size, ndur), j, min(j+size, nflux), size) for i in range(0, ndur, size) for j in range(0, nflux, size)])
+    leaves = np.zeros((0, 5), dtype=int)
+    stats = np.zeros((0, 5), dtype=np.float32)
+    detectedsources = np.zeros(0, dtype=int)
+    timing = np.zeros(3)
+    pool = grid_pool(setup, workers)
+    try:
+        while len(cells) > 0:
+            # Cells next to each other along flux in the same duration interval are simulated together as one row, so the
+            # engines share their work between them as they do along a row of the grid
+            cells = cells[np.lexsort((cells[:,2], cells[:,1], cells[:,0]))]
+            newrow = np.ones(len(cells), dtype=bool)
+            newrow[1:] = (cells[1:,0] != cells[:-1,0]) | (cells[1:,1] != cells[:-1,1]) | (cells[1:,2] != cells[:-1,3])
+            first = np.flatnonzero(newrow)
+            last = np.append(first[1:], len(cells)) - 1
+            # Every round gets its own seeds, so the cells are simulated the same whatever the number of workers
+            tasks = [(flux_bins[np.append(cells[a:b+1,2], cells[b,3])], dur_ints[cells[a,0]], dur_ints[cells[a,1]], rowseed, False) for a, b, rowseed in zip(first, last, seed.spawn(1)[0].spawn(len(first)))]
+            results = run_tasks(rowfunc, tasks, pool)
+            leaves = np.concatenate([leaves, cells])
+            cellstats = np.concatenate([r[0] for r in results])
+            # The centre of a cell spanning several bins is its geometric centre, as the grid is logarithmic
+            cellstats[:,0] = np.sqrt(dur_ints[cells[:,0]]*dur_ints[cells[:,1]])
+            cellstats[:,1] = np.sqrt(flux_bins[cells[:,2]]*flux_bins[cells[:,3]])
+            stats = np.concatenate([stats, cellstats])
+            detectedsources = np.concatenate([detectedsources] + [r[1] for r in results])
+            timing += np.sum([r[2] for r in results], axis=0)
+            # Which final cell every bin of the grid lies in, so that neighbouring cells of any size can be compared
+            i0, i1, j0, j1 = leaves[:,0], leaves[:,1], leaves[:,2], leaves[:,3]
+            counts = (i1-i0)*(j1-j0)
+            k = np.repeat(np.arange(len(leaves)), counts)
+            local = np.arange(len(k)) - np.repeat(np.cumsum(counts) - counts, counts) # position of each bin within its cell
+            owner = np.zeros((ndur, nflux), dtype=int)
+            owner[i0[k] + local//(j1-j0)[k], j0[k] + local%(j1-j0)[k]] = k
+            split = np.zeros(len(leaves), dtype=bool)
+            for a, b in ((owner[:-1], owner[1:]), (owner[:,:-1], owner[:,1:])):
+                differ = np.abs(stats[a,2] - stats[b,2]) > threshold
+                split[a[differ]] = True
+                split[b[differ]] = True
+            split &= leaves[:,4] > 1
+            cells = split_cells(leaves[split])
+            leaves = leaves[~split]
+            stats = stats[~split]
+            detectedsources = detectedsources[~split]
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return stats, detectedsources, tuple(timing), None, None
+
+def regrid_stats(stats, dur_ints, flux_bins):
+    """Interpolate scattered stats, e.g. of simulate_adaptive, in log duration and log flux onto the centres of the bins of
+    dur_ints and flux_bins with interpolate_scattered. Return the stats of the grid"""
+
+    durations = (dur_ints[:-1] + dur_ints[1:])/2
+    fluxes = (flux_bins[:-1] + flux_bins[1:])/2
+    gridstats = np.zeros(((len(dur_ints)-1)*(len(flux_bins)-1), 5), dtype=np.float32)
+    gridstats[:,0] = np.repeat(durations, len(fluxes))
+    gridstats[:,1] = np.tile(fluxes, len(durations))
+    for col in (2, 3, 4):
+        gridstats[:,col] = interpolate_scattered(np.log10(stats[:,0:2]), stats[:,col], np.log10(gridstats[:,0:2]))
+    return gridstats
+
+def combine_regions(regions, statlist, schedule):
+    """Combine the stats of regions, rows of calculate_regions or pixel_regions, into those of the sky they cover together. 
+    Each region is weighted by the transients it can hold, its area times the span of its observations in schedule. The 
+    regions of pixel_regions are exclusive, so all of them together are the union of the pointings. Those of 
+    calculate_regions include their overlaps, so the single pointings are combined and the overlaps counted once per 
+    pointing. Return the combined stats and the area they describe"""
+
+    weights = regions['area']*np.array([schedule.region(identity).durmax for identity in regions['identity']])
+    combined = np.copy(statlist[-1])
+    combined[:,2] = np.average([s[:,2] for s in statlist], weights=weights, axis=0)
+    return combined, np.sum(regions['area'])
+
+def statistics(fl_min, fl_max, dmin, dmax, det, all_simulated, flux_bins=None, dur_ints=None):
     """Calculate probabilities based on detections vs simulated, return a numpy array"""
 
     start = datetime.datetime.now()
-    flux_bins = np.geomspace(fl_min, fl_max, num=int(round((np.log10(fl_max)-np.log10(fl_min))/0.05)), endpoint=True)
-    dur_ints = np.geomspace(dmin, dmax, num=int(round((np.log10(dmax)-np.log10(dmin))/0.05)), endpoint=True)
+    if flux_bins is None:
+        flux_bins = np.geomspace(fl_min, fl_max, num=int(round((np.log10(fl_max)-np.log10(fl_min))/0.05)), endpoint=True)
+    if dur_ints is None:
+        dur_ints = np.geomspace(dmin, dmax, num=int(round((np.log10(dmax)-np.log10(dmin))/0.05)), endpoint=True)
 
     fluxes = np.array([],dtype=np.float32)
     durations = np.array([],dtype=np.float32)
@@ -423,8 +1493,171 @@ def statistics(fl_min, fl_max, dmin, dmax, det, all_simulated):
     end = datetime.datetime.now()
     return stats
 
-def make_mpl_plots(rgn, fl_min,fl_max,dmin,dmax,det_threshold,extra_threshold,obs,cdet,file,flux_err,toplot,gaussiancutoff,lclines,area,tsurvey,detections,confidence,filename):
-    """Use Matplotlib to make plots and if that fails dump numpy arrays. Returns an int that indicates plotting success or failure"""
+class ObservationSchedule:
+    """Observations grouped by pointing, with the gaps and coverage of the observations worked out once. The observations of 
+    a region (any combination of pointings) are a cached sub-schedule"""
+
+    def __init__(self, obs, pointFOV=None, index=None):
+        self.obs = obs
+        self.pointFOV = np.zeros((len(obs), 3)) if pointFOV is None else pointFOV
+        self.index = np.arange(len(obs)) if index is None else index # position of each observation in the full schedule
+        self.pointings, pointing = np.unique(self.pointFOV, axis=0, return_inverse=True)
+        self.pointing = pointing.ravel()
+        # The observations of pointing i are order[firstobs[i]:firstobs[i+1]], still in time order
+        self.order = np.argsort(self.pointing, kind='stable')
+        self.firstobs = np.r_[0, np.cumsum(np.bincount(self.pointing, minlength=len(self.pointings)))]
+        self._regions = {}
+        self._idle = {}
+        self._lines = {}
+        start, duration = obs['start'], obs['duration']
+        self.durmax = start[-1] + duration[-1] - start[0]
+        self.exposure = np.sum(duration)
+        # The gaps used for the lines on the plots, from the start of one observation to the start of the next plus the duration of the first
+        self.gaps = start[1:] - start[:-1] + duration[:-1]
+        self.maxgap = np.argmax(self.gaps) if len(self.gaps) else 0
+        self.max_distance = self.gaps[self.maxgap] if len(self.gaps) else 0.0
+
+    def __len__(self):
+        return len(self.obs)
+
+    def __getitem__(self, key):
+        return self.obs[key]
+
+    def pointing_index(self, i):
+        """Return index array of the observations of pointing i"""
+        return self.order[self.firstobs[i]:self.firstobs[i+1]]
+
+    def region(self, identity):
+        """Return the sub-schedule of the observations of every pointing in a region, e.g. 0&3&4"""
+        members = tuple(sorted(int(m) for m in str(identity).split('&')))
+        if members not in self._regions:
+            index = np.sort(np.concatenate([self.pointing_index(m) for m in members]))
+            self._regions[members] = ObservationSchedule(self.obs[index], self.pointFOV[index], self.index[index])
+        return self._regions[members]
+
+    def idle_time(self, det_threshold):
+        """Return the time not spent observing between the start of the first observation and the end of the last, including the gaps between scans"""
+        if det_threshold not in self._idle:
+            segments = observation_segments(self.obs, det_threshold)
+            # Within an observation a gap runs from the end of a scan to the start of the next, between observations from 
+            # the end of the last scan to the start of the next observation
+            nextstart = np.r_[segments['start'][1:], np.nan]
+            lastseg = np.flatnonzero(np.r_[segments['obs'][1:] != segments['obs'][:-1], False])
+            nextstart[lastseg] = self.obs['start'][segments['obs'][lastseg] + 1]
+            self._idle[det_threshold] = np.sum((nextstart - segments['start'] - segments['duration'])[:-1])
+        return self._idle[det_threshold]
+
+    def lines(self, lclines, xs, ys, flux_err):
+        """Return the lines of a light curve's lines method for these observations, worked out once per light curve, flux error and plot axes"""
+        key = (lclines, flux_err, xs.tobytes(), ys.tobytes())
+        if key not in self._lines:
+            self._lines[key] = lclines(xs, ys, self.durmax, self.max_distance, flux_err, self)
+        return self._lines[key]
+
+    def gap_fraction(self, det_threshold):
+        """Return the fraction of the survey not spent observing"""
+        return self.idle_time(det_threshold)/self.durmax
+
+def largest_gap(obs):
+    """Find the largest gap, from the start of one observation to the start of the next plus the duration of the first, of
+    an ObservationSchedule or a plain observation array. Return the index of the observation before it"""
+
+    if isinstance(obs, ObservationSchedule):
+        return obs.maxgap
+    gaps = obs['start'][1:] - obs['start'][:-1] + obs['duration'][:-1]
+    return np.argmax(gaps) if len(gaps) else 0
+
+def regular_grid(points):
+    """Check whether points lie on a rectilinear grid, one point per grid node. Return the grid axes and the order that 
+    arranges the points into a (len(xaxis), len(yaxis)) array, or None if they are scattered"""
+
+    xaxis, xind = np.unique(points[:,0], return_inverse=True)
+    yaxis, yind = np.unique(points[:,1], return_inverse=True)
+    if (len(xaxis) < 2) or (len(yaxis) < 2) or (len(xaxis)*len(yaxis) != len(points)):
+        return None
+    node = xind.ravel()*len(yaxis) + yind.ravel()
+    if len(np.unique(node)) != len(points):
+        return None
+    return xaxis, yaxis, np.argsort(node)
+
+def axis_weights(axis, x):
+    """Find the grid cell of every x along a sorted axis. Return the index of the left node, the weight of the right node and a mask of the x outside the axis"""
+
+    left = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, len(axis) - 2)
+    weight = (x - axis[left])/(axis[left+1] - axis[left])
+    return left, weight, (x < axis[0]) | (x > axis[-1])
+
+def interpolate_scattered(points, values, targets):
+    """Linearly interpolate values at scattered points to targets by triangulating the points. Targets outside the
+    triangulation, such as the edges of an adaptively refined grid whose cells reach beyond their centres, take the value
+    of the nearest point. Return array of the values at targets"""
+
+    import scipy.interpolate as interpolate
+    interpolated = interpolate.griddata(points, values, targets, method='linear')
+    outside = np.isnan(interpolated)
+    interpolated[outside] = interpolate.griddata(points, values, targets[outside], method='nearest')
+    return interpolated
+
+def interpolate_stats(points, values, xs, ys, grid=None):
+    """Linearly interpolate values at points onto the mesh of xs and ys. Points on a grid (see regular_grid) are interpolated 
+    bilinearly one axis at a time, anything else is triangulated with interpolate_scattered. Return array of shape (len(ys), len(xs)) like np.meshgrid"""
+
+    if grid is None:
+        X, Y = np.meshgrid(xs, ys)
+        return interpolate_scattered(points, values, np.column_stack([X.ravel(), Y.ravel()])).reshape(X.shape)
+    xaxis, yaxis, order = grid
+    gridvalues = values[order].reshape(len(xaxis), len(yaxis)).astype(np.float64)
+    xleft, xweight, xout = axis_weights(xaxis, xs)
+    yleft, yweight, yout = axis_weights(yaxis, ys)
+    with np.errstate(invalid='ignore'):
+        alongx = gridvalues[xleft]*(1 - xweight[:,None]) + gridvalues[xleft+1]*xweight[:,None]
+        mesh = alongx[:,yleft]*(1 - yweight) + alongx[:,yleft+1]*yweight
+    mesh[xout] = np.nan
+    mesh[:,yout] = np.nan
+    return mesh.T
+
+def transient_rates(probabilities, durations, tsurvey, area, detections, confidence):
+    """Turn detection probabilities into limits on the transient rate per day per square degree, an upper limit for no 
+    detections and Poisson confidence limits otherwise. Return the lower limits (None without detections) and the upper limits"""
+
+    with np.errstate(divide='ignore'):
+        if detections==0:
+            return None, -np.log(1-confidence)/(probabilities)/(tsurvey + durations)/area
+        from scipy.special import gammaincinv
+        alpha = 1-confidence
+        upperlimitpoisson = gammaincinv(detections+1, 1-alpha/2)
+        lowerlimitpoisson = gammaincinv(detections,alpha/2.)
+        return lowerlimitpoisson/(probabilities)/(tsurvey + durations)/area, upperlimitpoisson/(probabilities)/(tsurvey + durations)/area
+
+def save_stats(rgn, stats, area, tsurvey, detections, confidence, filename):
+    """Dump the probabilities and transient rates of the simulated bins without plotting them. Stats on a grid are saved 
+    as (duration, flux) arrays with the grid axes. The 4th and 5th columns of stats are the number of sources and half
+    width of a run with a tolerance, and zero otherwise. Return the name of the file written"""
+
+    points = stats[:,0:2].astype(np.float64)
+    probabilities = stats[:,2]
+    lltransrates, ultransrates = transient_rates(probabilities, points[:,0], tsurvey, area, detections, confidence)
+    arrays = {'stats': stats, 'durations': points[:,0], 'fluxes': points[:,1], 'probabilities': probabilities, 'ulrates': ultransrates}
+    if lltransrates is not None:
+        arrays['llrates'] = lltransrates
+    grid = regular_grid(points)
+    if grid is not None:
+        durations, fluxes, order = grid
+        arrays.update({key: value[order].reshape(len(durations), len(fluxes)) for key, value in arrays.items() if key not in ('stats', 'durations', 'fluxes')})
+        arrays['durations'], arrays['fluxes'] = durations, fluxes
+    now = (datetime.datetime.now() - datetime.datetime(1858, 11, 17, 00, 00, 00, 00)).total_seconds()/60/60/24
+    outfile = filename+rgn+'stats'+str(now).replace('.','_')+".npz"
+    np.savez_compressed(outfile, **arrays)
+    print("Saved probabilities and rates to", outfile)
+    return outfile
+
+def make_mpl_plots(rgn, fl_min,fl_max,dmin,dmax,det_threshold,extra_threshold,obs,cdet,file,flux_err,toplot,gaussiancutoff,lclines,area,tsurvey,detections,confidence,filename,resolution=1000,plots=True):
+    """Use Matplotlib to make plots and if that fails dump numpy arrays. With plots False only the probabilities and rates 
+    of the bins are saved, see save_stats. Returns an int that indicates plotting success or failure"""
+    if not plots:
+        return save_stats(rgn, toplot, area, tsurvey, detections, confidence, filename)
+    import matplotlib.pyplot as plt
+    from matplotlib import ticker, colors
     fddethist = None
     fddetbins = None
 
@@ -456,22 +1689,18 @@ def make_mpl_plots(rgn, fl_min,fl_max,dmin,dmax,det_threshold,extra_threshold,ob
     # difficult to make work properly. 
     toplot[:,0] = np.log10(toplot[:,0])
     toplot[:,1] = np.log10(toplot[:,1])
-    # An array of the gaps in the observations. This calculation is repeated for some light curves for no real reason
-    gaps = np.array([],dtype=np.float32)
-    for i in range(len(obs)-1):
-        gaps = np.append(gaps, (obs['start'][i+1] - obs['start'][i] + obs['duration'][i]))
-        # gaps = np.append(gaps, obs[i+1,0] - obs[i,0])
-
+    if not isinstance(obs, ObservationSchedule):
+        obs = ObservationSchedule(obs)
     min_sens = min(obs['sens'])
     max_sens = max(obs['sens'])
     extra_thresh = max_sens / det_threshold * (extra_threshold + det_threshold)
     sens_last = obs['sens'][-1]
-    sens_maxgap = obs['sens'][np.where((gaps[:] == max(gaps)))[0]+1][0]
+    sens_maxgap = obs['sens'][obs.maxgap+1]
 
-    durmax = (obs['start'][-1] + obs['duration'][-1] - obs['start'][0])
+    durmax = obs.durmax
     day1_obs = obs['duration'][0]
     mindurationobs = np.amin(obs['duration'])
-    max_distance = max(gaps)
+    max_distance = obs.max_distance
 
     dmin=min(toplot[:,0])
     dmax=max(toplot[:,0])
@@ -491,14 +1720,17 @@ def make_mpl_plots(rgn, fl_min,fl_max,dmin,dmax,det_threshold,extra_threshold,ob
     sensmax_y = np.empty(len(xs))
     sensmax_y.fill(max_sens)
 
-    X = np.linspace(dmin, dmax, num = 1001)
-    Y = np.linspace(flmin, flmax, num = 1001)
+    X = np.linspace(dmin, dmax, num = resolution + 1)
+    Y = np.linspace(flmin, flmax, num = resolution + 1)
     X = (X[0:-1] + X[1:])/2 # place interpolated Z values halfway between bin edges
     Y = (Y[0:-1] + Y[1:])/2
 
+    xaxis, yaxis = X, Y
     X, Y = np.meshgrid(X, Y)
     
-    Z = interpolate.griddata(toplot[:,0:2], toplot[:,2], (X, Y), method='linear')
+    # The stats normally sit on the duration and flux bins, so they are interpolated on that grid rather than triangulated
+    grid = regular_grid(toplot[:,0:2])
+    Z = interpolate_stats(toplot[:,0:2], toplot[:,2], xaxis, yaxis, grid)
 
     # do calculations for transient rate plot 
     durations = toplot[:,0]
@@ -511,10 +1743,10 @@ def make_mpl_plots(rgn, fl_min,fl_max,dmin,dmax,det_threshold,extra_threshold,ob
     # if there is a divide by zero error, do a dummy calculation and replace infinity with the max non-infinite number
     with np.errstate(divide='ignore'):
         if detections==0:
-            ultransrates = -np.log(1-confidence)/(probabilities)/(tsurvey + 10**durations)/area
+            _, ultransrates = transient_rates(probabilities, 10**durations, tsurvey, area, detections, confidence)
             # try: 
             # ultransrates = np.nan_to_num(-np.log(1-confidence)/(probabilities)/(tsurvey + durations)/area, posinf=np.max(trial_transrate[trial_transrate < np.inf]))
-            ulZrate = interpolate.griddata(toplot[:,0:2], ultransrates, (X, Y), method='linear')
+            ulZrate = interpolate_stats(toplot[:,0:2], ultransrates, xaxis, yaxis, grid)
             # figsc = plt.figure()
             # plt.scatter(10**X[-2,:],ulZrate[-2,:], s=3)
             # ax = plt.gca()
@@ -562,16 +1794,10 @@ def make_mpl_plots(rgn, fl_min,fl_max,dmin,dmax,det_threshold,extra_threshold,ob
             #     pass
 
         else:
-            from scipy.special import gammaincinv
-            alpha = 1-confidence
-            upperlimitpoisson = gammaincinv(detections+1, 1-alpha/2)
-            lowerlimitpoisson = gammaincinv(detections,alpha/2.)
-            lltrial_transrate, ultrial_transrate = lowerlimitpoisson/(probabilities)/(tsurvey + 10**durations)/area, (upperlimitpoisson/(probabilities)/(tsurvey + 10**durations)/area)
-            lltransrates = lowerlimitpoisson/(probabilities)/(tsurvey + 10**durations)/area
-            ultransrates = upperlimitpoisson/(probabilities)/(tsurvey + 10**durations)/area
-
-            ulZrate = interpolate.griddata(toplot[:,0:2], ultransrates, (X, Y), method='linear')
-            llZrate = interpolate.griddata(toplot[:,0:2], lltransrates, (X, Y), method='linear')
+            lltransrates, ultransrates = transient_rates(probabilities, 10**durations, tsurvey, area, detections, confidence)
+
+            ulZrate = interpolate_stats(toplot[:,0:2], ultransrates, xaxis, yaxis, grid)
+            llZrate = interpolate_stats(toplot[:,0:2], lltransrates, xaxis, yaxis, grid)
             # Make upper and lower limit plots 
             # https://matplotlib.org/stable/gallery/images_contours_and_fields/contourf_log.html#sphx-glr-gallery-images-contours-and-fields-contourf-log-py
 
@@ -639,7 +1865,7 @@ def make_mpl_plots(rgn, fl_min,fl_max,dmin,dmax,det_threshold,extra_threshold,ob
     fig = plt.figure()
     cs = plt.contourf(10**X, 10**Y, Z, levels=np.linspace(0,1.0,num = int(1/0.01)+1), cmap='viridis')
     cbar = fig.colorbar(cs, ticks=np.linspace(0,1.0,num=11))
-    durmax_x, maxdist_x, durmax_y, maxdist_y, durmax_y_indices, maxdist_y_indices = lclines(xs, ys, durmax, max_distance, flux_err, obs)   
+    durmax_x, maxdist_x, durmax_y, maxdist_y, durmax_y_indices, maxdist_y_indices = obs.lines(lclines, xs, ys, flux_err)   
     plt.plot(10**xs[durmax_y_indices], durmax_y[durmax_y_indices],  color = "red")
     plt.plot(10**xs[maxdist_y_indices], maxdist_y[maxdist_y_indices],   color = "red")
     plt.plot(10**xs, 10**np.full(xs.shape, np.log10(vlinex[0])),  color="red")
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 import sys
 class ered:
@@ -11,6 +12,10 @@ class ered:
     def latest_crit_time(self, end_survey, tau):
         return end_survey + tau
     
+    def support(self, tcrit, tau):
+        """Return the times between which the light curve is above 1e-15 of its peak"""
+        return tcrit - tau/2*np.log(1e15), tcrit + tau/2*np.log(1e15)
+    
     def fluxint(self, F0, tcrit, tau, end_obs, start_obs):
         """Return the integrated flux"""
         
@@ -23,57 +28,62 @@ class ered:
         #    we set half of tau to be the exponential decay factor. 
 
         tau = tau/2
+        # Observation times can be single values or one per source, so everything is brought to the same shape before masking
+        F0, tcrit, tau, end_obs, start_obs = np.broadcast_arrays(F0, tcrit, tau, end_obs, start_obs)
         
         # In order to avoid computational issues, we create masks for three different possible scenarios:
         # 1. The critical time of the transient is before the start of the observation and looks like a fred in the observation
         # 2. The critical time is after the end of the observation and looks like a wilma
         # 3. The critical time is during the observation and the wilma and fred portions must be calculated. 
-        scen1 = np.zeros(len(tcrit),dtype=bool)
-        scen2 = np.zeros(len(tcrit),dtype=bool)
-        scen3 = np.zeros(len(tcrit),dtype=bool)
-        scen1 += (tcrit < start_obs)
-        scen2 += (tcrit > end_obs)
-        scen3 += (tcrit <= end_obs) & (tcrit >= start_obs)
+        scen1 = (tcrit < start_obs)
+        scen2 = (tcrit > end_obs)
+        scen3 = (tcrit <= end_obs) & (tcrit >= start_obs)
 
 
-        flux_int = np.zeros(tcrit.shape[0],dtype=np.float64)
+        flux_int = np.zeros(tcrit.shape,dtype=np.float64)
                
         # Scenario one 
-        tstart1 = np.maximum(tcrit[scen1], start_obs) - tcrit[scen1]
-        tend1 = end_obs - tcrit[scen1]
-        flux_int[scen1] = F0[scen1]*tau[scen1]*(np.exp(-tstart1/tau[scen1]) - np.exp(-tend1/tau[scen1]))/(end_obs - start_obs)
+        tstart1 = np.maximum(tcrit[scen1], start_obs[scen1]) - tcrit[scen1]
+        tend1 = end_obs[scen1] - tcrit[scen1]
+        flux_int[scen1] = F0[scen1]*tau[scen1]*(np.exp(-tstart1/tau[scen1]) - np.exp(-tend1/tau[scen1]))/(end_obs[scen1] - start_obs[scen1])
         
         # Scenario two
-        tstart2 = start_obs - tcrit[scen2]
-        tend2 = np.minimum(end_obs,tcrit[scen2]) - tcrit[scen2] 
-        flux_int[scen2] = F0[scen2]*tau[scen2]*(np.exp(tend2/tau[scen2]) - np.exp(tstart2/tau[scen2]))/(end_obs - start_obs)
+        tstart2 = start_obs[scen2] - tcrit[scen2]
+        tend2 = np.minimum(end_obs[scen2],tcrit[scen2]) - tcrit[scen2] 
+        flux_int[scen2] = F0[scen2]*tau[scen2]*(np.exp(tend2/tau[scen2]) - np.exp(tstart2/tau[scen2]))/(end_obs[scen2] - start_obs[scen2])
 
         # Scenario three 
-        tstart3f = np.maximum(tcrit[scen3], start_obs) - tcrit[scen3]
-        tend3f = end_obs - tcrit[scen3]
-        tstart3w = start_obs - tcrit[scen3]
-        tend3w = np.minimum(end_obs,tcrit[scen3]) - tcrit[scen3] 
-        flux_int[scen3] = F0[scen3]*tau[scen3]*(np.exp(-tstart3f/tau[scen3]) - np.exp(-tend3f/tau[scen3]) + np.exp(tend3w/tau[scen3]) - np.exp(tstart3w/tau[scen3]))/(end_obs - start_obs)
+        tstart3f = np.maximum(tcrit[scen3], start_obs[scen3]) - tcrit[scen3]
+        tend3f = end_obs[scen3] - tcrit[scen3]
+        tstart3w = start_obs[scen3] - tcrit[scen3]
+        tend3w = np.minimum(end_obs[scen3],tcrit[scen3]) - tcrit[scen3] 
+        flux_int[scen3] = F0[scen3]*tau[scen3]*(np.exp(-tstart3f/tau[scen3]) - np.exp(-tend3f/tau[scen3]) + np.exp(tend3w/tau[scen3]) - np.exp(tstart3w/tau[scen3]))/(end_obs[scen3] - start_obs[scen3])
 
         return flux_int
 
+    @staticmethod
+    def scalar_fluxint(F0, tcrit, tau, end_obs, start_obs):
+        """Return the integrated flux of one source over one observation, for the jit backend"""
+        tau = tau/2
+        flux = 0.
+        if tcrit <= end_obs: # the fred part after the critical time
+            flux += math.exp(-(max(tcrit, start_obs) - tcrit)/tau) - math.exp(-(end_obs - tcrit)/tau)
+        if tcrit >= start_obs: # the wilma part before it
+            flux += math.exp((min(end_obs, tcrit) - tcrit)/tau) - math.exp((start_obs - tcrit)/tau)
+        return F0*tau*flux/(end_obs - start_obs)
         
     def lines(self, xs, ys, durmax, max_distance, flux_err, obs):
-        gaps = np.zeros(len(obs)-1,dtype=np.float32)
-        for i in range(len(obs)-1):
-            gaps[i] =  obs['start'][i+1] - obs['start'][i] + obs['duration'][i]
-            # gaps = np.append(gaps, obs[i+1,0] - obs[i,0])
+        from RaTS.compute_lc import largest_gap # obs is an ObservationSchedule or a plain observation array
+        maxgap = largest_gap(obs)
         min_sens = min(obs['sens'])
         max_sens = max(obs['sens'])
         
-        sens_maxgapbefore = obs['sens'][np.where((gaps[:] == max(gaps)))[0]-1][0]
-        sens_maxgapafter = obs['sens'][np.where((gaps[:] == max(gaps)))[0]+1][0]
+        sens_maxgapbefore = obs['sens'][maxgap-1]
+        sens_maxgapafter = obs['sens'][maxgap+1]
         sens_maxgap = min(sens_maxgapbefore, sens_maxgapafter)
         sens_argmin = np.argmin(np.array([sens_maxgapbefore, sens_maxgapafter]))
         gapobs = obs['duration'][sens_argmin]
         # sens_maxgap = obs['sens'][np.where((gaps[:] == max(gaps)))[0]+1][0]
-        durmax_y = np.zeros(xs.shape,dtype=np.float64)
-        maxdist_y = np.zeros(xs.shape,dtype=np.float64)
         day1_obs = obs['duration'][0]
         lastday_obs = obs['duration'][-1]
         sens_last = obs['sens'][-1]
@@ -81,20 +91,12 @@ class ered:
         sens_maxtime = max(sens_last, sens_first)
         maxargobs = np.argmin(np.array([sens_last, sens_first]))
         maxtime_obs = obs['duration'][maxargobs]
-        print(maxtime_obs)
-        print(durmax)
-        print(sens_maxtime)
-        for i in range(len(xs)):
-            x = xs[i]
-            try:
-                durmax_y[i] =  (1. + flux_err) * maxtime_obs * sens_maxtime / (np.power(10,x)/2) / (np.exp(-(durmax  / np.power(10,x))) - np.exp(-(durmax + 2*maxtime_obs) /  np.power(10,x)))
-            except:
-                durmax_y[i] = np.inf
-            try:
-                # maxdist_y[i] =  (((1. + flux_err) * sens_maxgap * day1_obs) /  np.power(10,x))   / (np.exp(-(max_distance / np.power(10,x))) - np.exp(-(max_distance + day1_obs) / np.power(10,x)))
-                maxdist_y[i] =  (((1. + flux_err) * sens_maxgap * gapobs) /  (np.power(10,x)/2)   / (np.exp(-(max_distance / np.power(10,x))) - np.exp(-(max_distance + 2*gapobs) / np.power(10,x))))
-            except:
-                maxdist_y[i] = np.inf    
+        tau = np.power(10, xs)
+        # Durations too short or too long for the exponentials come out as inf or nan, which never fall inside the plot
+        with np.errstate(all='ignore'):
+            durmax_y =  (1. + flux_err) * maxtime_obs * sens_maxtime / (tau/2) / (np.exp(-(durmax  / tau)) - np.exp(-(durmax + 2*maxtime_obs) /  tau))
+            # maxdist_y =  (((1. + flux_err) * sens_maxgap * day1_obs) /  tau)   / (np.exp(-(max_distance / tau)) - np.exp(-(max_distance + day1_obs) / tau))
+            maxdist_y =  (((1. + flux_err) * sens_maxgap * gapobs) /  (tau/2)   / (np.exp(-(max_distance / tau)) - np.exp(-(max_distance + 2*gapobs) / tau)))
         durmax_x = ' '
         maxdist_x = ' '
         durmax_y_indices = np.where((durmax_y < np.amax(10**ys)) &  (durmax_y > np.amin(10**ys)))[0]
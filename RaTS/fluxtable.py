@@ -0,0 +1,202 @@
+import os
+import hashlib
+import inspect
+import numpy as np
+
+TABLEVERSION = 1 # bump when the layout of the tables changes, so that old files are rebuilt
+
+class fluxtable:
+    """Lookup table of the integrated flux of a light curve. For a peak flux of 1 the average flux over an observation only
+    depends on its start and end measured from the critical time in units of the duration of the transient (or of the
+    light curve's timescale(tcrit, tau), if it has one). The table holds it on a grid of these two numbers, built once to
+    the accuracy rtol against the light curve's own fluxint and saved in directory. It stands in for the light curve:
+    fluxint is interpolated in the table and everything else is the light curve's own"""
+
+    def __init__(self, lightcurve, rtol=1e-3, floor=1e-6, directory=None, maxpoints=2**24):
+        self.lightcurve = lightcurve
+        self.accuracy = rtol
+        self.floor = floor # averages below this fraction of the peak flux only need to be accurate to rtol*floor
+        self.timescale = getattr(lightcurve, 'timescale', None)
+        self.averaged = getattr(lightcurve, 'averaged', True) # False if fluxint is the integral over the observation
+        # The table is computed for one transient, every other one is the same light curve shifted and stretched
+        self.tcrit0, self.tau0 = 1., 1.
+        self.scale0 = float(self.timescale(self.tcrit0, self.tau0)) if self.timescale is not None else self.tau0
+        lo, hi = -np.inf, np.inf
+        if hasattr(lightcurve, 'support'):
+            lo, hi = [float((np.asarray(t) - self.tcrit0)/self.scale0) for t in lightcurve.support(self.tcrit0, self.tau0)]
+        self.lo, self.hi = lo, hi
+        if np.isfinite(lo) and np.isfinite(hi):
+            # Observations are cut to the support window, the flux outside of it is negligible. Observations across the 
+            # critical time are split there, so that the peak of a light curve is always on the edge of the cells 
+            self.logtime = False
+            self.range = (lo, hi) if not lo < 0 < hi else (-max(-lo, hi), max(-lo, hi))
+        elif lightcurve.edges[0] == 1:
+            # light curves that start at the critical time and never end are tabulated against the log of the times,
+            # observations off the table are integrated by the light curve itself
+            self.logtime = True
+            self.range = (-4., 8.)
+        else:
+            raise ValueError(f"{type(lightcurve).__name__} needs a finite support window or a definite start to be tabulated")
+        params = {name: value for name, value in vars(lightcurve).items() if name != 'edges'}
+        try:
+            source = inspect.getsource(type(lightcurve))
+        except (OSError, TypeError):
+            source = ''
+        key = f"{TABLEVERSION} {type(lightcurve).__module__}.{type(lightcurve).__qualname__} {sorted(params.items())} {rtol} {floor} {source}"
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache', 'RaTS')
+        self.filename = os.path.join(directory, f"{type(lightcurve).__name__}-{hashlib.sha1(key.encode()).hexdigest()[:16]}.npz")
+        if os.path.exists(self.filename):
+            with np.load(self.filename) as saved:
+                if str(saved['key']) == key:
+                    self.axis, self.values, self.logflux, self.error = saved['axis'], saved['values'], bool(saved['logflux']), float(saved['error'])
+                    return
+        self.build(maxpoints)
+        os.makedirs(directory, exist_ok=True)
+        np.savez(self.filename, axis=self.axis, values=self.values, logflux=self.logflux, error=self.error, key=key)
+
+    def __getattr__(self, name):
+        # everything but the integrated flux is the light curve's own, e.g. lines, support and the crit time ranges
+        if name.startswith('__') or 'lightcurve' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.lightcurve, name)
+
+    def exact(self, x, y):
+        """Return the average flux between the table coordinates x and y worked out by the light curve"""
+        start, end = np.broadcast_arrays(np.minimum(x, y), np.maximum(x, y))
+        if self.logtime:
+            start, end = np.power(10., start), np.power(10., end)
+            step = 1e-3*start # times close to the critical time are only known to about 1e-16 of it
+        else:
+            step = 1e-6*(self.range[1] - self.range[0])
+        average = self.average(start, np.maximum(end, start + step))
+        # the flux at a single time, on the diagonal of the table, is extrapolated from two short observations
+        point = end - start < step
+        if np.any(point):
+            average = np.where(point, 2*average - self.average(start, start + 2*step), average)
+        return average
+
+    def average(self, start, end):
+        """Return the average flux between the times start and end after the critical time in units of the timescale"""
+        if not self.logtime:
+            over = np.maximum(end - self.hi, 0) # keep observations at the end of the support window inside it
+            start, end = start - over, end - over
+        flux = self.lightcurve.fluxint(1., self.tcrit0, self.tau0, self.tcrit0 + self.scale0*end, self.tcrit0 + self.scale0*start)
+        return flux if self.averaged else flux/(self.scale0*(end - start))
+
+    def relative_error(self, average, exact, x, y):
+        """Return the largest error of the average fluxes between x and y against the exact ones, relative to the larger of
+        them and floor. Observations across the critical time are never looked up in one piece, so they do not count"""
+        error = np.abs(average - exact)/np.maximum(np.abs(exact), self.floor)
+        if not self.logtime:
+            error = np.where((np.minimum(x, y) < 0) & (np.maximum(x, y) > 0), 0, error)
+        return np.amax(error)
+
+    def interpolate(self, x, y):
+        """Bilinearly interpolate the table at x and y, which must lie on its axis"""
+        # this runs on every (source, scan) pair, so it works in place on as few temporaries as it can
+        n = len(self.axis)
+        x, y = np.broadcast_arrays(x, y)
+        i = np.subtract(x, self.axis[0])
+        i *= 1/(self.axis[1] - self.axis[0])
+        j = np.subtract(y, self.axis[0])
+        j *= 1/(self.axis[1] - self.axis[0])
+        k = np.minimum(i.astype(np.intp), n - 2)
+        i -= k # weight of the next row
+        j0 = np.minimum(j.astype(np.intp), n - 2)
+        j -= j0 # weight of the next column
+        k *= n
+        k += j0
+        flat = self.values.ravel()
+        value, nextcolumn = flat.take(k), flat.take(k + 1)
+        k += n
+        nextrow, diagonal = flat.take(k), flat.take(k + 1)
+        nextrow -= value
+        nextrow *= i
+        value += nextrow
+        diagonal -= nextcolumn
+        diagonal *= i
+        nextcolumn += diagonal
+        nextcolumn -= value
+        nextcolumn *= j
+        value += nextcolumn
+        return value
+
+    def build(self, maxpoints):
+        """Fill the table with the average flux, or with its log if that needs fewer nodes, e.g. for exponential tails
+        and power laws. Fluxes that drop to zero, like the edges of a parabola, can only be interpolated as they are"""
+        best = None
+        for self.logflux in (True, False):
+            self.axis = np.linspace(*self.range, 65)
+            average = self.exact(self.axis[:,None], self.axis[None,:])
+            if self.logflux and not np.all(average > 0):
+                continue
+            try:
+                # the second try only has to beat the first
+                self.refine(average, maxpoints if best is None else best[2].size)
+            except ValueError as error:
+                failure = error
+                continue
+            best = (self.logflux, self.axis, self.values, self.error)
+        if best is None:
+            raise failure
+        self.logflux, self.axis, self.values, self.error = best
+
+    def refine(self, average, maxpoints):
+        """Double the nodes of the table until interpolating halfway between them, where linear interpolation is worst,
+        and at random points is accurate to rtol. The nodes already computed are kept"""
+        transform = np.log if self.logflux else np.asarray
+        self.values = transform(average)
+        mid = (self.axis[1:] + self.axis[:-1])/2
+        midaverage = self.exact(mid[:,None], self.axis[None,:])
+        rng = np.random.default_rng(0)
+        while True:
+            # random observations, half of them much shorter than the transient as most observations are
+            x, y = rng.uniform(*self.range, (2, 2**16))
+            y[::2] = np.clip(x[::2] + np.power(10., rng.uniform(-6, 0, 2**15))*(self.range[1] - self.range[0]), *self.range)
+            self.error = max(self.relative_error(self.lookup(mid[:,None], self.axis[None,:]), midaverage, mid[:,None], self.axis[None,:]),
+                self.relative_error(self.lookup(x, y), self.exact(x, y), x, y))
+            if self.error <= self.accuracy:
+                return
+            if (2*len(self.axis) - 1)**2 > maxpoints:
+                raise ValueError(f"The flux table of {type(self.lightcurve).__name__} only reached an accuracy of {self.error:.2g} with {self.values.size} points, not {self.accuracy:.2g}")
+            values = np.empty((2*len(self.axis) - 1, 2*len(self.axis) - 1))
+            values[::2,::2] = self.values
+            values[1::2,::2] = transform(midaverage)
+            values[::2,1::2] = transform(midaverage).T
+            values[1::2,1::2] = transform(self.exact(mid[:,None], mid[None,:]))
+            self.axis = np.linspace(*self.range, 2*len(self.axis) - 1)
+            self.values = values
+            mid = (self.axis[1:] + self.axis[:-1])/2
+            midaverage = self.exact(mid[:,None], self.axis[None,:])
+
+    def lookup(self, x, y):
+        """Return the average flux between table coordinates x and y"""
+        values = self.interpolate(x, y)
+        return np.exp(values) if self.logflux else values
+
+    def fluxint(self, F0, tcrit, tau, end_obs, start_obs):
+        """Return the integrated flux"""
+        scale = tau if self.timescale is None else self.timescale(tcrit, tau)
+        start, end = np.broadcast_arrays(np.subtract(start_obs, tcrit)/scale, np.subtract(end_obs, tcrit)/scale)
+        lo, hi = self.range
+        with np.errstate(all='ignore'):
+            if self.logtime:
+                x = np.log10(start)
+                y = np.log10(end)
+                average = self.lookup(np.clip(np.nan_to_num(x), lo, hi), np.clip(np.nan_to_num(y), lo, hi))
+                # observations off the table, including the ones at or across the critical time, are integrated exactly
+                off = ~((x >= lo) & (y <= hi))
+                if np.any(off):
+                    exact = self.lightcurve.fluxint(1., *[np.broadcast_to(a, off.shape)[off] for a in (tcrit, tau, end_obs, start_obs)])
+                    average[off] = exact if self.averaged else exact/np.broadcast_to(end_obs - start_obs, off.shape)[off]
+            else:
+                x = np.clip(start, self.lo, self.hi)
+                y = np.clip(end, self.lo, self.hi)
+                across = (x < 0) & (y > 0)
+                before = np.where(across, 0., y)
+                integral = self.lookup(x, before)*(before - x)
+                if np.any(across):
+                    integral[across] += self.lookup(np.zeros(np.count_nonzero(across)), y[across])*y[across]
+                average = integral/(end - start)
+        return F0*average if self.averaged else F0*average*(end_obs - start_obs)
@@ -1,6 +1,6 @@
+import math
 import numpy as np
 import sys
-from scipy.stats import norm
 from scipy.special import erf
 class gaussian:
     """gaussian lightcurve class"""
@@ -13,29 +13,34 @@ class gaussian:
     def latest_crit_time(self, end_survey, tau):
         return end_survey + tau
     
+    def support(self, tcrit, tau):
+        """Return the times between which the light curve is above 1e-15 of its peak"""
+        return tcrit - tau*np.sqrt(np.log(1e15)/2), tcrit + tau*np.sqrt(np.log(1e15)/2)
+    
     def fluxint(self, F0, tcrit, tau, end_obs, start_obs):
         """Return the integrated flux"""
         
         return (F0*tau*np.sqrt(np.pi/8.0)*(erf(np.sqrt(2)*(end_obs-tcrit)/(tau))-erf(np.sqrt(2)*(start_obs-tcrit)/(tau))))/(end_obs-start_obs)
+
+    @staticmethod
+    def scalar_fluxint(F0, tcrit, tau, end_obs, start_obs):
+        """Return the integrated flux of one source over one observation, for the jit backend"""
+        return (F0*tau*math.sqrt(math.pi/8.0)*(math.erf(math.sqrt(2)*(end_obs-tcrit)/tau)-math.erf(math.sqrt(2)*(start_obs-tcrit)/tau)))/(end_obs-start_obs)
         
     def gausscdf(self, x, t):
         return x*np.sqrt(np.pi/2)*erf(t/x/np.sqrt(2))
             
     def lines(self, xs, ys, durmax, max_distance, flux_err, obs):
-        gaps = np.array([],dtype=np.float32)
-        for i in range(len(obs)-1):
-            gaps = np.append(gaps, obs['start'][i+1] - obs['start'][i] + obs['duration'][i])
-            # gaps = np.append(gaps, obs[i+1,0] - obs[i,0])
+        from RaTS.compute_lc import largest_gap # obs is an ObservationSchedule or a plain observation array
+        maxgap = largest_gap(obs)
         min_sens = min(obs['sens'])
         max_sens = max(obs['sens'])
         sens_last = obs['sens'][-1]
         day1_obs = obs['duration'][0]
         # durmax_x = np.empty(len(ys))
         # durmax_x.fill(np.log10(durmax))
-        durmax_y = np.zeros(xs.shape,dtype=np.float64)
-        maxdist_y = np.zeros(xs.shape,dtype=np.float64)
-        sens_maxgapbefore = obs['sens'][np.where((gaps[:] == max(gaps)))[0]-1][0]
-        sens_maxgapafter = obs['sens'][np.where((gaps[:] == max(gaps)))[0]+1][0]
+        sens_maxgapbefore = obs['sens'][maxgap-1]
+        sens_maxgapafter = obs['sens'][maxgap+1]
         sens_maxgap = min(sens_maxgapbefore, sens_maxgapafter)
         sens_argmin = np.argmin(np.array([sens_maxgapbefore, sens_maxgapafter]))
         sens_maxdur = obs['duration'][sens_argmin]
@@ -44,16 +49,11 @@ class gaussian:
         sens_maxtime = max(sens_last, sens_first)
         maxargobs = np.argmin(np.array([sens_last, sens_first]))
         maxtime_obs = obs['duration'][maxargobs]
-        for i in range(len(xs)):
-            x = np.power(10,xs[i])
-            try:
-                durmax_y[i] = (1.+flux_err)*sens_maxtime*(maxtime_obs)/x/np.sqrt(np.pi/8.0)/(erf(np.sqrt(2)*(-durmax/2 + maxtime_obs)/(x))-erf(np.sqrt(2)*(-durmax/2)/(x)))
-            except RuntimeWarning:
-                durmax_y[i]=np.inf
-            try:
-                maxdist_y[i] = (1.+flux_err)*sens_maxgap*(sens_maxdur)/x/np.sqrt(np.pi/8.0)/(erf(np.sqrt(2)*(-max_distance/2)/(x))-erf(np.sqrt(2)*(-(sens_maxdur + max_distance/2))/(x)))
-            except RuntimeWarning:
-                maxdist_y[i] = np.inf
+        x = np.power(10, xs)
+        # Durations where the error functions cancel come out as inf or nan, which never fall inside the plot
+        with np.errstate(all='ignore'):
+            durmax_y = (1.+flux_err)*sens_maxtime*(maxtime_obs)/x/np.sqrt(np.pi/8.0)/(erf(np.sqrt(2)*(-durmax/2 + maxtime_obs)/(x))-erf(np.sqrt(2)*(-durmax/2)/(x)))
+            maxdist_y = (1.+flux_err)*sens_maxgap*(sens_maxdur)/x/np.sqrt(np.pi/8.0)/(erf(np.sqrt(2)*(-max_distance/2)/(x))-erf(np.sqrt(2)*(-(sens_maxdur + max_distance/2))/(x)))
         #     # print(self.gausscdf(np.power(10,x),durmax + np.power(10,x)))
 
         #     try:
@@ -0,0 +1,60 @@
+import math
+import numpy as np
+
+# Backends that detect_bursts can detect sources with. numpy is the reference implementation, jit compiles one loop per
+# light curve with numba that integrates, adds the noise and compares a source to every observation in a single pass,
+# without the (sources, scans) temporaries of the numpy backend
+BACKENDS = ('numpy', 'jit')
+_kernels = {} # compiled detection loops by scalar flux integral, so each is only compiled once per process
+
+def unavailable(lightcurve):
+    """Check whether the jit backend can detect sources of lightcurve. Return the reason it cannot, or None if it can"""
+
+    if getattr(lightcurve, 'scalar_fluxint', None) is None:
+        return f"{type(lightcurve).__name__} has no scalar_fluxint"
+    try:
+        import numba
+    except ImportError:
+        return "numba is not installed"
+    return None
+
+def detection_loop(fluxint):
+    """The detection loop around the integrated flux of one source over one observation. Plain python, so that it can
+    be compiled with fluxint by numba. Return the loop function"""
+
+    def loop(charflux, chartime, chardur, first, last, segbound, segstart, segend, segweight, segsens, obssens, flux_err, det_threshold, noise, detections):
+        # noise holds a standard normal draw for every scan of every observation from first to last of each source in
+        # turn, in the order the numpy backend draws them
+        k = 0
+        nobs = len(obssens)
+        for i in range(len(charflux)):
+            ndetected = 0
+            for o in range(first[i], last[i]):
+                flux = 0.
+                for s in range(segbound[o], segbound[o+1]):
+                    error = math.sqrt((charflux[i]*flux_err)**2 + (segsens[s]/det_threshold)**2)
+                    F0 = charflux[i] + error*noise[k]
+                    k += 1
+                    if F0 < 0:
+                        F0 = 0.
+                    scan = fluxint(F0, chartime[i], chardur[i], segend[s], segstart[s])
+                    if scan < 0:
+                        scan = 0.
+                    flux += scan*segweight[s]
+                if flux > obssens[o]:
+                    ndetected += 1
+            # an observation outside first to last sees no flux, so a source is only constant if it is detected in all of them
+            detections[i] = (ndetected > 0) and (ndetected < nobs)
+    return loop
+
+def detection_kernel(lightcurve):
+    """Compile the detection loop of lightcurve with numba. Return the compiled function"""
+
+    reason = unavailable(lightcurve)
+    if reason is not None:
+        raise ValueError(f"The jit backend is unavailable: {reason}")
+    import numba
+    scalar = lightcurve.scalar_fluxint
+    if scalar not in _kernels:
+        _kernels[scalar] = numba.njit(detection_loop(numba.njit(scalar)))
+    return _kernels[scalar]
@@ -0,0 +1,40 @@
+import importlib
+
+# Light curves shipped with RaTS, each the class of the same name in the module of the same name
+BUILTIN = ('tophat', 'fred', 'wilma', 'gaussian', 'ered', 'parabolic', 'sbpowerlaw')
+# Other packages register their light curves as entry points of this group, e.g. in pyproject.toml
+# [project.entry-points."RaTS.lightcurves"]
+# mylightcurve = "mypackage.mymodule:mylightcurve"
+ENTRY_POINT_GROUP = 'RaTS.lightcurves'
+
+def entry_points():
+    """Find the light curves registered by installed packages. Return dictionary of entry points by name"""
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError: # Python before 3.8 has no importlib.metadata
+        return {}
+    found = entry_points()
+    group = found.select(group=ENTRY_POINT_GROUP) if hasattr(found, 'select') else found.get(ENTRY_POINT_GROUP, [])
+    return {entry.name: entry for entry in group}
+
+def available_lightcurves():
+    """Return the names of the shipped and registered light curves"""
+
+    return sorted(set(BUILTIN) | set(entry_points()))
+
+def load_lightcurve(name):
+    """Import the light curve called name, which is a shipped one, one registered by another package, or a class of that
+    name in a module of that name in RaTS. Only that light curve's module is imported. Return the light curve class"""
+
+    if name not in BUILTIN:
+        registered = entry_points()
+        if name in registered:
+            return registered[name].load()
+    try:
+        module = importlib.import_module(f"RaTS.{name}")
+    except ModuleNotFoundError as e:
+        if e.name != f"RaTS.{name}":
+            raise
+        raise ValueError(f"Unknown light curve {name}, the available ones are {', '.join(available_lightcurves())}") from None
+    return getattr(module, name)
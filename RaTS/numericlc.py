@@ -0,0 +1,110 @@
+import numpy as np
+from numpy.polynomial.legendre import leggauss
+
+# Gauss-Legendre rule used on every panel by panel_quad
+_NODES, _WEIGHTS = leggauss(10)
+
+def panel_quad(f, start, end, args=(), scale=None, rtol=1e-8, maxlevel=16, blocksize=2**14, logtime=False):
+    """Integrate f(t, *args) from start to end for many intervals at once. Each interval is split into equal panels, in log
+    time if logtime (then 0 < start), integrated with a fixed order Gauss-Legendre rule and refined by doubling the panels
+    until two successive estimates agree to rtol. Intervals start with about one panel per scale, e.g. the duration of the
+    transient, so that short features in long intervals are not stepped over. args and scale are arrays with one value per
+    interval. Return the integrals and their error estimates"""
+
+    start, end = np.broadcast_arrays(np.asarray(start, dtype=np.float64), np.asarray(end, dtype=np.float64))
+    shape = start.shape
+    args = [np.broadcast_to(a, shape).ravel() for a in args]
+    lower, upper = (np.log(start.ravel()), np.log(end.ravel())) if logtime else (start.ravel(), end.ravel())
+    level0 = np.zeros(lower.shape, dtype=int)
+    if scale is not None:
+        with np.errstate(all='ignore'):
+            level0 = np.clip(np.ceil(np.log2((upper - lower)/np.broadcast_to(scale, shape).ravel())), 0, maxlevel)
+        level0 = np.nan_to_num(level0).astype(int)
+    def panels(ind, npanels):
+        # integrate intervals ind over npanels equal panels, in blocks to bound the (intervals, panels, nodes) temporaries
+        result = np.zeros(len(ind))
+        step = max(1, blocksize//npanels)
+        for b in range(0, len(ind), step):
+            blk = ind[b:b+step]
+            width = ((upper[blk] - lower[blk])/npanels)[:,None,None]
+            t = lower[blk][:,None,None] + width*(np.arange(npanels)[None,:,None] + (_NODES + 1)/2)
+            if logtime:
+                t = np.exp(t)
+                values = f(t, *[a[blk][:,None,None] for a in args])*t
+            else:
+                values = f(t, *[a[blk][:,None,None] for a in args])
+            result[b:b+step] = np.sum(values*_WEIGHTS, axis=(1,2))*width[:,0,0]/2
+        return result
+    integral = np.zeros(lower.shape)
+    error = np.zeros(lower.shape)
+    coarse = np.zeros(lower.shape)
+    todo = np.zeros(0, dtype=int)
+    for level in range(maxlevel + 1):
+        # intervals already started are refined to 2**level panels, then the ones starting at this level get their first estimate
+        if len(todo):
+            fine = panels(todo, 2**level)
+            with np.errstate(invalid='ignore'):
+                diff = np.abs(fine - coarse[todo])
+                done = ~(diff > rtol*np.abs(fine)) # nan and inf integrals cannot improve, so they stop too
+            integral[todo], error[todo], coarse[todo] = fine, diff, fine
+            todo = todo[~done]
+        new = np.flatnonzero((level0 == level) & (upper > lower))
+        coarse[new] = integral[new] = panels(new, 2**level)
+        error[new] = np.inf
+        todo = np.concatenate((todo, new))
+    return integral.reshape(shape), error.reshape(shape)
+
+class numericlc:
+    """Base class for light curves without a closed form integral. A subclass only defines flux(t, F0, tcrit, tau), the
+    flux at times t vectorized over all arguments, and optionally support(tcrit, tau), the times outside of which the flux
+    is negligible. The integrated flux, the lines on the plots and the range of critical times are worked out numerically"""
+    edges = [0, 0] # 1 is a definite edge, tophat is the default and has a definite beginning and end. Therefore it is [1,1]
+    rtol = 1e-6 # relative accuracy of the integrated flux
+
+    def flux(self, t, F0, tcrit, tau):
+        """Return the flux at times t"""
+        raise NotImplementedError(f"{type(self).__name__} must define flux(t, F0, tcrit, tau)")
+
+    def support(self, tcrit, tau):
+        """Return the times between which the light curve is on, unbounded unless a subclass knows better"""
+        return np.full(np.shape(tcrit), -np.inf), np.full(np.shape(tcrit), np.inf)
+
+    def earliest_crit_time(self, start_survey, tau):
+        """Return the earliest critical time of a transient that is still on at the start of the survey"""
+        _, end = self.support(np.zeros(np.shape(tau)), tau)
+        return start_survey - np.where(np.isfinite(end), end, tau)
+
+    def latest_crit_time(self, end_survey, tau):
+        """Return the latest critical time of a transient that is already on at the end of the survey"""
+        start, _ = self.support(np.zeros(np.shape(tau)), tau)
+        return end_survey - np.where(np.isfinite(start), start, 0)
+
+    def fluxint(self, F0, tcrit, tau, end_obs, start_obs):
+        """Return the integrated flux"""
+        # the arguments may be (sources, 1) and (scans,) arrays, every pair of them is one interval of panel_quad
+        shape = np.broadcast(F0, tcrit, tau, end_obs, start_obs).shape
+        F0, tcrit, tau, end_obs, start_obs = [np.broadcast_to(np.asarray(a, dtype=np.float64), shape).ravel() for a in (F0, tcrit, tau, end_obs, start_obs)]
+        windowstart, windowend = self.support(tcrit, tau)
+        start = np.maximum(start_obs, windowstart)
+        end = np.minimum(end_obs, windowend)
+        on = end > start
+        intflux = np.zeros(len(F0))
+        intflux[on], _ = panel_quad(self.flux, start[on], end[on], args=(F0[on], tcrit[on], tau[on]), scale=tau[on], rtol=self.rtol)
+        return (intflux/(end_obs - start_obs)).reshape(shape)
+
+    def lines(self, xs, ys, durmax, max_distance, flux_err, obs):
+        """Work out the fluxes above which every transient is detected: one starting with the first observation must still
+        be seen in the last, and one starting max_distance before the observation after the largest gap must be seen in it"""
+        from RaTS.compute_lc import largest_gap # obs is an ObservationSchedule or a plain observation array
+        maxgap = largest_gap(obs)
+        tau = np.power(10, xs.astype(np.float64))
+        last = len(obs) - 1
+        after = maxgap + 1
+        with np.errstate(all='ignore'):
+            durmax_y = (1. + flux_err) * obs['sens'][last] / self.fluxint(1., obs['start'][0], tau, obs['start'][last] + obs['duration'][last], obs['start'][last])
+            maxdist_y = (1. + flux_err) * obs['sens'][after] / self.fluxint(1., obs['start'][after] - max_distance, tau, obs['start'][after] + obs['duration'][after], obs['start'][after])
+        durmax_x = ' '
+        maxdist_x = ' '
+        durmax_y_indices = np.where((durmax_y < np.amax(10**ys)) &  (durmax_y > np.amin(10**ys)))[0]
+        maxdist_y_indices = np.where((maxdist_y < np.amax(10**ys)) & (maxdist_y > np.amin(10**ys)))[0]
+        return  durmax_x, maxdist_x, durmax_y, maxdist_y, durmax_y_indices, maxdist_y_indices
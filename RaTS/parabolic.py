@@ -1,3 +1,4 @@
+import math
 import numpy as np
 # from tqdm import tqdm
 # from scipy.integrate import quad
@@ -13,6 +14,10 @@ class parabolic:
     def latest_crit_time(self, end_survey, tau):
         return end_survey 
     
+    def support(self, tcrit, tau):
+        """Return the times between which the light curve is on"""
+        return tcrit, tcrit + tau
+    
     def lightcurve(self, t, F0, tau, tcrit):
         
         return -(F0/((tau/2.0)**2))*(t - tau/2.0 - tcrit)**2 + F0
@@ -22,23 +27,27 @@ class parabolic:
         
         tstart = np.maximum(tcrit , start_obs) 
         tend = np.minimum(tcrit + tau, end_obs) 
+        tend = np.maximum(tend, tstart) # no overlap, otherwise the parabola below zero outside the burst gives a positive integral
         fluxint = (F0*(tend-tstart) - (F0*(np.power((tend - tau/2.0 - tcrit),3.0)-np.power((tstart - tau/2.0 - tcrit),3.0))/(3.0*np.power((tau/2.0),2.0))))/(end_obs-start_obs)
         # fluxint = (F0*(tend-tstart) - (F0*(np.power((tend - tau/2.0 - tcrit),3.0)-np.power((tstart - tau/2.0 - tcrit),3.0))/(3.0*np.power((tau/2.0),2.0))))/(end_obs-start_obs)
         
         return fluxint
+
+    @staticmethod
+    def scalar_fluxint(F0, tcrit, tau, end_obs, start_obs):
+        """Return the integrated flux of one source over one observation, for the jit backend"""
+        tstart = max(tcrit, start_obs)
+        tend = max(min(tcrit + tau, end_obs), tstart)
+        return (F0*(tend-tstart) - (F0*((tend - tau/2.0 - tcrit)**3-(tstart - tau/2.0 - tcrit)**3)/(3.0*(tau/2.0)**2)))/(end_obs-start_obs)
     
     def lines(self, xs, ys, durmax, max_distance, flux_err, obs):
-        gaps = np.zeros(len(obs)-1,dtype=np.float32)
-        for i in range(len(obs)-1):
-            gaps[i] =  obs['start'][i+1] - obs['start'][i] + obs['duration'][i]
-            # gaps = np.append(gaps, obs[i+1,0] - obs[i,0])
+        from RaTS.compute_lc import largest_gap # obs is an ObservationSchedule or a plain observation array
+        maxgap = largest_gap(obs)
         min_sens = min(obs['sens'])
         max_sens = max(obs['sens'])
         sens_last = obs['sens'][-1]
-        sens_maxgap = obs['sens'][np.where((gaps[:] == max(gaps)))[0]+1][0]
-        dur_maxgap = obs['duration'][np.where((gaps[:] == max(gaps)))[0]+1][0]
-        durmax_y = np.array([],dtype=np.float64)
-        maxdist_y = np.array([],dtype=np.float64)
+        sens_maxgap = obs['sens'][maxgap+1]
+        dur_maxgap = obs['duration'][maxgap+1]
         day1_obs = obs['duration'][0]
         lastday_obs = obs['duration'][-1]
         durmax_x = np.empty(len(ys))
@@ -46,38 +55,14 @@ class parabolic:
         maxdist_x = np.empty(len(ys))
         maxdist_x.fill(np.log10(max_distance)) 
         durmax_y = np.zeros(xs.shape,dtype=np.float64)
-        maxdist_y = np.zeros(xs.shape,dtype=np.float64)
 
 # F0 = S_obs*(T_end - T_start)/((tend-tstart) - (np.power((tend - tau/2.0 - tcrit),3.0)-np.power((tstart - tau/2.0 - tcrit),3.0))/(3.0*np.power((tau/2.0),2.0)))
-        for i in range(len(xs)):
-            x = np.float64(xs[i])
-            max_distance = np.float64(max_distance)
-            durmax = np.float64(durmax)
-            lastday = np.float64(lastday_obs) 
-            x = np.power(10,x)
-            sens_last = np.float64(sens_last)
-            flux_err = np.float64(flux_err)
-            sens_maxgap = np.float64(sens_maxgap)
-            dur_maxgap = np.float64(dur_maxgap)
-
-            # try:
-            # durmax_y[i] = np.divide((1 + flux_err) * sens_last * (lastday_obs),(x - np.divide(np.power((durmax - lastday_obs + x/2.0 ),3.0)-np.power((durmax - lastday_obs - x/2.0 ),3.0),(3.0*np.power((x/2.0),2.0)))))
-                # durmax_y = np.append(durmax_y, (1. + flux_err) * sens_last * day1_obs /  (day1_obs - (1.0/(3.0*np.power(x/2.0,2.0)))*(np.power(durmax + x, 3.0) - np.power(durmax - day1_obs + np.power(10.0, x), 3.0))))
-            # except:
-                # durmax_y[i] = np.inf
-                # durmax_y = np.append(durmax_y, np.inf)
-            # try:
-            
-            maxdist_y[i] = np.divide((1 + flux_err) * sens_maxgap * dur_maxgap, ( x - max_distance) - np.divide(np.power((x/2.0),3.0)-np.power((max_distance - x/2.0),3.0),(3.0*np.power((x/2.0),2.0))))
-            # maxdist_y[i] = (1. + flux_err) * sens_maxgap * dur_maxgap /  ((x - max_distance) - ((np.power((max_distance + x/2.0),3.0)-np.power((max_distance - x/2.0),3.0))/(3.0*np.power((x/2.0),2.0))))
-            # maxdist_y[i] = (1. + flux_err) * sens_maxgap * dur_maxgap /  (dur_maxgap - (1.0/(3*np.power(x/2.0,2.0)))*(np.power(max_distance + x, 3.0) - np.power(max_distance, 3.0)))
-            
-            
-            
-            # (day1_obs - (1.0/(3*np.power(x/2.0,2.0)))*(np.power(max_distance + day1_obs, 3.0) - np.power(max_distance, 3.0)))
-            # except:
-                # maxdist_y[i] = np.inf
-                # maxdist_y = np.append(maxdist_y, np.inf)    
+        x = np.power(10, xs.astype(np.float64))
+        max_distance = np.float64(max_distance)
+        with np.errstate(all='ignore'):
+            maxdist_y = np.divide((1 + flux_err) * sens_maxgap * dur_maxgap, ( x - max_distance) - np.divide(np.power((x/2.0),3.0)-np.power((max_distance - x/2.0),3.0),(3.0*np.power((x/2.0),2.0))))
+            # maxdist_y = (1. + flux_err) * sens_maxgap * dur_maxgap /  ((x - max_distance) - ((np.power((max_distance + x/2.0),3.0)-np.power((max_distance - x/2.0),3.0))/(3.0*np.power((x/2.0),2.0))))
+            # maxdist_y = (1. + flux_err) * sens_maxgap * dur_maxgap /  (dur_maxgap - (1.0/(3*np.power(x/2.0,2.0)))*(np.power(max_distance + x, 3.0) - np.power(max_distance, 3.0)))
         durmax_y_indices = np.where((durmax_y < np.amax(10**ys)) &  (durmax_y > np.amin(10**ys)))[0]
       #   durmax_y_indices = np.where((durmax_y < np.amax(10**ys)) &  (durmax_y > np.amin(10**ys)))[0]
        #  maxdist_y_indices = np.where((10**xs > max_distance) & (maxdist_y < np.amax(10**ys)) & (maxdist_y > np.amin(10**ys)))[0]
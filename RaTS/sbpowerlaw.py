@@ -1,21 +1,11 @@
 import numpy as np
-import os
-import sys
-from scipy.integrate import quad
-from tqdm import tqdm
-# from scipy.integrate import trapezoid
-from fractions import Fraction
-from decimal import Decimal
-import datetime
-import subprocess
-import uuid
-from scipy.integrate import quad_vec
-from multiprocessing import Pool
+from RaTS.numericlc import panel_quad
 
 class sbpowerlaw:
     """smoothly broken power law lightcurve class"""
     # class variables
     edges=[1,0] # 1 is a definite edge, tophat is the default and has a definite beginning and end. Therefore it is [1,1]
+    averaged=False # fluxint is the flux integrated over the observation rather than its average
     def __init__(self, alpha1=0.8, alpha2=-2.1, s=10**0.39, nu0=3, nu=3, beta=-0.61  ):
         # from Mooley et al. 2018 https://arxiv.org/abs/1810.12927
         self.alpha1 = alpha1
@@ -35,85 +25,62 @@ class sbpowerlaw:
 
     def tbreakfromdur(self, t1, tau):
         return np.exp((self.alpha1*np.log(t1) - self.alpha2*np.log(t1+tau))/(self.alpha1 - self.alpha2)) - t1
+
+    def timescale(self, tcrit, tau):
+        """Return the break time, the light curve only depends on the time after the critical time in units of it"""
+        return self.tbreakfromdur(tcrit, tau)
     def fluxint(self, F0, tcrit, tau, end_obs, start_obs):
         """Return the integrated flux"""
        #  def sbpl(t,tb):
        #       return  ((t/tb)**(-self.s*self.alpha1) + (t/tb)**(-self.s*self.alpha2))**(-1/self.s)
        #  def sbpl2(x):
        #       return  ((x)**(-self.s*self.alpha1) + (x)**(-self.s*self.alpha2))**(-1/self.s)
-        intflux = np.zeros(F0.shape)
-        t1 = np.maximum(start_obs, tcrit - tau)
-        unique_filename = str(uuid.uuid4())+'.csv'
-       #  result = np.zeros(len(F0),dtype=float)
-        error = np.zeros(len(F0), dtype=float)
-        s = self.s
-        nu = self.nu
-        nu0 = self.nu0
-        beta = self.beta
-        alpha1 = self.alpha1
-        alpha2 = self.alpha2
-        def integratelc(mytau, mytc, myf0, t2, t1):
-            tb = self.tbreakfromdur(mytc, mytau)
-            tstart = t1 - mytc
-            tend = t2 - mytc
-            sbpl = lambda t: (2**(1/s)) * myf0 * (nu/nu0)**(beta) * ( (t/tb)**(-s*alpha1) * (t/tb)**(-s*alpha2))**(-1/s)
-            intflux, error = quad_vec(sbpl, tstart, tend)
-            return intflux, error
+        # the arguments may be (sources, 1) and (scans,) arrays, every pair of them is one interval of panel_quad
+        shape = np.broadcast(F0, tcrit, tau, end_obs, start_obs).shape
+        F0, tcrit, tau, end_obs, start_obs = [np.broadcast_to(a, shape).ravel() for a in (F0, tcrit, tau, end_obs, start_obs)]
+        tb = self.tbreakfromdur(tcrit, tau)
+        tstart = start_obs - tcrit
+        tend = end_obs - tcrit
         intflux = np.zeros(len(F0))
-        for i,(mytau, mytc, myf0, t2, t1) in enumerate(zip(tau,tcrit,F0,end_obs,start_obs)):
-            intflux[i], error[i] = integratelc(mytau, mytc, myf0, t2, t1)
-        return intflux
-            
+        # The light curve is zero before the critical time and its integral diverges at it, so observations starting at 
+        # the critical time get inf and ones spanning it nan, as they did with the adaptive quadrature
+        after = tstart > 0
+        intflux[after], _ = panel_quad(self.sbpl, tstart[after], tend[after], args=(tb[after],), logtime=True)
+        intflux[tstart == 0] = np.inf
+        intflux[(tstart < 0) & (tend > 0)] = np.nan
+        return (F0*intflux).reshape(shape)
+
+    def sbpl(self, t, tb):
+        """Return the light curve for a peak flux of 1 at time t after the critical time"""
+        s = self.s
+        with np.errstate(all='ignore'):
+            return (2**(1/s)) * 1 * (self.nu/self.nu0)**(self.beta) * ( (t/tb)**(-s*self.alpha1) * (t/tb)**(-s*self.alpha2))**(-1/s)
+
     def lines(self, xs, ys, durmax, max_distance, flux_err, obs):
-        gaps = np.array([],dtype=np.float32)
-        for i in range(len(obs)-1):
-            gaps = np.append(gaps, obs['start'][i+1] - obs['start'][i] + obs['duration'][i])
-            # gaps = np.append(gaps, obs[i+1,0] - obs[i,0])
+        from RaTS.compute_lc import largest_gap # obs is an ObservationSchedule or a plain observation array
+        maxgap = largest_gap(obs)
         min_sens = min(obs['sens'])
         max_sens = max(obs['sens'])
         sens_last = obs['sens'][-1]
         day1_obs = obs['duration'][0]
         # durmax_x = np.empty(len(ys))
         # durmax_x.fill(np.log10(durmax))
-        durmax_y = np.zeros(xs.shape,dtype=np.float64)
-        maxdist_y = np.zeros(xs.shape,dtype=np.float64)
-        sens_maxgap = obs['sens'][np.where((gaps[:] == max(gaps)))[0]+1][0]
-        start_maxgap = obs['start'][np.where((gaps[:] == max(gaps)))[0]+1][0]
-        before_maxgap = obs['start'][np.where((gaps[:] == max(gaps)))[0]][0]
-        duration_maxgap = obs['duration'][np.where((gaps[:] == max(gaps)))[0]+1][0]
+        sens_maxgap = obs['sens'][maxgap+1]
+        start_maxgap = obs['start'][maxgap+1]
+        before_maxgap = obs['start'][maxgap]
+        duration_maxgap = obs['duration'][maxgap+1]
         sens_last = obs['sens'][-1]
-        s = self.s
-        nu = self.nu
-        nu0 = self.nu0
-        beta = self.beta
-        alpha1 = self.alpha1
-        alpha2 = self.alpha2
-        for i in range(len(xs)):
-            x = np.power(10,xs[i])
-            try:
-                tb = self.tbreakfromdur(obs['start'][0],x)
-                mytc = obs['start'][0]
-                t1 = obs['start'][-1] - mytc
-                t2 = obs['start'][-1] + obs['duration'][-1] - mytc
-                sbpl = lambda t: (2**(1/s)) * 1 * (nu/nu0)**(beta) * ( (t/tb)**(-s*alpha1) * (t/tb)**(-s*alpha2))**(-1/s)
-                result, error = quad_vec(sbpl, t1, t2)
-                # result, error = sbpl.integrate((self.alpha1, self.alpha2, self.s, self.tbreakfromdur(obs['start'][0],x), obs['start'][-1] + obs['duration'][-1], obs['start'][0], 1, self.nu, self.nu0, self.beta,obs['start'][-1]))
-                durmax_y[i] = (1.+flux_err)*sens_last/result
-              #   print('durmax_y ',durmax_y[i], 'duration ',x)
-            except exception as e:
-                print(e)
-                durmax_y[i]=np.inf
-            try:
-                tb = self.tbreakfromdur(before_maxgap,x)
-                mytc = before_maxgap
-                t2 = start_maxgap + duration_maxgap - mytc
-                t1 = start_maxgap - mytc
-                sbpl = lambda t: (2**(1/s)) * 1 * (nu/nu0)**(beta) * ( (t/tb)**(-s*alpha1) * (t/tb)**(-s*alpha2))**(-1/s)
-                result, error = quad_vec(sbpl, t1, t2)
-                maxdist_y[i] = (1.+flux_err)*sens_maxgap/result
-            except exception as e:
-                print(e)
-                maxdist_y[i] = np.inf
+        x = np.power(10, xs)
+        def integratelines(mytc, t1, t2):
+            # every duration has its own break time, so each is one interval of panel_quad
+            result, error = panel_quad(self.sbpl, np.full(x.shape, t1), t2, args=(self.tbreakfromdur(mytc, x),), logtime=True)
+            return result
+        mytc = obs['start'][0]
+        with np.errstate(all='ignore'):
+            durmax_y = (1.+flux_err)*sens_last/integratelines(mytc, obs['start'][-1] - mytc, obs['start'][-1] + obs['duration'][-1] - mytc)
+            maxdist_y = (1.+flux_err)*sens_maxgap/integratelines(before_maxgap, start_maxgap - before_maxgap, start_maxgap + duration_maxgap - before_maxgap)
+        durmax_y[~np.isfinite(durmax_y)] = np.inf
+        maxdist_y[~np.isfinite(maxdist_y)] = np.inf
         durmax_x = ' '
         maxdist_x = ' '
         # maxdist_x = np.empty(len(ys))
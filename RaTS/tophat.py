@@ -1,3 +1,4 @@
+import math
 import numpy as np
 class tophat:
     """tophat lightcurve class"""
@@ -10,11 +11,22 @@ class tophat:
     def latest_crit_time(self, end_survey, tau):
         return end_survey
     
+    def support(self, tcrit, tau):
+        """Return the times between which the light curve is on"""
+        return tcrit, tcrit + tau
+    
     def fluxint(self, F0, tcrit, tau, end_obs, start_obs):
         """Return the integrated flux"""
         tstart = np.maximum(tcrit, start_obs) - tcrit
         tend = np.minimum(tcrit + tau, end_obs) - tcrit
         return np.multiply(F0, np.divide((tend - tstart), (end_obs-start_obs)))
+
+    @staticmethod
+    def scalar_fluxint(F0, tcrit, tau, end_obs, start_obs):
+        """Return the integrated flux of one source over one observation, for the jit backend"""
+        tstart = max(tcrit, start_obs) - tcrit
+        tend = min(tcrit + tau, end_obs) - tcrit
+        return F0*((tend - tstart)/(end_obs - start_obs))
     
     def lines(self, xs, ys, durmax, max_distance, flux_err, obs):
         durmax_x = np.empty(len(ys))
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 class wilma:
     """wilma lightcurve class"""
@@ -10,37 +11,41 @@ class wilma:
     def latest_crit_time(self, end_survey, tau):
         return end_survey + tau
     
+    def support(self, tcrit, tau):
+        """Return the times between which the light curve is above 1e-15 of its peak"""
+        return tcrit - tau*np.log(1e15), tcrit
+    
     def fluxint(self, F0, tcrit, tau, end_obs, start_obs):
         """Return the integrated flux"""
         tstart = start_obs - tcrit# Burst really starts, so we always start at the beginning of the observation
         tend = np.minimum(end_obs,tcrit) - tcrit 
     
         return np.multiply(F0, np.multiply(tau, np.divide(np.exp(np.divide(tend,tau)) - np.exp(np.divide(tstart,tau)) , (end_obs-start_obs))))
+
+    @staticmethod
+    def scalar_fluxint(F0, tcrit, tau, end_obs, start_obs):
+        """Return the integrated flux of one source over one observation, for the jit backend"""
+        if start_obs >= tcrit: # after the burst, where fluxint is zero or negative and clipped to zero
+            return 0.
+        tstart = start_obs - tcrit
+        tend = min(end_obs, tcrit) - tcrit
+        return F0*(tau*((math.exp(tend/tau) - math.exp(tstart/tau))/(end_obs - start_obs)))
         
     def lines(self, xs, ys, durmax, max_distance, flux_err, obs):
-        gaps = np.zeros(len(obs)-1,dtype=np.float32)
-        for i in range(len(obs)-1):
-            gaps[i] =  obs['start'][i+1] - obs['start'][i] + obs['duration'][i]
-            # gaps = np.append(gaps, obs[i+1,0] - obs[i,0])
+        from RaTS.compute_lc import largest_gap # obs is an ObservationSchedule or a plain observation array
+        maxgap = largest_gap(obs)
         min_sens = min(obs['sens'])
         max_sens = max(obs['sens'])
         sens_last = obs['sens'][-1]
-        sens_maxgap = obs['sens'][np.where((gaps[:] == max(gaps)))[0]-1][0]
-        durmax_y = np.zeros(xs.shape,dtype=np.float64)
-        maxdist_y = np.zeros(xs.shape,dtype=np.float64)
+        sens_maxgap = obs['sens'][maxgap-1]
         day1_obs = obs['duration'][0]
-        obspregap = obs['duration'][np.where((gaps[:] == max(gaps)))[0]-1][0]
+        obspregap = obs['duration'][maxgap-1]
         sens_first = obs['sens'][0]
-        for i in range(len(xs)):
-            x = xs[i]
-            try:
-                durmax_y[i] = (1. + flux_err) * sens_last * day1_obs / np.power(10,x) / (np.exp(-(durmax - day1_obs) /  np.power(10,x)) - np.exp(-((durmax) / np.power(10,x))))
-            except:
-                durmax_y[i] = np.inf
-            try:
-                maxdist_y[i] =   (((1. + flux_err) * sens_maxgap * obspregap) /  np.power(10,x))   / (np.exp(-(max_distance / np.power(10,x))) - np.exp(-(max_distance + obspregap) / np.power(10,x)))
-            except:
-                maxdist_y[i] = np.inf   
+        tau = np.power(10, xs)
+        # Durations too short or too long for the exponentials come out as inf or nan, which never fall inside the plot
+        with np.errstate(all='ignore'):
+            durmax_y = (1. + flux_err) * sens_last * day1_obs / tau / (np.exp(-(durmax - day1_obs) /  tau) - np.exp(-((durmax) / tau)))
+            maxdist_y =   (((1. + flux_err) * sens_maxgap * obspregap) /  tau)   / (np.exp(-(max_distance / tau)) - np.exp(-(max_distance + obspregap) / tau))
         durmax_x = ' '
         maxdist_x = ' '
         durmax_y_indices = np.where((durmax_y < np.amax(10**ys)) &  (durmax_y > np.amin(10**ys)))[0]
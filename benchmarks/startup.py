@@ -0,0 +1,46 @@
+"""Time how long RaTS takes to start: importing compute_lc, simulate.py --help, setting up the observations of trial mode
+and loading each light curve, every one in a fresh interpreter. Also lists the heavy libraries that importing compute_lc
+and setting up trial mode pull in, which should be none"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY = ('matplotlib', 'astropy', 'scipy')
+# The observations simulate.py sets up without an observation file, with the defaults of config.ini
+TRIAL = "from RaTS import compute_lc; compute_lc.observing_strategy(None, 5, 46, 21.7e-6, 4.6e-6, 7, 0.009)"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(command, repeat):
+    """Run command in a fresh interpreter repeat times. Return the median wall time in seconds"""
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+if __name__=='__main__':
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--repeat", type=int, default=5, help="Number of runs of each command, the median is reported. Default is 5")
+    config = argparser.parse_args()
+    sys.path.insert(0, ROOT)
+    from RaTS.lightcurves import BUILTIN
+
+    python = sys.executable
+    commands = [("python (baseline)", [python, '-c', 'pass']),
+        ("import numpy", [python, '-c', 'import numpy']),
+        ("import RaTS.compute_lc", [python, '-c', 'import RaTS.compute_lc']),
+        ("simulate.py --help", [python, os.path.join(ROOT, 'scripts', 'simulate.py'), '--help']),
+        ("trial mode observations", [python, '-c', TRIAL])]
+    commands += [(f"load_lightcurve('{name}')", [python, '-c', f"from RaTS.lightcurves import load_lightcurve; load_lightcurve('{name}')"]) for name in BUILTIN]
+    for label, command in commands:
+        print(f"{label:<40} {run(command, config.repeat):7.3f} s")
+    for label, setup in (("importing RaTS.compute_lc", "import RaTS.compute_lc"), ("trial mode observations", TRIAL)):
+        check = f"import sys; {setup}; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+        heavy = subprocess.run([python, '-c', check], env=dict(os.environ, PYTHONPATH=ROOT), check=True, capture_output=True, text=True).stdout.split()
+        print(f"Heavy libraries imported by {label}:", ', '.join(heavy) if heavy else 'none')
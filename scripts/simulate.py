@@ -5,9 +5,9 @@ import numpy as np
 import os
 import argparse
 import warnings
+import multiprocessing
 from RaTS import compute_lc
-from RaTS import tophat
-import importlib
+from RaTS import lightcurves
 from tqdm import tqdm
 # warnings.simplefilter("error", RuntimeWarning)
 
@@ -21,9 +21,34 @@ def get_configuration():
     argparser.add_argument("--burstflux", help="All simulated transients this flux (Jy)")    
     argparser.add_argument("--keep", action='store_true', help="Keep previous bursts")
     argparser.add_argument("--configfile", default='config.ini', help="Configuration file. Default is config.ini")
+    argparser.add_argument("--workers", type=int, default=1, help="Number of worker processes used to simulate the duration and flux bins. Default is 1 (serial)")
+    argparser.add_argument("--engine", default='bins', choices=['bins', 'unitflux', 'grid', 'analytic'], help="How to simulate the grid. bins simulates each bin separately, unitflux integrates one set of sources per duration row and rescales it to every flux bin, grid draws the sources of the whole grid in large blocks and bins them with statistics(), analytic draws no sources and integrates the detection probability over the critical times, durations and fluxes of each bin with the flux noise marginalized. Default is bins")
+    argparser.add_argument("--mc-false-detections", action='store_true', help="Also count the false detections with a Monte Carlo run of the bins engine with a tophat longer than the survey against observations all at the first epoch, and use those counts. Only needed to validate the analytic false detections")
+    argparser.add_argument("--tolerance", type=float, help="Simulate every bin of the bins engine in batches until the 95%% confidence interval on its probability is narrower than this half width, instead of srcperbin sources. The number of sources and the half width of each bin are kept in the 4th and 5th columns of its stats")
+    argparser.add_argument("--min-sources", type=int, default=100, help="Sources in the first batch of a bin with --tolerance. Default is 100")
+    argparser.add_argument("--max-sources", type=int, default=100000, help="Most sources simulated in a bin with --tolerance. Default is 100000")
+    argparser.add_argument("--interval", default='wilson', choices=['wilson', 'clopper-pearson'], help="Confidence interval used by --tolerance. Default is wilson")
+    argparser.add_argument("--adaptive-levels", type=int, default=0, help="Refine the grid adaptively, starting from cells of 2**N by 2**N bins and splitting those whose probability differs from a neighbour's by more than --adaptive-threshold down to single bins. The stats are then scattered points. Default is 0, every bin is simulated")
+    argparser.add_argument("--adaptive-threshold", type=float, default=0.1, help="Difference in probability between neighbouring cells above which --adaptive-levels splits them. Default is 0.1")
+    argparser.add_argument("--atol", type=float, default=1e-3, help="Absolute accuracy of the detection probabilities of the analytic engine. Default is 1e-3")
+    argparser.add_argument("--backend", default='numpy', choices=['numpy', 'jit'], help="How the bins and grid engines detect sources. numpy is the reference implementation, jit compiles one pass over the observations per source with numba, if it is installed and the light curve has a scalar_fluxint. Default is numpy")
+    argparser.add_argument("--chunksize", type=int, help="Largest number of sources detected at once by the grid engine. Default is a whole block of 16384 sources")
+    argparser.add_argument("--seed", type=int, help="Seed for the random numbers, so that a run can be repeated exactly. Default is a fresh seed, which is printed")
+    argparser.add_argument("--coverage", default='caps', choices=['caps', 'pixels'], help="How to find the regions covered by each combination of pointings. caps uses the exact geometry of up to three overlapping fields, pixels tiles the sky in equal area pixels and handles any number of overlapping fields. Default is caps")
+    argparser.add_argument("--pixels-per-fov", type=int, default=4096, help="Number of pixels covering the smallest field of view for --coverage pixels. Default is 4096")
+    argparser.add_argument("--no-plots", action='store_true', help="Only save the probabilities and transient rates of the bins, without making any plots")
+    argparser.add_argument("--plot-workers", type=int, default=1, help="Number of background processes making the plots while the next region is simulated. 0 makes them in the main process. Default is 1")
+    argparser.add_argument("--plot-resolution", type=int, default=1000, help="Number of points along each axis of the interpolated probability and rate plots. Default is 1000")
+    argparser.add_argument("--flux-table", action='store_true', help="Interpolate the integrated flux in a lookup table of the light curve, built once and saved in --table-dir, instead of integrating it for every source")
+    argparser.add_argument("--table-rtol", type=float, default=1e-3, help="Relative accuracy of the --flux-table lookup table. Default is 1e-3")
+    argparser.add_argument("--table-dir", help="Directory of the --flux-table lookup tables. Default is ~/.cache/RaTS")
+    argparser.add_argument("--max-mem", help="Rough limit on the memory used for the (sources, observations) arrays of each process, e.g. 512M or 4G. Default is no limit")
 
 
-    return argparser.parse_args()
+    config = argparser.parse_args()
+    if config.tolerance is not None and config.engine != 'bins':
+        argparser.error("--tolerance needs --engine bins, the only engine that simulates the bins one by one")
+    return config
 
 def read_ini_file(filename):
     """Reads config.ini and returns a dictionary of its contents"""
@@ -50,6 +75,130 @@ def write_stat(filename, bursts):
             f.write("{}\t{}\t{}\t{}\t{}\n".format(burst[0], burst[1], burst[2], burst[3], burst[4]))        # for python 2.7 (struis)
         f.flush()
 
+def render_plots(plotpool, renders, *args, **kwargs):
+    """Hand the plots of a region to the background plotting processes, or make them right away if there are none"""
+    if plotpool is None:
+        compute_lc.make_mpl_plots(*args, **kwargs)
+    else:
+        renders.append(plotpool.apply_async(compute_lc.make_mpl_plots, args, kwargs))
+
+
+def simulate_region(config, params, lightcurve, lightcurvetype, schedule, fake_obs, region, seed, dur_ints, flux_bins, maxmem, plotpool, renders):
+    """Simulate the transients of one region of the sky, print how the run went and hand its plots over. Return its stats"""
+
+    current_obs = schedule.region(region['identity'])
+    tsurvey = current_obs.durmax
+    startepoch = region['start']
+    stopepoch = region['stop']
+    flux_err = float(params['INITIAL PARAMETERS']['flux_err'])
+    det_threshold = float(params['INITIAL PARAMETERS']['det_threshold'])
+    burstlength = np.float32(config.burstlength)
+    burstflux = np.float32(config.burstflux)
+    targetnum = int(float(params['INITIAL PARAMETERS']['srcperbin'])) # Inner parenthesis is important for type conversion
+    simseed, fakeseed = seed.spawn(2)
+    # iterate over bins
+    stats, detectedsources, (srcsimtime, dettime, stattime), bursts, detbool = compute_lc.simulate_grid(current_obs.obs,
+        lightcurve,
+        lightcurvetype,
+        startepoch,
+        stopepoch,
+        dur_ints,
+        flux_bins,
+        targetnum,
+        flux_err,
+        det_threshold,
+        burstlength,
+        burstflux,
+        seed=simseed,
+        workers=config.workers,
+        engine=config.engine,
+        chunksize=config.chunksize,
+        max_mem=maxmem,
+        backend=config.backend,
+        atol=config.atol,
+        tolerance=config.tolerance,
+        minsources=config.min_sources,
+        maxsources=config.max_sources,
+        interval=config.interval,
+        levels=config.adaptive_levels,
+        threshold=config.adaptive_threshold)
+    if config.keep and bursts is not None: # the analytic engine draws no sources
+        with open(params['INITIAL PARAMETERS']['file'] + '_' + lightcurvetype + '_SimTrans', 'w') as f:
+                f.write('# Tcrit\tcharacteristic\tPkFlux\n')        ## INITIALISE LIST OF SIMILATED TRANSIENTS
+        write_source(params['INITIAL PARAMETERS']['file'] + '_' + lightcurvetype + '_SimTrans' , bursts) #file with starttime\tduration\tflux
+        print("Written Simulated Sources")
+            
+    print(srcsimtime,"seconds simulating sources")
+    print(dettime, "seconds detecting sources")
+    print(stattime,"seconds aggregating stats")
+    totaltime = srcsimtime + dettime +stattime
+    print(100*srcsimtime/totaltime,"% of the time simulating sources")
+    print(100*dettime/totaltime, "% of the time detecting sources")
+    print(100*stattime/totaltime,"% of the time aggregating stats")
+    print(np.sum(detectedsources),"sources detected")
+    cdet = False # no false detection histogram for transients of a single length and flux
+    if not (np.isnan(burstlength) and np.isnan(burstflux)):
+        if detbool is not None:
+            print("Percent detected:", np.mean(detbool))
+            print(np.sum(detbool))
+        else: # every bin holds the same sources, so the last bin's probability is the fraction detected
+            print("Percent detected:", stats[-1,2])
+        print("Gap percentage:", current_obs.gap_fraction(det_threshold))
+    else:
+        # False detections are sources of constant flux that are only detected in some observations because of
+        # the flux noise and variations in observation sensitivity. They are worked out for every flux bin with as
+        # many sources as the duration bins together hold. 
+        detectedsources = compute_lc.false_detections(current_obs.obs, flux_bins, targetnum*(len(dur_ints) - 1), flux_err, det_threshold)
+        if config.mc_false_detections:
+            # Repeat all of the steps from simulating the sources to gathering statistics, but this time with a
+            # single large value for transient duration and a single point in time for observations
+            analytic = detectedsources
+            from RaTS import tophat
+            tophatlc = tophat.tophat()
+            _, detectedsources, _, _, _ = compute_lc.simulate_grid(fake_obs[current_obs.index],
+                tophatlc,
+                "tophat",
+                startepoch,
+                stopepoch,
+                dur_ints,
+                flux_bins,
+                targetnum,
+                flux_err,
+                det_threshold,
+                2*tsurvey,
+                burstflux,
+                seed=fakeseed,
+                workers=config.workers,
+                fixedstart=fake_obs['start'][0],
+                engine='bins', # sampled whatever the engine, to check the analytic false detections against
+                max_mem=maxmem,
+                backend=config.backend)
+            print("False detections: Monte Carlo", np.sum(detectedsources), "analytic", np.sum(analytic), "largest difference in a flux bin", np.amax(np.abs(detectedsources - analytic)))
+        cdet = (detectedsources,flux_bins)
+
+    render_plots(plotpool, renders, region['identity'].replace('&', 'and'),
+        float(params['INITIAL PARAMETERS']['fl_min']),
+        float(params['INITIAL PARAMETERS']['fl_max']),
+        float(params['INITIAL PARAMETERS']['dmin']),
+        float(params['INITIAL PARAMETERS']['dmax']),
+        det_threshold,
+        float(params['INITIAL PARAMETERS']['extra_threshold']),
+        current_obs,
+        cdet,
+        params['INITIAL PARAMETERS']['file'],
+        flux_err,
+        np.copy(stats),
+        2,
+        lightcurve.lines,
+        region['area'],
+        tsurvey,
+        int(params['INITIAL PARAMETERS']['detections']),
+        float(params['INITIAL PARAMETERS']['confidence'])/100,
+        params['INITIAL PARAMETERS']['file'],
+        resolution=config.plot_resolution,
+        plots=not config.no_plots)
+    return stats
+
 
 if __name__=='__main__':
     #currently must be "tophat" or "fred" or "gaussian" or "wilma" or "ered" or  'parabolic' or 'choppedgaussian'
@@ -64,387 +213,98 @@ if __name__=='__main__':
         with open("config.ini","w") as f:
             f.write(configfilestring)
         exit()
-    lightcurve_obj = getattr(importlib.import_module(f"RaTS.{lightcurvetype}"), lightcurvetype) # import the lightcurve class specified in the config file 
+    lightcurve_obj = lightcurves.load_lightcurve(lightcurvetype) # import the lightcurve class specified in the config file 
     lightcurve = lightcurve_obj()
-    burstlength = np.float32(config.burstlength)
-    burstflux = np.float32(config.burstflux)
+    if config.flux_table:
+        from RaTS import fluxtable
+        lightcurve = fluxtable.fluxtable(lightcurve, rtol=config.table_rtol, directory=config.table_dir)
+        print(f"Flux table {lightcurve.filename}: {len(lightcurve.axis)}x{len(lightcurve.axis)} points, largest error {lightcurve.error:.2g}")
+    if config.backend == 'jit':
+        from RaTS import jitkernels
+        reason = jitkernels.unavailable(lightcurve)
+        if reason is not None:
+            print(f"Using the numpy backend, the jit backend is unavailable: {reason}")
+            config.backend = 'numpy'
+    maxmem = compute_lc.parse_memory(config.max_mem) # bytes, or None for no limit
+    # Every random number comes from one seed tree: one branch for the simulated observations and one per region, which 
+    # is split again per duration row and per bin, so results do not depend on --workers, --chunksize or --max-mem
+    rootseed = np.random.SeedSequence(config.seed)
+    print("Random seed:", rootseed.entropy)
+    obsseed, regionsseed = rootseed.spawn(2)
     obs, pointFOV = compute_lc.observing_strategy(config.observations, 
         float(params['INITIAL PARAMETERS']['det_threshold']), 
         int(params['SIM']['nobs']), 
         float(params['SIM']['obssens']), 
         float(params['SIM']['obssig']), 
         float(params['SIM']['obsinterval']), 
-        float(params['SIM']['obsdurations']))
+        float(params['SIM']['obsdurations']),
+        rng=obsseed)
+    compute_lc.load_scans(obs, float(params['INITIAL PARAMETERS']['det_threshold'])) # parse every scans file once up front
     uniquepointFOV = np.unique(pointFOV, axis=0)
-    regions, obssubsection = compute_lc.calculate_regions(pointFOV, obs)
-    leftoff = len(uniquepointFOV)
-    overlapnums = np.zeros(len(regions), dtype={'names': ('name', 'sources'), 'formats': ('<U6','f8')})
-    obsmask = np.zeros((len(obs),len(uniquepointFOV)),dtype=bool)
-    tsurveylist= []
+    if config.coverage == 'pixels':
+        regions, _ = compute_lc.pixel_regions(pointFOV, obs, pixels_per_fov=config.pixels_per_fov, max_mem=maxmem)
+    else:
+        regions, _ = compute_lc.calculate_regions(pointFOV, obs)
+    schedule = compute_lc.ObservationSchedule(obs, pointFOV)
+    # Observations of the false detection runs, all at the time of the first observation
+    fake_obs = np.copy(obs)
+    fake_obs['start'] = np.full(fake_obs['start'].shape, fake_obs['start'][0])
+    fake_obs['gaps'] = 'False'
     fl_min = float(params['INITIAL PARAMETERS']['fl_min'])
     fl_max = float(params['INITIAL PARAMETERS']['fl_max'])
     dmin = float(params['INITIAL PARAMETERS']['dmin'])
     dmax = float(params['INITIAL PARAMETERS']['dmax'])
-    statlist = []
-    for i in range(len(uniquepointFOV)):
-        obsmask[:,i] = [np.all(p) for p in pointFOV[obssubsection[i][0]]==pointFOV]
-        tsurvey = obs[obsmask[:,i]][-1][0] + obs[obsmask[:,i]][-1][1] - obs[obsmask[:,i]][0][0] 
-        tsurveylist.append(tsurvey)
-        startepoch = regions['start'][i]
-        stopepoch = regions['stop'][i]
-        targetnum = int(float(params['INITIAL PARAMETERS']['srcperbin'])) # Inner parenthesis is important for type conversion
-        # Create bins
-        flux_bins = np.geomspace(fl_min, fl_max, num=int(round((np.log10(fl_max)-np.log10(fl_min))/0.05)), endpoint=True)
-        dur_ints = np.geomspace(dmin, dmax, num=int(round((np.log10(dmax)-np.log10(dmin))/0.05)), endpoint=True)
-        durations = (dur_ints[:-1] + dur_ints[1:])/2
-        fluxes = (flux_bins[:-1] + flux_bins[1:])/2
-        stats = np.zeros(((len(flux_bins)-1)*(len(dur_ints)-1), 5), dtype=np.float32)
-        # iterate over bins
-        statcounter = 0
-        srcsimtime = 0
-        dettime = 0
-        stattime = 0
-        detectedsources = np.zeros(len(flux_bins[:-1]),dtype=int)
-        for ldurbin,rdurbin in tqdm(zip(dur_ints[:-1],dur_ints[1:]),total=len(dur_ints[:-1])):
-            thisdur = (ldurbin+rdurbin)/2
-            for fluxind,(lfluxbin,rfluxbin) in enumerate(zip(flux_bins[:-1],flux_bins[1:])):
-                t1 = datetime.datetime.now()
-                thisflux = (lfluxbin + rfluxbin)/2
-                bursts = compute_lc.generate_sources(targetnum, #n_sources
-                    startepoch, #start_survey
-                    stopepoch, #end_survey
-                    lfluxbin, #Flux min
-                    rfluxbin, #Flux max
-                    ldurbin, # duration min
-                    rdurbin,  #duration max
-                    lightcurvetype,
-                    burstlength,
-                    burstflux) # 
-    
-                bursts = compute_lc.generate_start(bursts, 
-                    lightcurve.earliest_crit_time(startepoch,bursts['chardur']), # earliest crit time
-                    lightcurve.latest_crit_time(stopepoch,bursts['chardur']),  # latest crit time
-                    targetnum)
-                t2 = datetime.datetime.now() 
-                srcsimtime+= (t2-t1).total_seconds()
-                if config.keep:
-                    with open(params['INITIAL PARAMETERS']['file'] + '_' + lightcurvetype + '_SimTrans', 'w') as f:
-                            f.write('# Tcrit\tcharacteristic\tPkFlux\n')        ## INITIALISE LIST OF SIMILATED TRANSIENTS
-                            write_source(params['INITIAL PARAMETERS']['file'] + '_' + lightcurvetype + '_SimTrans' , bursts) #file with starttime\tduration\tflux
-                            print("Written Simulated Sources")
-    
-                t1 = datetime.datetime.now() 
-                # det are the sources themselves while detbool is a numpy boolean array indexing all sources
-                det, detbool = compute_lc.detect_bursts(obs[obsmask[:,i]], 
-                    float(params['INITIAL PARAMETERS']['flux_err']), 
-                    float(params['INITIAL PARAMETERS']['det_threshold']) , 
-                    bursts, 
-                    lightcurve.fluxint)
-                t2 = datetime.datetime.now()
-                dettime += (t2-t1).total_seconds()
-                t1 = datetime.datetime.now() 
-                stats[statcounter,0] = thisdur 
-                stats[statcounter,1] = thisflux 
-                stats[statcounter,2] = np.nan_to_num(np.sum(detbool)/targetnum) # probability for this bin
-                statcounter+=1
-                
-                detectedsources[fluxind] += np.sum(detbool)
-                t2= datetime.datetime.now()
-                stattime += (t2-t1).total_seconds()
-              
-                
-        print(srcsimtime,"seconds simulating sources")
-        print(dettime, "seconds detecting sources")
-        print(stattime,"seconds aggregating stats")
-        totaltime = srcsimtime + dettime +stattime
-        print(100*srcsimtime/totaltime,"% of the time simulating sources")
-        print(100*dettime/totaltime, "% of the time detecting sources")
-        print(100*stattime/totaltime,"% of the time aggregating stats")
-        print(np.sum(detectedsources),"sources detected")
-        statlist.append(stats)
-        if not (np.isnan(burstlength) and np.isnan(burstflux)):
-            print("Percent detected:", np.sum(detbool)/targetnum)
-            print(np.sum(detbool))
-            gaptime = 0
-            for j in range(len(obs[obsmask[:,i]])):
-                if obs[obsmask[:,i]]['gaps'][j]=='False':
-                    if j!=(len(obs[obsmask[:,i]])-1):
-                        gaptime += obs[obsmask[:,i]]['start'][j+1] - (obs[obsmask[:,i]]['start'][j] + obs[obsmask[:,i]]['duration'][j])
-                else:
-                    subobs, _ = compute_lc.observing_strategy(obs[obsmask[:,i]]['gaps'][j], float(params['INITIAL PARAMETERS']['det_threshold']), 1, 1, 1, 1, 1) # We are giving the scansfile name, so the other variables are unimportant, we set them to 1 
-                    for k in range(len(subobs)-1):
-                        gaptime += subobs['start'][k+1] - (subobs['start'][k] + subobs['duration'][k])
-                        if (k==len(subobs)-2) and (j!=len(obs[obsmask[:,i]])-1):
-                            gaptime += obs[obsmask[:,i]]['start'][j+1] - (subobs['start'][k+1] + subobs['duration'][k+1])
-            print("Gap percentage:", gaptime/(obs[obsmask[:,i]]['start'][-1] + obs[obsmask[:,i]]['duration'][-1] - obs[obsmask[:,i]]['start'][0]))
-        else:
-            # We now repeat all of the steps from simulating the sources to gathering statistics, but this time we 
-            # use a single large value for transient duration and a single point in time for observations. We do this
-            # to help eliminate false detections due to variations in observation sensitivity. 
-    
-            fake_obs = np.copy(obs)
-            fake_obs['start'] = np.full(fake_obs['start'].shape, fake_obs['start'][0])
-            fake_obs['gaps'] = 'False'
-            tophatlc = tophat.tophat()
-            fdstats = np.zeros(((len(flux_bins)-1)*(len(dur_ints)-1), 5), dtype=np.float32)
-            # iterate over bins
-            statcounter = 0
-            detectedsources = np.zeros(len(flux_bins[:-1]),dtype=int)
-            for ldurbin,rdurbin in tqdm(zip(dur_ints[:-1],dur_ints[1:]),total=len(dur_ints[:-1])):
-                thisdur = (ldurbin+rdurbin)/2
-                for fluxind, (lfluxbin,rfluxbin) in enumerate(zip(flux_bins[:-1],flux_bins[1:])):
-                    thisflux = (lfluxbin + rfluxbin)/2
-                    fdbursts = compute_lc.generate_sources(targetnum, #n_sources
-                        startepoch, #start_survey
-                        stopepoch, #end_survey
-                        lfluxbin, #Flux min
-                        rfluxbin, #Flux max
-                        ldurbin, # duration min
-                        rdurbin,  #duration max
-                        "tophat",
-                        2*tsurvey,
-                        burstflux) # 
-                    fdbursts['chartime'] += fake_obs['start'][0]
-            
-    
-    
-                    # det are the sources themselves while detbool is a numpy boolean array indexing all sources
-                    fddet, fddetbool = compute_lc.detect_bursts(fake_obs[obsmask[:,i]], 
-                        float(params['INITIAL PARAMETERS']['flux_err']), 
-                        float(params['INITIAL PARAMETERS']['det_threshold']) , 
-                        fdbursts, 
-                        tophatlc.fluxint)
-                    detectedsources[fluxind] += np.sum(fddetbool)
-                    fdstats[statcounter,0] = thisdur 
-                    fdstats[statcounter,1] = thisflux 
-                    fdstats[statcounter,2] = np.nan_to_num(np.sum(fddetbool)/targetnum) # probability for this bin
-                    statcounter+=1
-            cdet = (detectedsources,flux_bins)
-
-
-                    
-
-        det_threshold = float(params['INITIAL PARAMETERS']['det_threshold'])
-        extra_threshold = float(params['INITIAL PARAMETERS']['extra_threshold'])
-        current_obs = obs[obsmask[:,i]]
-    
-            
-        detections = int(params['INITIAL PARAMETERS']['detections'])
-        confidence = float(params['INITIAL PARAMETERS']['confidence'])/100
-        compute_lc.make_mpl_plots(regions['identity'][i].replace('&', 'and'),
-        fl_min,
-        fl_max,
-        dmin,
-        dmax,
-        det_threshold,
-        extra_threshold,
-        current_obs,
-        cdet,
-        params['INITIAL PARAMETERS']['file'],
-        float(params['INITIAL PARAMETERS']['flux_err']),
-        np.copy(stats),
-        2,
-        lightcurve.lines,
-        regions['area'][i],
-        tsurvey,
-        detections,
-        confidence,
-        params['INITIAL PARAMETERS']['file'])
-    if len(uniquepointFOV) > 1:
-        combinedprobs = np.average([s[:,2] for s in statlist], weights = [np.full(statlist[0][:,2].shape, w) for w in regions['area'][np.array(["&" not in r for r in regions['identity']])]*np.array(tsurveylist)], axis=0)
+    # Create bins, the same for every region
+    flux_bins = np.geomspace(fl_min, fl_max, num=int(round((np.log10(fl_max)-np.log10(fl_min))/0.05)), endpoint=True)
+    dur_ints = np.geomspace(dmin, dmax, num=int(round((np.log10(dmax)-np.log10(dmin))/0.05)), endpoint=True)
+    regionseeds = regionsseed.spawn(len(regions))
+    # Plots are made in the background while the next region is simulated, except when only the numbers are wanted
+    plotpool = None if (config.no_plots or config.plot_workers < 1) else multiprocessing.Pool(config.plot_workers)
+    renders = []
+    # The single pointings come first, then the regions where they overlap. With --coverage pixels a pointing that the 
+    # others cover completely has no area, and so no transient rates, of its own
+    covered = regions['area'] == 0
+    for i in np.flatnonzero(covered):
+        print("Skipping region", regions['identity'][i], "as other pointings cover all of it")
+    simulated = np.flatnonzero(~covered)
+    statlist = [simulate_region(config, params, lightcurve, lightcurvetype, schedule, fake_obs, regions[i], regionseeds[i], dur_ints, flux_bins, maxmem, plotpool, renders) for i in simulated]
+    # The regions of pixel_regions are exclusive and together cover the union of the pointings, those of calculate_regions
+    # include their overlaps, so only the single pointings are combined
+    combine = simulated if config.coverage == 'pixels' else simulated[simulated < len(uniquepointFOV)]
+    if len(uniquepointFOV) > 1 and len(combine) > 0:
+        combinestats = [statlist[k] for k in np.searchsorted(simulated, combine)]
+        if config.adaptive_levels > 0: # every region is refined differently, so they are combined on the full grid
+            combinestats = [compute_lc.regrid_stats(s, dur_ints, flux_bins) for s in combinestats]
+        combinedstat, combinedarea = compute_lc.combine_regions(regions[combine], combinestats, schedule)
         combinedname = "combined"+regions['identity'][0]
         for i in range(1,len(uniquepointFOV)):
             combinedname += 'and'+str(regions['identity'][i])
-        combinedstat = np.copy(stats)
-        combinedstat[:,2] = combinedprobs
-        compute_lc.make_mpl_plots(combinedname,
+        render_plots(plotpool, renders, combinedname,
             fl_min,
             fl_max,
-            bursts['chardur'].min(),
-            bursts['chardur'].max(),
-            det_threshold,
-            extra_threshold,
-            obs,
+            dmin,
+            dmax,
+            float(params['INITIAL PARAMETERS']['det_threshold']),
+            float(params['INITIAL PARAMETERS']['extra_threshold']),
+            schedule,
             False,
             params['INITIAL PARAMETERS']['file'],
             float(params['INITIAL PARAMETERS']['flux_err']),
             combinedstat,
             2,
             lightcurve.lines,
-            np.sum(regions['area']),
-            obs['start'][-1] + obs['duration'][-1] - obs['start'][0],
-            detections,
-            confidence,
-            params['INITIAL PARAMETERS']['file'])
-    
-    leftoff=0
-    obsmaskmulti = np.zeros((len(obs),len(regions)-len(uniquepointFOV)), dtype=bool)                    
-    for i in range(len(uniquepointFOV)-1):
-        for j in range(i+1,len(uniquepointFOV)):
-            if str(i)+'&'+str(j) in regions['identity']:
-                obsmaskmulti[:,leftoff] = obsmask[:,i] | obsmask[:,j]
-                leftoff+=1
-    
-    for i in range(len(uniquepointFOV)-2):
-        for j in range(i+1,len(uniquepointFOV)-1):
-            for k in range(j+1,len(uniquepointFOV)):
-                if str(i)+'&'+str(j)+'&'+str(k) in regions['identity']:
-                    obsmaskmulti[:,leftoff] = obsmask[:,i] | obsmask[:,j] | obsmask[:,k]
-    
-    # overlaparray = np.array(len(overlapnums), dtype={'names': ('name', 'sources'), 'formats': ('str','f8')})
-    for i in range(len(uniquepointFOV),len(regions)):
-        # targetnum = int(np.around(float(params['INITIAL PARAMETERS']['n_sources'])*(regions['area'][i]/regions['area'][0]))*(regions['timespan'][i]/regions['timespan'][0]))
-        tsurvey = obs['start'][-1] + obs['duration'][-1] - obs['start'][0]
-        startepoch = regions['start'][i]
-        stopepoch = regions['stop'][i]
-    
-        # exit()
-        # def generate_sources(n_sources, file, start_time, end_time, fl_min, fl_max, dmin, dmax, dump_intermediate, lightcurve,gaussiancutoff):
-        targetnum = int(float(params['INITIAL PARAMETERS']['srcperbin'])) # Inner parenthesis is important for type conversion
-        # Create bins
-        flux_bins = np.geomspace(fl_min, fl_max, num=int(round((np.log10(fl_max)-np.log10(fl_min))/0.05)), endpoint=True)
-        dur_ints = np.geomspace(dmin, dmax, num=int(round((np.log10(dmax)-np.log10(dmin))/0.05)), endpoint=True)
-        durations = (dur_ints[:-1] + dur_ints[1:])/2
-        fluxes = (flux_bins[:-1] + flux_bins[1:])/2
-        stats = np.zeros(((len(flux_bins)-1)*(len(dur_ints)-1), 5), dtype=np.float32)
-        # iterate over bins
-        statcounter = 0
-        srcsimtime = 0
-        dettime = 0
-        stattime = 0
-        for ldurbin,rdurbin in tqdm(zip(dur_ints[:-1],dur_ints[1:]),total=len(dur_ints[:-1])):
-            thisdur = (ldurbin+rdurbin)/2
-            for lfluxbin,rfluxbin in zip(flux_bins[:-1],flux_bins[1:]):
-                t1 = datetime.datetime.now()
-                thisflux = (lfluxbin + rfluxbin)/2
-                bursts = compute_lc.generate_sources(targetnum, #n_sources
-                    startepoch, #start_survey
-                    stopepoch, #end_survey
-                    lfluxbin, #Flux min
-                    rfluxbin, #Flux max
-                    ldurbin, # duration min
-                    rdurbin,  #duration max
-                    lightcurvetype,
-                    burstlength,
-                    burstflux) # 
-    
-                bursts = compute_lc.generate_start(bursts, 
-                    lightcurve.earliest_crit_time(startepoch,bursts['chardur']), # earliest crit time
-                    lightcurve.latest_crit_time(stopepoch,bursts['chardur']),  # latest crit time
-                    targetnum)
-                t2 = datetime.datetime.now() 
-                srcsimtime+= (t2-t1).total_seconds()
-                if config.keep:
-                    with open(params['INITIAL PARAMETERS']['file'] + '_' + lightcurvetype + '_SimTrans', 'w') as f:
-                            f.write('# Tcrit\tcharacteristic\tPkFlux\n')        ## INITIALISE LIST OF SIMILATED TRANSIENTS
-                            write_source(params['INITIAL PARAMETERS']['file'] + '_' + lightcurvetype + '_SimTrans' , bursts) #file with starttime\tduration\tflux
-                            print("Written Simulated Sources")
-    
-                t1 = datetime.datetime.now() 
-                # det are the sources themselves while detbool is a numpy boolean array indexing all sources
-                det, detbool = compute_lc.detect_bursts(obs[obsmaskmulti[:,i-len(uniquepointFOV)]], 
-                    float(params['INITIAL PARAMETERS']['flux_err']), 
-                    float(params['INITIAL PARAMETERS']['det_threshold']) , 
-                    bursts, 
-                    lightcurve.fluxint)
-                t2 = datetime.datetime.now()
-                dettime += (t2-t1).total_seconds()
-                t1 = datetime.datetime.now() 
-                stats[statcounter,0] = thisdur 
-                stats[statcounter,1] = thisflux 
-                stats[statcounter,2] = np.nan_to_num(np.sum(detbool)/targetnum) # probability for this bin
-                statcounter+=1
-                
-                t2= datetime.datetime.now()
-                stattime += (t2-t1).total_seconds()
-              
-                
-        print(srcsimtime,"seconds simulating sources")
-        print(dettime, "seconds detecting sources")
-        print(stattime,"seconds aggregating stats")
-        totaltime = srcsimtime + dettime +stattime
-        print(100*srcsimtime/totaltime,"% of the time simulating sources")
-        print(100*dettime/totaltime, "% of the time detecting sources")
-        print(100*stattime/totaltime,"% of the time aggregating stats")
-        statlist.append(stats)
-        if not (np.isnan(burstlength) and np.isnan(burstflux)):
-            print("Percent detected:", np.sum(detbool)/targetnum)
-            print(np.sum(detbool))
-            gaptime = 0
-            for j in range(len(obs[obsmaskmulti[:,i-len(uniquepointFOV)]])):
-                if obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['gaps'][j]=='False':
-                    if j!=(len(obs[obsmaskmulti[:,i-len(uniquepointFOV)]])-1):
-                        gaptime += obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['start'][j+1] - (obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['start'][j] + obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['duration'][j])
-                else:
-                    subobs, _ = compute_lc.observing_strategy(obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['gaps'][j], float(params['INITIAL PARAMETERS']['det_threshold']), 1, 1, 1, 1, 1) # We are giving the scansfile name, so the other variables are unimportant, we set them to 1 
-                    for k in range(len(subobs)-1):
-                        gaptime += subobs['start'][k+1] - (subobs['start'][k] + subobs['duration'][k])
-                        if (k==len(subobs)-2) and (j!=len(obs[obsmaskmulti[:,i-len(uniquepointFOV)]])-1):
-                            gaptime += obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['start'][j+1] - (subobs['start'][k+1] + subobs['duration'][k+1])
-            print("Gap percentage:", gaptime/(obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['start'][-1] + obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['duration'][-1] - obs[obsmaskmulti[:,i-len(uniquepointFOV)]]['start'][0]))
-        else:
-            # We now repeat all of the steps from simulating the sources to gathering statistics, but this time we 
-            # use a single large value for transient duration and a single point in time for observations. We do this
-            # to help eliminate false detections due to variations in observation sensitivity. 
-    
-            fake_obs = np.copy(obs)
-            fake_obs['start'] = np.full(fake_obs['start'].shape, fake_obs['start'][0])
-            fake_obs['gaps'] = 'False'
-            tophatlc = tophat.tophat()
-            fdstats = np.zeros(((len(flux_bins)-1)*(len(dur_ints)-1), 5), dtype=np.float32)
-            # iterate over bins
-            statcounter = 0
-            detectedsources = np.zeros(len(flux_bins[:-1]),dtype=int)
-            for ldurbin,rdurbin in tqdm(zip(dur_ints[:-1],dur_ints[1:]),total=len(dur_ints[:-1])):
-                thisdur = (ldurbin+rdurbin)/2
-                for fluxind, (lfluxbin,rfluxbin) in enumerate(zip(flux_bins[:-1],flux_bins[1:])):
-                    thisflux = (lfluxbin + rfluxbin)/2
-                    fdbursts = compute_lc.generate_sources(targetnum, #n_sources
-                        startepoch, #start_survey
-                        stopepoch, #end_survey
-                        lfluxbin, #Flux min
-                        rfluxbin, #Flux max
-                        ldurbin, # duration min
-                        rdurbin,  #duration max
-                        "tophat",
-                        2*tsurvey,
-                        burstflux) # 
-                    fdbursts['chartime'] += fake_obs['start'][0]
-            
-    
-    
-                    # det are the sources themselves while detbool is a numpy boolean array indexing all sources
-                    fddet, fddetbool = compute_lc.detect_bursts(fake_obs[obsmaskmulti[:,i-len(uniquepointFOV)]], 
-                        float(params['INITIAL PARAMETERS']['flux_err']), 
-                        float(params['INITIAL PARAMETERS']['det_threshold']) , 
-                        fdbursts, 
-                        tophatlc.fluxint)
-                    detectedsources[fluxind] += np.sum(fddetbool)
-                    fdstats[statcounter,0] = thisdur 
-                    fdstats[statcounter,1] = thisflux 
-                    fdstats[statcounter,2] = np.nan_to_num(np.sum(fddetbool)/targetnum) # probability for this bin
-                    statcounter+=1
-            cdet = (detectedsources,flux_bins)
-    
-        compute_lc.make_mpl_plots(regions['identity'][i].replace('&', 'and'),
-            fl_min,
-            fl_max,
-            dmin,
-            dmax,
-            det_threshold,
-            extra_threshold,
-            current_obs,
-            cdet,
+            combinedarea,
+            schedule.durmax,
+            int(params['INITIAL PARAMETERS']['detections']),
+            float(params['INITIAL PARAMETERS']['confidence'])/100,
             params['INITIAL PARAMETERS']['file'],
-            float(params['INITIAL PARAMETERS']['flux_err']),
-            np.copy(stats),
-            2,
-            lightcurve.lines,
-            regions['area'][i],
-            tsurvey,
-            detections,
-            confidence,
-            params['INITIAL PARAMETERS']['file'])
+            resolution=config.plot_resolution,
+            plots=not config.no_plots)
     
+    if plotpool is not None:
+        plotpool.close()
+        for render in renders:
+            render.get() # wait for the plots, raising any error from making them
+        plotpool.join()
     end = datetime.datetime.now()
     print("total runtime: ", end - start)
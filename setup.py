@@ -12,6 +12,7 @@ setup(name="RaTS",
       scripts = glob.glob('scripts/*.py'),
       python_requires ='>3.6',
       install_requires = ["astropy","colorama","cycler","fonttools","kiwisolver","matplotlib","numpy","packaging","Pillow","pyerfa","pyparsing","python-dateutil","PyYAML","scipy","six","tqdm"],
+      extras_require = {"jit": ["numba"]},
       test_suite="tests")
 
 
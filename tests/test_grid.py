@@ -0,0 +1,120 @@
+import unittest
+from unittest import mock
+import numpy as np
+from RaTS import compute_lc
+from RaTS.lightcurves import load_lightcurve
+
+def trial_survey(nobs=10, seed=1):
+    """Observations of the trial mode of observing_strategy, weekly with sensitivities near 1e-4 Jy. Return them and their pointings"""
+
+    return compute_lc.observing_strategy(None, 5, nobs, 21.7e-6, 4.6e-6, 7, 0.009, rng=seed)
+
+class GridTest(unittest.TestCase):
+    """simulate_grid on a small grid of fred light curves that runs from never to always detected"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.obs, _ = trial_survey()
+        cls.lightcurve = load_lightcurve('fred')()
+        cls.dur_ints = np.geomspace(0.1, 100, 7)
+        cls.flux_bins = np.geomspace(2e-5, 2e-3, 7)
+
+    def simulate(self, targetnum=200, seed=1, **options):
+        obs = self.obs
+        return compute_lc.simulate_grid(obs, self.lightcurve, 'fred', obs['start'][0], obs['start'][-1] + obs['duration'][-1], self.dur_ints, self.flux_bins, targetnum, 0.1, 5, np.nan, np.nan, seed=seed, **options)
+
+    def test_workers_match_serial(self):
+        for engine in ('bins', 'unitflux', 'grid'):
+            serial = self.simulate(engine=engine)
+            parallel = self.simulate(engine=engine, workers=3)
+            np.testing.assert_array_equal(serial[0], parallel[0], err_msg=engine)
+            np.testing.assert_array_equal(serial[1], parallel[1], err_msg=engine)
+
+    def test_max_mem_matches_serial(self):
+        for engine in ('bins', 'grid'):
+            np.testing.assert_array_equal(self.simulate(engine=engine)[0], self.simulate(engine=engine, max_mem=4096)[0], err_msg=engine)
+
+    def test_chunksize_matches_full_row(self):
+        np.testing.assert_array_equal(self.simulate(engine='grid')[0], self.simulate(engine='grid', chunksize=37)[0])
+
+    def test_grid_blocks_match_any_split(self):
+        # blocks smaller than a duration row, so sources of several rows share a block and a row spans several blocks
+        with mock.patch.object(compute_lc, '_GRIDBLOCK', 500):
+            serial = self.simulate(engine='grid')
+            np.testing.assert_array_equal(serial[0], self.simulate(engine='grid', workers=3)[0])
+            np.testing.assert_array_equal(serial[0], self.simulate(engine='grid', chunksize=37)[0])
+        # the drawn durations and fluxes are binned, and every bin holds the 200 sources drawn for it
+        np.testing.assert_allclose((serial[0][:,2]*200).reshape(6, 6).sum(axis=0), serial[1], rtol=1e-5)
+
+    def test_spare_columns_only_hold_tolerance_results(self):
+        for engine in ('bins', 'unitflux', 'grid', 'analytic'):
+            np.testing.assert_array_equal(self.simulate(20, engine=engine, atol=1e-2)[0][:,3:], 0, err_msg=engine)
+        stats = self.simulate(engine='bins', tolerance=0.1, minsources=20)[0]
+        self.assertTrue(np.all(stats[:,3] >= 20) and np.all(stats[:,4] > 0))
+
+    def test_engines_agree_with_bins(self):
+        targetnum = 400
+        bins = self.simulate(targetnum, engine='bins')[0]
+        p = bins[:,2]
+        for engine, options in (('unitflux', {}), ('grid', {}), ('analytic', {'atol': 1e-2})):
+            other = self.simulate(targetnum, seed=2, engine=engine, **options)[0]
+            np.testing.assert_allclose(other[:,0:2], bins[:,0:2], err_msg=engine)
+            # five standard deviations of the difference of two binomial estimates, but at least a few sources
+            sigma = np.sqrt(2*np.maximum(p*(1 - p), 3/targetnum)/targetnum)
+            self.assertTrue(np.all(np.abs(other[:,2] - p) < 5*sigma), f"{engine} differs from bins by {np.max(np.abs(other[:,2] - p)/sigma):.1f} sigma")
+
+    def test_tolerance_reaches_halfwidth(self):
+        stats = self.simulate(engine='bins', tolerance=0.05, minsources=50, maxsources=5000)[0]
+        self.assertTrue(np.all((stats[:,4] <= 0.05) | (stats[:,3] >= 5000)))
+
+    def test_adaptive_cells(self):
+        serial = self.simulate(engine='bins', levels=1)
+        np.testing.assert_array_equal(serial[0], self.simulate(engine='bins', levels=1, workers=3)[0])
+        # every final cell sits at the geometric centre of whole bins of the grid
+        logd, logf = np.log10(self.dur_ints), np.log10(self.flux_bins)
+        centres = lambda edges: (edges[:,None] + edges[None,:])/2
+        for col, edges in ((0, logd), (1, logf)):
+            self.assertTrue(np.all(np.min(np.abs(np.log10(serial[0][:,col])[:,None] - centres(edges).ravel()), axis=1) < 1e-5))
+        self.assertLess(len(serial[0]), (len(self.dur_ints)-1)*(len(self.flux_bins)-1) + 1)
+
+class DetectionProbabilityTest(unittest.TestCase):
+    """detection_probability only works out the fluxes at which some observation is uncertain, so it is checked against
+    the normal CDF of every flux and observation"""
+
+    def test_matches_every_flux(self):
+        from scipy.special import ndtr
+        obs, _ = trial_survey(nobs=6)
+        segments = compute_lc.observation_segments(obs, 5)
+        rng = np.random.default_rng(1)
+        # sources seen in a few observations, in all of them and in none
+        unit = rng.uniform(0, 1, (40, len(segments)))*(rng.uniform(size=(40, len(segments))) < 0.4)
+        unit[:10] = rng.uniform(0.01, 1, (10, len(segments)))
+        unit[10] = 0
+        fluxes = rng.permutation(np.geomspace(1e-6, 1, 300))
+        probability = compute_lc.detection_probability(obs, segments, unit, fluxes, 0.1, 5)
+        with np.errstate(all='ignore'):
+            x = (fluxes*unit[:,:,None] - obs['sens'][:,None])/np.sqrt((fluxes*unit[:,:,None]*0.1)**2 + (unit[:,:,None]*obs['sens'][:,None]/5)**2)
+        detected = np.nan_to_num(ndtr(x))
+        np.testing.assert_allclose(probability, 1 - np.prod(1 - detected, axis=1) - np.prod(detected, axis=1), atol=1e-12)
+
+class BinomialHalfwidthTest(unittest.TestCase):
+
+    def test_wilson(self):
+        # Wilson score interval of 10 out of 100 at 95% is 0.0552 to 0.1744
+        self.assertAlmostEqual(compute_lc.binomial_halfwidth(10, 100), (0.174366 - 0.055229)/2, places=5)
+        # of 0 out of 20 is 0 to 0.1611
+        self.assertAlmostEqual(compute_lc.binomial_halfwidth(0, 20), 0.161125/2, places=5)
+
+    def test_clopper_pearson(self):
+        # Clopper-Pearson interval of 10 out of 100 at 95% is 0.0490 to 0.1762
+        self.assertAlmostEqual(compute_lc.binomial_halfwidth(10, 100, method='clopper-pearson'), (0.176223 - 0.049005)/2, places=5)
+        # of 0 out of 20 is 0 to 0.1684 and of 20 out of 20 is 0.8316 to 1
+        self.assertAlmostEqual(compute_lc.binomial_halfwidth(0, 20, method='clopper-pearson'), 0.168433/2, places=5)
+        self.assertAlmostEqual(compute_lc.binomial_halfwidth(20, 20, method='clopper-pearson'), 0.168433/2, places=5)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            compute_lc.binomial_halfwidth(1, 10, method='jeffreys')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import importlib.util
+import unittest
+import numpy as np
+from RaTS import compute_lc, jitkernels
+from RaTS.lightcurves import BUILTIN, load_lightcurve
+from tests.test_grid import trial_survey
+
+@unittest.skipIf(importlib.util.find_spec('numba') is None, "numba is not installed")
+class DetectionKernelTest(unittest.TestCase):
+
+    def test_kernel_matches_numpy(self):
+        obs, _ = trial_survey(nobs=20)
+        start, stop = obs['start'][0], obs['start'][-1] + obs['duration'][-1]
+        segments = compute_lc.observation_segments(obs, 5)
+        for name in BUILTIN:
+            lightcurve = load_lightcurve(name)()
+            if jitkernels.unavailable(lightcurve) is not None:
+                continue
+            kernel = jitkernels.detection_kernel(lightcurve)
+            rng = np.random.default_rng(3)
+            sources = compute_lc.generate_sources(20000, start, stop, 1e-5, 1e-2, 0.01, 100, name, np.nan, np.nan, rng=rng)
+            sources = compute_lc.generate_start(sources, lightcurve.earliest_crit_time(start, sources['chardur']), lightcurve.latest_crit_time(stop, sources['chardur']), len(sources), rng=rng)
+            # with a support only the observations the source can be on in are integrated, and the noise is drawn to match
+            for support in (None, getattr(lightcurve, 'support', None)):
+                _, expected = compute_lc.detect_bursts(obs, 0.1, 5, sources, lightcurve.fluxint, rng=7, segments=segments, support=support)
+                _, detected = compute_lc.detect_bursts(obs, 0.1, 5, sources, lightcurve.fluxint, rng=7, segments=segments, support=support, kernel=kernel)
+                self.assertGreater(np.sum(expected), 0, name)
+                np.testing.assert_array_equal(detected, expected, err_msg=f"{name} with support {support is not None}")
+
+    def test_grid_backends_match(self):
+        obs, _ = trial_survey()
+        lightcurve = load_lightcurve('ered')()
+        for engine in ('bins', 'grid'):
+            stats = [compute_lc.simulate_grid(obs, lightcurve, 'ered', obs['start'][0], obs['start'][-1] + obs['duration'][-1], np.geomspace(0.1, 100, 5), np.geomspace(2e-5, 2e-3, 5), 100, 0.1, 5, np.nan, np.nan, seed=4, engine=engine, backend=backend)[0] for backend in ('numpy', 'jit')]
+            np.testing.assert_array_equal(stats[0], stats[1], err_msg=engine)
+
+    def test_unavailable_without_scalar_fluxint(self):
+        self.assertIsNotNone(jitkernels.unavailable(load_lightcurve('sbpowerlaw')()))
+        with self.assertRaises(ValueError):
+            jitkernels.detection_kernel(load_lightcurve('sbpowerlaw')())
+
+if __name__ == '__main__':
+    unittest.main()
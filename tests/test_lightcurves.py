@@ -0,0 +1,74 @@
+import unittest
+import numpy as np
+from RaTS import compute_lc
+from RaTS.lightcurves import BUILTIN, load_lightcurve
+from RaTS.numericlc import numericlc
+from tests.test_grid import trial_survey
+
+class numericfred(numericlc):
+    """fred written only as its flux, to check the numerical integration against the closed form"""
+    edges = [1, 0]
+
+    def flux(self, t, F0, tcrit, tau):
+        with np.errstate(over='ignore'):
+            return np.where(t >= tcrit, F0*np.exp(-(t - tcrit)/tau), 0.)
+
+    def support(self, tcrit, tau):
+        return tcrit, tcrit + tau*np.log(1e15)
+
+class numericgaussian(numericlc):
+    """gaussian written only as its flux, without a support, so the whole of every observation is integrated"""
+
+    def flux(self, t, F0, tcrit, tau):
+        return F0*np.exp(-2*((t - tcrit)/tau)**2)
+
+class NumericTest(unittest.TestCase):
+
+    def sources(self, n=2000, seed=1):
+        rng = np.random.default_rng(seed)
+        tau = 10**rng.uniform(-2, 2, n)
+        tcrit = rng.uniform(-30, 30, n)
+        start = rng.uniform(-20, 20, n)
+        end = start + 10**rng.uniform(-3, 0.5, n)
+        return rng.uniform(1e-4, 1e-2, n), tcrit, tau, end, start
+
+    def test_fluxint_matches_closed_form(self):
+        F0, tcrit, tau, end, start = self.sources()
+        for numeric, closed in ((numericfred(), load_lightcurve('fred')()), (numericgaussian(), load_lightcurve('gaussian')())):
+            # the closed form fred is negative for observations before the burst, which the detection clips to zero
+            with np.errstate(all='ignore'):
+                expected = np.maximum(closed.fluxint(F0, tcrit, tau, end, start), 0)
+            np.testing.assert_allclose(numeric.fluxint(F0, tcrit, tau, end, start), expected, rtol=10*numeric.rtol, atol=1e-12*np.max(F0), err_msg=type(numeric).__name__)
+
+    def test_fluxint_broadcasts_sources_against_scans(self):
+        F0, tcrit, tau, end, start = self.sources(50)
+        lightcurve = numericfred()
+        grid = lightcurve.fluxint(F0[:,None], tcrit[:,None], tau[:,None], end[None,:], start[None,:])
+        self.assertEqual(grid.shape, (50, 50))
+        np.testing.assert_allclose(np.diag(grid), lightcurve.fluxint(F0, tcrit, tau, end, start))
+
+    def test_crit_times_from_support(self):
+        tau = np.array([0.1, 1., 10.])
+        fred = load_lightcurve('fred')()
+        np.testing.assert_allclose(numericfred().latest_crit_time(100., tau), fred.latest_crit_time(100., tau))
+        # without a support a transient counts as on for one duration after its critical time
+        np.testing.assert_allclose(numericgaussian().earliest_crit_time(100., tau), 100. - tau)
+
+class LinesTest(unittest.TestCase):
+
+    def test_plain_observations_match_schedule(self):
+        obs, pointFOV = trial_survey()
+        obs['start'][6:] += 20 # so that the largest gap is not the first
+        schedule = compute_lc.ObservationSchedule(obs, pointFOV)
+        self.assertEqual(compute_lc.largest_gap(obs), schedule.maxgap)
+        xs = np.linspace(-1, 2, 50)
+        ys = np.linspace(-5, -2, 50)
+        for name in BUILTIN:
+            lightcurve = load_lightcurve(name)()
+            plain = lightcurve.lines(xs, ys, schedule.durmax, schedule.max_distance, 0.1, obs)
+            scheduled = lightcurve.lines(xs, ys, schedule.durmax, schedule.max_distance, 0.1, schedule)
+            for a, b in zip(plain, scheduled):
+                np.testing.assert_array_equal(a, b, err_msg=name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import numpy as np
+from RaTS import compute_lc
+
+def survey(pointings, nobs=4):
+    """Weekly observations cycling through pointings, rows of ra, dec and field of view. Return the observations and their pointings"""
+
+    obs = np.zeros(nobs*len(pointings), dtype={'names': ('start', 'duration','sens','gaps'), 'formats': ('f8','f8','f8','<U128')})
+    obs['start'] = 58000 + 7*np.arange(len(obs))
+    obs['duration'] = 0.01
+    obs['sens'] = 1e-4
+    obs['gaps'] = 'False'
+    return obs, np.tile(pointings, (nobs, 1))
+
+def monte_carlo_areas(pointings, n=2000000, seed=1):
+    """Estimate the area in square degrees of the sky covered by exactly each set of pointings by sampling a cap around
+    all of them. Return dictionary of area by region identity, e.g. 0&2"""
+
+    pointings = np.unique(pointings, axis=0) # numbered like the regions
+    centre = np.mean(pointings[:,0:2], axis=0)
+    bigfov = 3*np.max(pointings[:,2]) + np.max(np.hypot(*(pointings[:,0:2] - centre).T))
+    points = compute_lc.sample_cap(n, centre[0], centre[1], bigfov, rng=seed)
+    inside = points @ compute_lc.unit_vectors(pointings[:,0], pointings[:,1]).T >= np.cos(np.radians(pointings[:,2]))
+    bigarea = 2*np.pi*(1 - np.cos(np.radians(bigfov)))*(180/np.pi)**2
+    codes, counts = np.unique(inside @ (1 << np.arange(len(pointings))), return_counts=True)
+    return {'&'.join(str(k) for k in range(len(pointings)) if code >> k & 1): count/n*bigarea for code, count in zip(codes, counts) if code}
+
+class PixelRegionsTest(unittest.TestCase):
+
+    def areas(self, pointings, **options):
+        obs, pointFOV = survey(pointings)
+        regions, _ = compute_lc.pixel_regions(pointFOV, obs, **options)
+        return dict(zip(regions['identity'], regions['area']))
+
+    def test_two_pointings_match_calculate_regions(self):
+        # calculate_regions' overlap of two caps is only exact for equal fields of view
+        pointings = np.array([[150., 2., 1.], [151.2, 2.3, 1.]])
+        obs, pointFOV = survey(pointings)
+        caps, _ = compute_lc.calculate_regions(pointFOV, obs)
+        caps = dict(zip(caps['identity'], caps['area']))
+        pixels = self.areas(pointings, pixels_per_fov=16384)
+        # calculate_regions gives the whole field of each pointing, pixel_regions only the part no other pointing covers
+        self.assertAlmostEqual(pixels['0&1']/caps['0&1'], 1, delta=0.01)
+        self.assertAlmostEqual((pixels['0'] + pixels['0&1'])/caps['0'], 1, delta=0.01)
+        self.assertAlmostEqual((pixels['1'] + pixels['0&1'])/caps['1'], 1, delta=0.01)
+
+    def test_two_pointings_match_monte_carlo(self):
+        pointings = np.array([[150., 2., 1.], [151.2, 2.3, 0.8]])
+        pixels = self.areas(pointings, pixels_per_fov=16384)
+        for identity, area in monte_carlo_areas(pointings).items():
+            self.assertAlmostEqual(pixels[identity], area, delta=0.01*area + 0.01, msg=identity)
+
+    def test_three_pointings_match_monte_carlo(self):
+        pointings = np.array([[30., -40., 1.], [31., -40.2, 0.9], [30.5, -39.4, 1.1]])
+        pixels = self.areas(pointings, pixels_per_fov=16384)
+        sampled = monte_carlo_areas(pointings)
+        self.assertEqual(set(pixels), set(sampled))
+        for identity, area in sampled.items():
+            # a few times the sampling error of two million points
+            self.assertAlmostEqual(pixels[identity], area, delta=0.01*area + 0.01, msg=identity)
+
+    def test_covered_pointing_has_no_area(self):
+        # pointing 1 lies inside pointing 0, so it keeps its row but has no sky of its own
+        pixels = self.areas(np.array([[150., 2., 1.], [150.1, 2., 0.3]]))
+        self.assertEqual(pixels['1'], 0)
+        self.assertGreater(pixels['0&1'], 0)
+
+    def test_combined_regions_cover_the_union(self):
+        pointings = np.array([[150., 2., 1.], [150.5, 2., 1.]])
+        obs, pointFOV = survey(pointings)
+        regions, _ = compute_lc.pixel_regions(pointFOV, obs, pixels_per_fov=16384)
+        schedule = compute_lc.ObservationSchedule(obs, pointFOV)
+        # a probability of 1 in the overlap and 0 elsewhere, so the combined probability is the overlap's share of the sky
+        statlist = [np.zeros((4, 5)) for _ in regions]
+        for stats, identity in zip(statlist, regions['identity']):
+            stats[:,2] = identity == '0&1'
+        combined, area = compute_lc.combine_regions(regions, statlist, schedule)
+        sampled = monte_carlo_areas(pointings)
+        self.assertAlmostEqual(area, sum(sampled.values()), delta=0.01*area)
+        spans = {identity: schedule.region(identity).durmax for identity in regions['identity']}
+        share = sampled['0&1']*spans['0&1']/sum(sampled[identity]*spans[identity] for identity in sampled)
+        np.testing.assert_allclose(combined[:,2], share, rtol=0.01)
+
+    def test_max_mem_does_not_change_regions(self):
+        pointings = np.array([[30., -40., 1.], [31., -40.2, 0.9], [30.5, -39.4, 1.1]])
+        self.assertEqual(self.areas(pointings), self.areas(pointings, max_mem=1<<16))
+
+if __name__ == '__main__':
+    unittest.main()